@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class CoreConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'core'
+
+    def ready(self):
+        # Register cache invalidation, seat accounting and roster signal handlers
+        from . import hints, listings, roomcache, roster, seats  # noqa: F401
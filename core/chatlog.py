@@ -0,0 +1,193 @@
+"""
+Write-behind persistence of chat messages.
+
+Consumers hand chat lines to a process-wide buffer instead of writing them on
+the hot path. The buffer is flushed with one bulk_create when it reaches
+BATCH_SIZE messages or FLUSH_INTERVAL seconds after the first pending one,
+and once more when the process exits. It never holds more than MAX_PENDING
+messages: a full buffer makes senders wait for a flush, and messages that
+still don't fit (e.g. the database is down) are dropped and counted.
+
+A message the database rejects, say because its session was deleted in the
+meantime, would fail every bulk insert it is part of. When a batch is
+rejected it is written one row at a time instead, and the rows that still
+fail are logged and dropped, so they can't hold up the rest.
+"""
+import asyncio
+import atexit
+import logging
+import time
+
+from channels.db import database_sync_to_async
+from django.conf import settings
+from django.db import DataError, IntegrityError, close_old_connections, transaction
+
+from .models import ChatMessage
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'BATCH_SIZE': 200,
+    'FLUSH_INTERVAL': 1.0,
+    'MAX_PENDING': 5000,
+}
+
+
+class ChatWriteBehind:
+    def __init__(self, batch_size, flush_interval, max_pending):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self._pending = []
+        self._timer = None
+        self._timer_loop = None
+        self._tasks = set()
+
+        self.flushes = 0
+        self.written = 0
+        self.dropped = 0
+        self.rejected = 0
+        self.failed_flushes = 0
+        self.last_flush_ms = 0.0
+        self.max_flush_ms = 0.0
+        self.total_flush_ms = 0.0
+
+    @property
+    def depth(self):
+        return len(self._pending)
+
+    def metrics(self):
+        return {
+            'queue_depth': self.depth,
+            'flushes': self.flushes,
+            'failed_flushes': self.failed_flushes,
+            'written': self.written,
+            'dropped': self.dropped,
+            'rejected': self.rejected,
+            'last_flush_ms': self.last_flush_ms,
+            'max_flush_ms': self.max_flush_ms,
+            'avg_flush_ms': self.total_flush_ms / self.flushes if self.flushes else 0.0,
+        }
+
+    async def add(self, **fields):
+        if len(self._pending) >= self.max_pending:
+            await self.flush()
+            if len(self._pending) >= self.max_pending:
+                self.dropped += 1
+                return
+
+        self._pending.append(ChatMessage(**fields))
+        if len(self._pending) >= self.batch_size:
+            self._spawn_flush()
+        else:
+            self._schedule()
+
+    def _schedule(self):
+        loop = asyncio.get_running_loop()
+        if self._timer is not None and self._timer_loop is loop:
+            return
+        self._timer_loop = loop
+        self._timer = loop.call_later(self.flush_interval, self._on_timer)
+
+    def _on_timer(self):
+        self._timer = None
+        self._spawn_flush()
+
+    def _spawn_flush(self):
+        task = asyncio.ensure_future(self.flush())
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def flush(self):
+        # Taking the batch is atomic on the event loop, so concurrent
+        # flushes just write disjoint batches.
+        batch, self._pending = self._pending, []
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if not batch:
+            return
+
+        start = time.perf_counter()
+        try:
+            rejected = await database_sync_to_async(self._write)(batch)
+        except Exception:
+            logger.exception('Failed to write %d chat messages', len(batch))
+            self.failed_flushes += 1
+            # Messages stored one by one before the failure keep their pk
+            self._requeue([message for message in batch if message.pk is None])
+            self._schedule()
+            return
+        self._record(batch, rejected, start)
+
+    def flush_sync(self):
+        """Write everything still pending; for use outside the event loop."""
+        batch, self._pending = self._pending, []
+        if not batch:
+            return
+        start = time.perf_counter()
+        close_old_connections()
+        rejected = self._write(batch)
+        self._record(batch, rejected, start)
+
+    def _write(self, batch):
+        """Insert a batch; returns the messages the database rejected."""
+        try:
+            with transaction.atomic():
+                ChatMessage.objects.bulk_create(batch, batch_size=self.batch_size)
+            return []
+        except Exception as exc:
+            # Rolled back, even if the insert already handed out pks
+            for message in batch:
+                message.pk = None
+            if not isinstance(exc, (DataError, IntegrityError)):
+                raise
+
+        rejected = []
+        for message in batch:
+            try:
+                with transaction.atomic():
+                    message.save(force_insert=True)
+            except (DataError, IntegrityError):
+                message.pk = None
+                rejected.append(message)
+        return rejected
+
+    def _requeue(self, batch):
+        pending = batch + self._pending
+        overflow = len(pending) - self.max_pending
+        if overflow > 0:
+            # Keep the newest messages
+            self.dropped += overflow
+            pending = pending[overflow:]
+        self._pending = pending
+
+    def _record(self, batch, rejected, start):
+        elapsed = (time.perf_counter() - start) * 1000
+        if rejected:
+            logger.warning('Dropped %d of %d chat messages rejected by the database (sessions %s)',
+                           len(rejected), len(batch), sorted({message.session_id for message in rejected}))
+            self.rejected += len(rejected)
+        self.flushes += 1
+        self.written += len(batch) - len(rejected)
+        self.last_flush_ms = elapsed
+        self.max_flush_ms = max(self.max_flush_ms, elapsed)
+        self.total_flush_ms += elapsed
+        logger.debug('Flushed %d chat messages in %.1f ms (queue depth %d)',
+                     len(batch), elapsed, self.depth)
+
+
+_config = {**DEFAULTS, **getattr(settings, 'CHAT_WRITE_BEHIND', {})}
+chat_writer = ChatWriteBehind(
+    batch_size=_config['BATCH_SIZE'],
+    flush_interval=_config['FLUSH_INTERVAL'],
+    max_pending=_config['MAX_PENDING'],
+)
+
+
+@atexit.register
+def _flush_at_exit():
+    try:
+        chat_writer.flush_sync()
+    except Exception:
+        logger.exception('Failed to flush chat messages on shutdown')
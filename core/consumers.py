@@ -1,173 +1,442 @@
+import asyncio
 import json
+import time
+from urllib.parse import parse_qsl
+
 from channels.generic.websocket import AsyncWebsocketConsumer
 from channels.db import database_sync_to_async
-from .models import CommandSuggestion, Session
+from django.utils import timezone
+from .models import Participant
+from . import eventlog, hints, history, metrics, roomcache, tokens, wire
+from .chatlog import chat_writer
+from .eventlog import room_events
+from .outbound import (
+    PRIORITY_BULK, PRIORITY_CONTROL, SEND_FAILED_CLOSE_CODE, SLOW_CLIENT_CLOSE_CODE, OutboundQueue,
+)
+from .presence import HEARTBEAT_INTERVAL, presence_registry
+from .realtime import LOBBY_GROUP, SESSION_SETTINGS_FIELDS, room_group_name, user_group_name
+from .rooms import registry
+from .roster import rosters
+from .seats import MEMBER_STATUSES, SEAT_STATUSES
+from .signaling import BATCH_WINDOW, SignalBatcher
+from .topology import relay_planner
+
+# Handshakes without a valid connect token for an accepted participant
+FORBIDDEN_CLOSE_CODE = 4003
+# Sockets of a participant the host kicked or rejected
+REMOVED_CLOSE_CODE = 4001
+
+
+def merge_presence(queued, update):
+    """Fold a presence diff into a presence frame still waiting to be sent."""
+    field = 'snapshot' if 'snapshot' in queued else 'changes'
+    return {**queued, field: {**queued[field], **update['changes']}}
+
 
 class SessionConsumer(AsyncWebsocketConsumer):
+    # Deliver targeted WebRTC signals straight to the target's channels
+    direct_signaling = True
+    # Seconds to collect signals per target before forwarding them as one
+    # frame, or None to forward each one as it arrives
+    signal_batch_window = BATCH_WINDOW
+
     async def connect(self):
         self.room_code = self.scope['url_route']['kwargs']['room_code']
-        self.room_group_name = f'session_{self.room_code}'
+        self.room_group_name = room_group_name(self.room_code)
+        params = dict(parse_qsl(self.scope.get('query_string', b'').decode('latin-1')))
+
+        # Checked before anything is set up or the group is joined, so
+        # strangers, pending and kicked users never see room traffic
+        self.identity = tokens.verify(params.get('token'), self.room_code)
+        member = await self.authorize() if self.identity else None
+        if member is None:
+            await self.close(code=FORBIDDEN_CLOSE_CODE)
+            return
+        self.user_id = self.identity.user_id
+        self.username = self.identity.username
+        self.participant_id = member['id']
+
+        self.codec, subprotocol = wire.negotiate(self.scope.get('subprotocols', ()))
+        wire.acquire(self.codec)
+        # Everything sent to the client goes through here, so a slow link
+        # backs up only its own queue
+        self.outbound = OutboundQueue(
+            self.send_frame, on_slow=self.close_slow, on_error=self.close_failed, encode=self.codec.dumps
+        )
+        self.signal_batcher = None
+        if self.signal_batch_window:
+            self.signal_batcher = SignalBatcher(self.signal_batch_window, self.forward_signals)
+
+        # Events numbered up to here were sent before this socket joined
+        self.room_log = room_events.get(self.room_code)
+        self.last_seq = self.room_log.head
 
         await self.channel_layer.group_add(
             self.room_group_name,
             self.channel_name
         )
+        registry.add(self.room_code, self.username, self.channel_name)
 
-        await self.accept()
+        # Loaded after joining the group so no settings push is missed;
+        # kept up to date by 'session_settings' events from the views.
+        self.room_settings = await self.load_session_settings()
+        self.session_id = self.room_settings.pop('id', None)
+        self.host_username = self.room_settings.pop('host__username', None)
+
+        members = await self.load_members()
+        # Built from the same rows by the room's first socket in this process;
+        # kept current by 'roster_change' events from then on
+        self.roster = rosters.build(self.room_code, [
+            (username, status, display_name, request_type)
+            for username, status, _, _, display_name, request_type in members
+        ])
+        presence_registry.connect(self.room_code, self.username, self.participant_id, self.channel_name)
+
+        await self.accept(subprotocol)
+        if metrics.ENABLED:
+            metrics.ws_connects.inc()
+
+        # Stored state from every worker, overlaid with this process's live view
+        snapshot = {
+            username: {'online': status == 'accepted' and channel is not None, 'quality': quality}
+            for username, status, quality, channel, _, _ in members
+            if status in MEMBER_STATUSES
+        }
+        snapshot.update(presence_registry.snapshot(self.room_code))
+        self.outbound.put(PRIORITY_CONTROL, {
+            'type': 'presence',
+            'snapshot': snapshot,
+            'heartbeat_interval': HEARTBEAT_INTERVAL
+        }, key='presence', merge=merge_presence)
+        self.outbound.put(PRIORITY_CONTROL, self.roster.snapshot())
+        self.resume(eventlog.parse_position(params.get('resume')))
+
+        if relay_planner is not None:
+            if self.identity.role == tokens.ROLE_HOST:
+                await self.send_relay_plans({
+                    self.username: relay_planner.host_plan(self.room_code, self.username)
+                })
+            else:
+                quality = next((q for username, _, q, *_ in members if username == self.username), 'high')
+                await self.send_relay_plans(
+                    relay_planner.join(self.room_code, self.host_username, self.username, quality)
+                )
 
     async def disconnect(self, close_code):
+        if getattr(self, 'signal_batcher', None):
+            await self.signal_batcher.flush()
+        if getattr(self, 'outbound', None):
+            self.outbound.close()
+            wire.release(self.codec)
+        if getattr(self, 'username', None):
+            registry.remove(self.room_code, self.username, self.channel_name)
+            if not registry.usernames(self.room_code):
+                room_events.release(self.room_code)
+                # Nothing here would keep it current any more
+                rosters.drop(self.room_code)
+        if getattr(self, 'participant_id', None):
+            presence_registry.disconnect(self.room_code, self.username, self.channel_name)
+            # Leaves the relay tree with the last of the user's sockets
+            if relay_planner is not None and not registry.channels(self.room_code, self.username):
+                await self.send_relay_plans(relay_planner.leave(self.room_code, self.username))
         await self.channel_layer.group_discard(
             self.room_group_name,
             self.channel_name
         )
 
-    async def receive(self, text_data):
-        text_data_json = json.loads(text_data)
+    async def receive(self, text_data=None, bytes_data=None):
+        if bytes_data is not None and self.codec.binary:
+            text_data_json = self.codec.loads(bytes_data)
+        else:
+            text_data_json = wire.JSON.loads(text_data if text_data is not None else bytes_data)
+        if not metrics.ENABLED:
+            return await self.handle_message(text_data_json)
+        start = time.perf_counter()
+        await self.handle_message(text_data_json)
+        message_type = text_data_json.get('type')
+        metrics.receive_seconds.observe(
+            time.perf_counter() - start, message_type if message_type in metrics.RECEIVE_TYPES else 'other'
+        )
+
+    async def handle_message(self, text_data_json):
         message_type = text_data_json.get('type')
         
         if message_type == 'chat_message':
             message = text_data_json.get('message')
-            sender = self.scope['user'].username
-            
-            # Save message to DB (optional)
+            sender = self.username
+
+            # Persisted in batches by the write-behind buffer
+            if self.session_id and message:
+                await chat_writer.add(
+                    session_id=self.session_id,
+                    sender_id=self.user_id,
+                    sender_name=sender,
+                    content=message,
+                    timestamp=timezone.now(),
+                )
+
             # Check for command suggestions if enabled by host
-            suggestion = await self.get_command_suggestion(message, self.room_code)
+            suggestion = await self.get_command_suggestion(message)
 
             await self.channel_layer.group_send(
                 self.room_group_name,
-                {
+                wire.frame_event('chat_message', {
                     'type': 'chat_message',
                     'message': message,
                     'sender': sender,
                     'suggestion': suggestion
-                }
+                })
             )
         
         elif message_type == 'signal':
             # Signaling for WebRTC (offer, answer, candidate)
             # We target a specific user if 'target' is present, otherwise broadcast (careful with broadcast)
             target = text_data_json.get('target')
-            sender = self.scope['user'].username
-            
-            payload = {
-                'type': 'signal',
-                'sender': sender,
-                'data': text_data_json.get('data'),
-                'target': target
-            }
-            
-            if target:
-                # Send to specific channel if we tracked it (need to store channel_names in DB or Redis)
-                # For simplicity in this demo without Redis channel layer specific addressing:
-                # We broadcast and let clients filter by 'target'
-                await self.channel_layer.group_send(
-                    self.room_group_name,
-                    payload
-                )
+            if self.signal_batcher is not None:
+                self.signal_batcher.add(target, text_data_json.get('data'))
             else:
-                await self.channel_layer.group_send(
-                    self.room_group_name,
-                    payload
-                )
+                await self.forward_signals(target, [text_data_json.get('data')])
 
         elif message_type == 'user_join':
              await self.channel_layer.group_send(
                 self.room_group_name,
-                {
+                wire.frame_event('user_join', {
                     'type': 'user_join',
-                    'username': self.scope['user'].username,
+                    'username': self.username,
                     'channel_name': self.channel_name # Useful if we want to target
-                }
+                })
             )
             
-        elif message_type == 'audio_message':
-             await self.channel_layer.group_send(
-                self.room_group_name,
-                {
-                    'type': 'audio_message',
-                    'content': text_data_json.get('content'),
-                    'sender': self.scope['user'].username
-                }
+        elif message_type == 'history':
+            # Replay older messages to this socket only
+            messages, next_cursor = await self.get_history(
+                text_data_json.get('before'), text_data_json.get('limit')
+            )
+            self.outbound.put(PRIORITY_BULK, {
+                'type': 'history',
+                'messages': messages,
+                'next_cursor': next_cursor
+            })
+
+        elif message_type == 'heartbeat':
+            presence_registry.heartbeat(
+                self.room_code, self.username, self.participant_id, self.channel_name,
+                text_data_json.get('quality')
             )
+            if relay_planner is not None and text_data_json.get('quality') in relay_planner.fanout:
+                await self.send_relay_plans(relay_planner.set_quality(
+                    self.room_code, self.username, text_data_json['quality']
+                ))
+            # Only the latest ack matters for measuring the round trip
+            # with a fresh connect token for reconnecting
+            self.outbound.put(PRIORITY_CONTROL, {
+                'type': 'heartbeat_ack',
+                'sent': text_data_json.get('sent'),
+                'token': tokens.issue(self.identity)
+            }, key='heartbeat_ack')
+
+        elif message_type == 'roster':
+            # The page missed a delta and starts over from the full roster
+            self.outbound.put(PRIORITY_CONTROL, self.roster.snapshot())
+
+    async def forward_signals(self, target, payloads):
+        sender = self.username
+        if len(payloads) == 1:
+            frame = {'type': 'signal', 'sender': sender, 'data': payloads[0]}
+        else:
+            frame = {'type': 'signal_batch', 'sender': sender, 'data': payloads}
+        event = wire.frame_event('signal', frame, sender=sender, target=target)
 
-        elif message_type == 'participant_update':
+        # Targets connected to this process get the signal on their own
+        # channels; anything else falls back to a room broadcast that the
+        # signal() handler filters by 'target'.
+        channels = ()
+        if target and self.direct_signaling:
+            channels = registry.channels(self.room_code, target)
+
+        if channels:
+            for channel in channels:
+                await self.channel_layer.send(channel, event)
+        else:
             await self.channel_layer.group_send(
                 self.room_group_name,
-                {
-                    'type': 'participant_update',
-                    'username': text_data_json.get('username'),
-                    'action': text_data_json.get('action'),
-                    'sender': self.scope['user'].username
-                }
+                event
             )
 
+    async def send_relay_plans(self, plans):
+        """Tell each peer in `plans` whom to pull the shared screen from and forward it to."""
+        for username, plan in plans.items():
+            event = wire.frame_event('relay_plan', {'type': 'relay_plan', **plan})
+            for channel in registry.channels(self.room_code, username):
+                await self.channel_layer.send(channel, event)
+
+    async def send_frame(self, data):
+        if isinstance(data, bytes):
+            await self.send(bytes_data=data)
+        else:
+            await self.send(text_data=data)
+
+    def close_slow(self):
+        asyncio.ensure_future(self.close(code=SLOW_CLIENT_CLOSE_CODE))
+
+    def close_failed(self):
+        asyncio.ensure_future(self.close(code=SEND_FAILED_CLOSE_CODE))
+
+    # Room events arrive with their frame already encoded by the sender
+
+    def resume(self, position):
+        """
+        Replay what a reconnecting page missed since `position` (epoch, seq),
+        or tell it to resync; a first connection just learns the position.
+        """
+        status, entries = 'fresh', []
+        if position is not None:
+            entries = room_events.resume(self.room_code, *position)
+            if entries is None:
+                status, entries = 'resync', []
+            else:
+                status, self.last_seq = 'resumed', position[1]
+        self.outbound.put(PRIORITY_CONTROL, {
+            'type': 'resume',
+            'status': status,
+            'epoch': self.room_log.epoch,
+            'seq': self.last_seq
+        })
+        for entry in entries:
+            self.put_sequenced(entry)
+
+    def put_sequenced(self, entry):
+        # Skips events already replayed to this socket
+        if entry.seq > self.last_seq:
+            self.last_seq = entry.seq
+            # The control lane is FIFO and never drops a frame, so the page
+            # sees every sequenced event in order and its last seq is safe
+            # to resume from; a backlog too long for it closes the socket
+            self.outbound.put(PRIORITY_CONTROL, entry.frame(self.codec))
+
     async def chat_message(self, event):
-        await self.send(text_data=json.dumps({
-            'type': 'chat_message',
-            'message': event['message'],
-            'sender': event['sender'],
-            'suggestion': event.get('suggestion')
-        }))
+        self.put_sequenced(self.room_log.record(event))
 
     async def audio_message(self, event):
-        await self.send(text_data=json.dumps({
-            'type': 'audio_message',
-            'content': event['content'],
-            'sender': event['sender']
-        }))
+        # Clips are uploaded over HTTP; only their metadata goes over the socket
+        self.put_sequenced(self.room_log.record(event))
 
     async def signal(self, event):
         # Only send if I am the target or if it's broadcast (and I'm not the sender)
-        if event.get('target') and event['target'] != self.scope['user'].username:
+        if event.get('target') and event['target'] != self.username:
             return
-        if event['sender'] == self.scope['user'].username:
+        if event['sender'] == self.username:
             return
             
-        await self.send(text_data=json.dumps({
-            'type': 'signal',
-            'sender': event['sender'],
-            'data': event['data']
-        }))
+        self.outbound.put(PRIORITY_CONTROL, wire.encoded(event, self.codec))
+
+    async def relay_plan(self, event):
+        self.outbound.put(PRIORITY_CONTROL, wire.encoded(event, self.codec))
 
     async def user_join(self, event):
-        await self.send(text_data=json.dumps({
-            'type': 'user_join',
-            'username': event['username'],
-            'channel_name': event.get('channel_name')
-        }))
+        self.put_sequenced(self.room_log.record(event))
 
-    async def participant_update(self, event):
-        await self.send(text_data=json.dumps({
-            'type': 'participant_update',
-            'username': event['username'],
-            'action': event['action'],
-            'sender': event['sender']
-        }))
+    async def roster_change(self, event):
+        delta = self.roster.apply(event)
+        if delta is not None:
+            self.outbound.put(PRIORITY_CONTROL, wire.encoded(delta, self.codec))
 
+    async def presence(self, event):
+        # Diffs still queued are merged rather than sent one after another
+        self.outbound.put(PRIORITY_CONTROL, {
+            'type': 'presence',
+            'changes': event['changes']
+        }, key='presence', merge=merge_presence)
 
+    async def evict(self, event):
+        if event['username'] != self.username:
+            return
+        # Out of the group first, and nothing still queued goes out
+        await self.channel_layer.group_discard(self.room_group_name, self.channel_name)
+        self.outbound.close()
+        await self.close(code=REMOVED_CLOSE_CODE)
+
+    async def session_settings(self, event):
+        self.room_settings.update(event['settings'])
 
     @database_sync_to_async
-    def get_command_suggestion(self, text, room_code):
+    def load_session_settings(self):
+        session = roomcache.get_session(self.room_code)
+        if session is None:
+            return {}
+        return {field: session[field] for field in ('id', 'host__username', *SESSION_SETTINGS_FIELDS)}
+
+    @database_sync_to_async
+    def authorize(self):
+        """
+        The connecting user's participant id and status if they may join the
+        room, else None. Read from the database, never the cache: a kick
+        must shut the door on every worker at once.
+        """
+        return Participant.objects.filter(
+            session_id=self.identity.session_id, session__room_code=self.room_code, session__is_active=True,
+            user_id=self.identity.user_id, status__in=MEMBER_STATUSES
+        ).values('id', 'status').first()
+
+    @database_sync_to_async
+    def load_members(self):
+        """
+        The stored (username, status, quality, channel_name, display_name,
+        request_type) of everyone holding a seat.
+        """
+        return list(Participant.objects.filter(
+            session_id=self.session_id, status__in=SEAT_STATUSES, user__isnull=False
+        ).values_list('user__username', 'status', 'connection_quality', 'channel_name', 'display_name',
+                      'request_type'))
+
+    @database_sync_to_async
+    def get_history(self, cursor, limit):
+        if not self.session_id or (cursor and history.decode_cursor(cursor) is None):
+            return [], None
         try:
-            session = Session.objects.get(room_code=room_code)
-            if not session.is_suggestions_enabled:
-                return None
-        except Session.DoesNotExist:
+            limit = min(max(int(limit or history.DEFAULT_PAGE_SIZE), 1), history.MAX_PAGE_SIZE)
+        except (ValueError, TypeError):
+            limit = history.DEFAULT_PAGE_SIZE
+        return history.history_page(self.session_id, cursor, limit)
+
+    async def get_command_suggestion(self, text):
+        if not self.room_settings.get('is_suggestions_enabled'):
             return None
+        start = time.perf_counter()
+        fuzzy = self.room_settings.get('is_fuzzy_hints_enabled', False)
+        # Matching is in memory; only (re)building a matcher needs the thread pool
+        built, suggestion = hints.suggest_from_memory(text, fuzzy=fuzzy)
+        if not built:
+            suggestion = await database_sync_to_async(hints.suggest)(text, fuzzy=fuzzy)
+        if metrics.ENABLED:
+            metrics.suggest_seconds.observe(time.perf_counter() - start)
+        return suggestion
 
-        # Simple keyword matching with word boundary check
-        import re
-        suggestions = CommandSuggestion.objects.all()
-        text = text.lower()
-        
-        for s in suggestions:
-            # Match keyword as a whole word (case insensitive)
-            pattern = r'\b' + re.escape(s.keyword.lower()) + r'\b'
-            if re.search(pattern, text):
-                return f"Tip: {s.suggestion} - {s.description}"
-        
-        # Hardcoded fallback for common terms if DB is missing some
-        if re.search(r'\btaskbar\b', text):
-            return "Tip: Win+T to focus taskbar."
-            
-        return None
+
+class NotificationConsumer(AsyncWebsocketConsumer):
+    """
+    Per-user push channel for invitations, join requests, request status
+    changes and session listing updates, so pages don't have to poll.
+    """
+
+    async def connect(self):
+        user = self.scope['user']
+        if not user.is_authenticated:
+            await self.close()
+            return
+
+        self.groups_joined = [user_group_name(user.id), LOBBY_GROUP]
+        for group in self.groups_joined:
+            await self.channel_layer.group_add(group, self.channel_name)
+
+        await self.accept()
+
+    async def disconnect(self, close_code):
+        for group in getattr(self, 'groups_joined', []):
+            await self.channel_layer.group_discard(group, self.channel_name)
+
+    async def notify(self, event):
+        await self.send(text_data=json.dumps({
+            'type': event['event'],
+            **event['data']
+        }))
@@ -0,0 +1,171 @@
+"""
+Sequenced room events, so a reconnecting socket can catch up.
+
+Room events a page would otherwise miss while its socket is down (chat, audio
+messages and joins) are numbered and kept in a bounded ring buffer per room.
+The roster needs no replay, since a reconnecting page gets a fresh snapshot.
+The first consumer in a process to receive an event records it. The others
+find it by the event_id that wire.frame_event() gives every event, so each
+event is numbered once per process. Group messages reach every channel of a
+process in the same order, so all sockets see the same numbers. The
+sequenced frame is built once per event and codec and shared by every
+socket, and goes out on the control lane of its outbound queue, which keeps
+order and never drops a frame.
+
+A reconnecting page names the log (its epoch) and the last sequence number it
+saw. It gets the events it missed, or 'resync' when the log is a different
+one (another worker, or a restart) or the gap is older than the buffer.
+
+Events are only recorded while some socket of the room is open in this
+process. Once the last one closes, anything sent to the room goes unseen.
+Sockets that reconnect after that can't be shown to have missed nothing,
+and are told to resync too.
+
+Logs are kept per process, like presence, and dropped RETAIN seconds after
+the last socket in the room closes here.
+"""
+import asyncio
+import itertools
+import uuid
+from collections import deque
+
+from django.conf import settings
+
+from . import wire
+
+DEFAULTS = {
+    # Events kept per room for resuming
+    'CAPACITY': 500,
+    # Seconds a log outlives the room's last socket in this process
+    'RETAIN': 120,
+}
+
+_config = {**DEFAULTS, **getattr(settings, 'ROOM_EVENTS', {})}
+_totals = {'recorded': 0, 'resumed': 0, 'replayed': 0, 'resyncs': 0}
+
+_epochs = itertools.count(1)
+
+
+class Entry:
+    __slots__ = ('seq', 'event', '_frames')
+
+    def __init__(self, seq, event):
+        self.seq = seq
+        self.event = event
+        self._frames = {}
+
+    def frame(self, codec):
+        """The event's frame with its 'seq', encoded for `codec`."""
+        data = self._frames.get(codec.name)
+        if data is None:
+            text = self.event['encoded']['json']
+            if codec is wire.JSON:
+                # Spliced into the sender's encoding rather than re-encoded
+                data = f'{{"seq":{self.seq},{text[1:]}'
+            else:
+                data = codec.dumps({'seq': self.seq, **wire.JSON.loads(text)})
+            self._frames[codec.name] = data
+        return data
+
+
+class RoomLog:
+    def __init__(self, capacity):
+        # Unique per log: a different epoch means the numbers don't carry over
+        self.epoch = f'{uuid.uuid4().hex[:8]}{next(_epochs)}'
+        self.head = 0
+        # Positions up to here may predate a time nobody here was listening
+        self.covered_after = -1
+        self.listening = True
+        self._entries = deque(maxlen=capacity)
+        self._by_id = {}
+
+    def record(self, event):
+        """The entry for `event`, numbering it if no socket here has yet."""
+        event_id = event['event_id']
+        entry = self._by_id.get(event_id)
+        if entry is None:
+            if len(self._entries) == self._entries.maxlen:
+                del self._by_id[self._entries[0].event['event_id']]
+            self.head += 1
+            entry = self._by_id[event_id] = Entry(self.head, event)
+            self._entries.append(entry)
+            _totals['recorded'] += 1
+        return entry
+
+    def since(self, seq):
+        """
+        Entries after `seq`, or None if some of them are no longer kept or
+        may never have been recorded.
+        """
+        if seq > self.head or seq <= self.covered_after:
+            return None
+        oldest = self._entries[0].seq if self._entries else self.head + 1
+        if seq + 1 < oldest:
+            return None
+        return [entry for entry in self._entries if entry.seq > seq]
+
+
+class RoomEventLogs:
+    def __init__(self, capacity, retain):
+        self.capacity = capacity
+        self.retain = retain
+        self._logs = {}
+        self._expiry = {}
+
+    def get(self, room_code):
+        timer = self._expiry.pop(room_code, None)
+        if timer is not None:
+            timer.cancel()
+        log = self._logs.get(room_code)
+        if log is None:
+            log = self._logs[room_code] = RoomLog(self.capacity)
+        elif not log.listening:
+            # Whatever was sent while nobody here listened is not in the log
+            log.covered_after = log.head
+            log.listening = True
+        return log
+
+    def release(self, room_code):
+        """The room's last socket here closed; keep the log RETAIN seconds for reconnects."""
+        if room_code not in self._logs or room_code in self._expiry:
+            return
+        self._logs[room_code].listening = False
+        self._expiry[room_code] = asyncio.get_running_loop().call_later(self.retain, self._drop, room_code)
+
+    def _drop(self, room_code):
+        self._expiry.pop(room_code, None)
+        self._logs.pop(room_code, None)
+
+    def resume(self, room_code, epoch, seq):
+        """Entries a socket that saw `seq` of log `epoch` missed, or None to resync."""
+        log = self.get(room_code)
+        entries = log.since(seq) if epoch == log.epoch else None
+        if entries is None:
+            _totals['resyncs'] += 1
+        else:
+            _totals['resumed'] += 1
+            _totals['replayed'] += len(entries)
+        return entries
+
+    def metrics(self):
+        return {
+            'rooms': len(self._logs),
+            'events': sum(len(log._entries) for log in self._logs.values()),
+            **_totals,
+        }
+
+
+room_events = RoomEventLogs(_config['CAPACITY'], _config['RETAIN'])
+
+
+def metrics():
+    return room_events.metrics()
+
+
+def parse_position(value):
+    """(epoch, seq) from a client's 'epoch:seq', or None."""
+    epoch, _, seq = (value or '').partition(':')
+    try:
+        return (epoch, int(seq)) if epoch else None
+    except ValueError:
+        return None
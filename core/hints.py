@@ -0,0 +1,353 @@
+"""
+Command hint matching.
+
+The whole CommandSuggestion catalog is compiled once into an Aho-Corasick
+automaton and kept in process memory, so matching a chat line costs one pass
+over the text no matter how many keywords exist. The automaton is dropped
+whenever a CommandSuggestion row is saved or deleted in this process, and
+in any case HINT_CATALOG_SECONDS after it was built, so changes made by
+another worker, the admin or populate_suggestions show up within that time.
+It is rebuilt lazily on the next lookup; until then, suggest_from_memory()
+answers without touching the database.
+
+Typo-tolerant lookups use a SymSpell-style deletion dictionary built from the
+same catalog, so a lookup only touches keywords that share a deletion variant
+with the text instead of scanning the catalog. They are off unless the host
+turns them on for the session. Keywords under 5 letters must match exactly,
+and a typo never changes the first letter, which keeps ordinary words one
+edit away from a keyword ("taste" and "paste") apart.
+"""
+import re
+import threading
+import time
+
+from django.conf import settings
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import CommandSuggestion
+
+# Hardcoded fallback for common terms if DB is missing some
+FALLBACK_HINTS = [
+    ('taskbar', "Tip: Win+T to focus taskbar."),
+]
+
+
+def _is_word_char(ch):
+    # Same notion of "word character" as \w / \b in the re module
+    return ch.isalnum() or ch == '_'
+
+
+def _at_boundary(text, pos):
+    before = pos > 0 and _is_word_char(text[pos - 1])
+    after = pos < len(text) and _is_word_char(text[pos])
+    return before != after
+
+
+def format_hint(suggestion, description):
+    return f"Tip: {suggestion} - {description}"
+
+
+class HintMatcher:
+    """
+    Multi-keyword matcher with the same results as checking each keyword
+    in catalog order with r'\\b<keyword>\\b': the hint returned is the one
+    whose keyword comes first in the catalog, not the one found first in
+    the text.
+    """
+
+    def __init__(self, entries, fallback=FALLBACK_HINTS):
+        # entries: iterable of (keyword, hint) in catalog order
+        self.hints = []
+        self._goto = [{}]
+        self._fail = [0]
+        self._out = [None]      # (keyword length, catalog index) ending here
+        self._link = [0]        # next state on the fail chain with an output
+
+        for keyword, hint in entries:
+            keyword = keyword.lower()
+            index = len(self.hints)
+            self.hints.append(hint)
+            if not keyword:
+                continue
+            state = 0
+            for ch in keyword:
+                nxt = self._goto[state].get(ch)
+                if nxt is None:
+                    nxt = len(self._goto)
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._out.append(None)
+                    self._link.append(0)
+                    self._goto[state][ch] = nxt
+                state = nxt
+            # Keywords are unique, but keep the earliest one just in case
+            if self._out[state] is None:
+                self._out[state] = (len(keyword), index)
+
+        self._build_links()
+        self._fallback = [
+            (re.compile(r'\b' + re.escape(word) + r'\b'), hint)
+            for word, hint in fallback
+        ]
+
+    def _build_links(self):
+        goto, fail, out, link = self._goto, self._fail, self._out, self._link
+        queue = list(goto[0].values())
+        head = 0
+        while head < len(queue):
+            state = queue[head]
+            head += 1
+            for ch, nxt in goto[state].items():
+                queue.append(nxt)
+                f = fail[state]
+                while f and ch not in goto[f]:
+                    f = fail[f]
+                f = goto[f].get(ch, 0)
+                fail[nxt] = f
+                link[nxt] = f if out[f] is not None else link[f]
+
+    def __len__(self):
+        return len(self.hints)
+
+    def match(self, text):
+        if not text:
+            return None
+        text = text.lower()
+        goto, fail, out, link = self._goto, self._fail, self._out, self._link
+
+        best = None
+        state = 0
+        for pos, ch in enumerate(text):
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+
+            found = state if out[state] is not None else link[state]
+            while found:
+                length, index = out[found]
+                if best is None or index < best:
+                    end = pos + 1
+                    if _at_boundary(text, end) and _at_boundary(text, end - length):
+                        best = index
+                found = link[found]
+            if best == 0:
+                break
+
+        if best is not None:
+            return self.hints[best]
+
+        for pattern, hint in self._fallback:
+            if pattern.search(text):
+                return hint
+        return None
+
+
+def _words(text):
+    return re.findall(r'\w+', text.lower())
+
+
+def _deletes(word, distance):
+    """All strings reachable from word by removing up to `distance` chars."""
+    found = {word}
+    frontier = [word]
+    for _ in range(distance):
+        nxt = []
+        for w in frontier:
+            for i in range(len(w)):
+                variant = w[:i] + w[i + 1:]
+                if variant not in found:
+                    found.add(variant)
+                    nxt.append(variant)
+        frontier = nxt
+    return found
+
+
+def edit_distance(a, b, limit):
+    """
+    Optimal string alignment distance (Levenshtein plus adjacent
+    transpositions), or limit + 1 as soon as it is known to exceed limit.
+    """
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    prev2 = None
+    prev = list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        cur = [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            cost = 0 if a[i - 1] == b[j - 1] else 1
+            cur[j] = min(prev[j] + 1, cur[j - 1] + 1, prev[j - 1] + cost)
+            if (prev2 is not None and i > 1 and j > 1
+                    and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]):
+                cur[j] = min(cur[j], prev2[j - 2] + 1)
+        if min(cur) > limit:
+            return limit + 1
+        prev2, prev = prev, cur
+    return prev[-1]
+
+
+def typo_budget(length, max_distance):
+    """Edits allowed for a keyword of this length; short ones must match exactly."""
+    if length < 5:
+        return 0
+    if length < 9:
+        return min(1, max_distance)
+    return max_distance
+
+
+class FuzzyHintIndex:
+    """
+    Typo-tolerant keyword lookup over a deletion dictionary.
+
+    Multi-word keywords are indexed as whole phrases and compared against
+    runs of the same number of words in the message. A phrase only matches a
+    keyword with the same first letter. When several keywords are close
+    enough, the smallest edit distance wins, then catalog order.
+    """
+
+    def __init__(self, entries, max_distance=2):
+        self.max_distance = max_distance
+        self.hints = []
+        self.keywords = []
+        self.max_words = 0
+        self.max_length = 0
+        self._index = {}
+
+        for keyword, hint in entries:
+            phrase = ' '.join(_words(keyword))
+            index = len(self.hints)
+            self.hints.append(hint)
+            self.keywords.append(phrase)
+            if not phrase:
+                continue
+            self.max_words = max(self.max_words, phrase.count(' ') + 1)
+            self.max_length = max(self.max_length, len(phrase))
+            for variant in _deletes(phrase, typo_budget(len(phrase), max_distance)):
+                self._index.setdefault(variant, []).append(index)
+
+    def __len__(self):
+        return len(self.hints)
+
+    def match(self, text):
+        if not text or not self._index:
+            return None
+        words = _words(text)
+        limit = self.max_length + self.max_distance
+
+        best = None
+        seen = set()
+        for start in range(len(words)):
+            for end in range(start + 1, min(start + self.max_words, len(words)) + 1):
+                phrase = ' '.join(words[start:end])
+                if len(phrase) > limit:
+                    break
+                if phrase in seen:
+                    continue
+                seen.add(phrase)
+
+                # The longest keyword this phrase could match sets the depth
+                reach = typo_budget(len(phrase) + self.max_distance, self.max_distance)
+                for variant in _deletes(phrase, reach):
+                    for index in self._index.get(variant, ()):
+                        keyword = self.keywords[index]
+                        if keyword[0] != phrase[0]:
+                            continue
+                        budget = typo_budget(len(keyword), self.max_distance)
+                        distance = edit_distance(phrase, keyword, budget)
+                        if distance <= budget and (best is None or (distance, index) < best):
+                            best = (distance, index)
+                            if best == (0, 0):
+                                return self.hints[0]
+
+        return self.hints[best[1]] if best else None
+
+
+# (matcher, monotonic time it expires)
+_matcher = None
+_fuzzy = None
+_lock = threading.Lock()
+
+
+def _current(built):
+    if built is not None and time.monotonic() < built[1]:
+        return built[0]
+    return None
+
+
+def _expiry():
+    return time.monotonic() + getattr(settings, 'HINT_CATALOG_SECONDS', 30)
+
+
+def _catalog():
+    rows = CommandSuggestion.objects.order_by('id').values_list(
+        'keyword', 'suggestion', 'description'
+    )
+    return [
+        (keyword, format_hint(suggestion, description))
+        for keyword, suggestion, description in rows
+    ]
+
+
+def get_matcher():
+    """Return the compiled matcher, building it from the DB if needed."""
+    global _matcher
+    matcher = _current(_matcher)
+    if matcher is None:
+        with _lock:
+            matcher = _current(_matcher)
+            if matcher is None:
+                matcher = HintMatcher(_catalog())
+                _matcher = (matcher, _expiry())
+    return matcher
+
+
+def get_fuzzy_index():
+    """Return the typo-tolerant index, building it from the DB if needed."""
+    global _fuzzy
+    index = _current(_fuzzy)
+    if index is None:
+        with _lock:
+            index = _current(_fuzzy)
+            if index is None:
+                max_distance = getattr(settings, 'HINT_FUZZY_MAX_DISTANCE', 2)
+                index = FuzzyHintIndex(_catalog(), max_distance)
+                _fuzzy = (index, _expiry())
+    return index
+
+
+def suggest(text, fuzzy=False):
+    """Exact keyword hint first, then a typo-tolerant one if allowed."""
+    hint = get_matcher().match(text)
+    if hint is None and fuzzy:
+        hint = get_fuzzy_index().match(text)
+    return hint
+
+
+def suggest_from_memory(text, fuzzy=False):
+    """
+    suggest() from what is already built, without touching the database:
+    (True, hint), or (False, None) when a matcher has to be (re)built first.
+    """
+    matcher = _current(_matcher)
+    if matcher is None:
+        return False, None
+    hint = matcher.match(text)
+    if hint is None and fuzzy:
+        index = _current(_fuzzy)
+        if index is None:
+            return False, None
+        hint = index.match(text)
+    return True, hint
+
+
+def invalidate():
+    global _matcher, _fuzzy
+    with _lock:
+        _matcher = None
+        _fuzzy = None
+
+
+@receiver(post_save, sender=CommandSuggestion)
+@receiver(post_delete, sender=CommandSuggestion)
+def _catalog_changed(sender, **kwargs):
+    invalidate()
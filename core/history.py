@@ -0,0 +1,93 @@
+"""
+Chat history pages for a session, newest first, merging ChatMessage and
+AudioMessage rows.
+
+Pages are fetched with keyset pagination over the (session, timestamp)
+indexes, so an old page costs the same as the latest one. The cursor is the
+(timestamp, kind, id) of the oldest entry already returned.
+"""
+import base64
+from datetime import datetime
+
+from django.db.models import Q
+from django.urls import reverse
+
+from .models import AudioMessage, ChatMessage
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+# Tie-break order between kinds for entries with identical timestamps
+KIND_RANK = {'chat': 0, 'audio': 1}
+
+
+def encode_cursor(entry):
+    raw = f"{entry['timestamp'].isoformat()}|{entry['kind']}|{entry['id']}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_cursor(cursor):
+    """Return (timestamp, kind, id) or None if the cursor is malformed."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor.encode()).decode()
+        timestamp, kind, entry_id = raw.split('|')
+        if kind not in KIND_RANK:
+            return None
+        return datetime.fromisoformat(timestamp), kind, int(entry_id)
+    except (ValueError, UnicodeError):
+        return None
+
+
+def _older_than(position, kind):
+    """Keyset filter selecting rows of `kind` that sort before `position`."""
+    timestamp, cursor_kind, cursor_id = position
+    rank, cursor_rank = KIND_RANK[kind], KIND_RANK[cursor_kind]
+    if rank < cursor_rank:
+        return Q(timestamp__lte=timestamp)
+    if rank > cursor_rank:
+        return Q(timestamp__lt=timestamp)
+    # The redundant upper bound lets the planner seek into the index
+    # instead of filtering every row of the session.
+    return Q(timestamp__lte=timestamp) & (Q(timestamp__lt=timestamp) | Q(id__lt=cursor_id))
+
+
+def _fetch(model, kind, fields, session_id, position, limit):
+    rows = model.objects.filter(session_id=session_id)
+    if position is not None:
+        rows = rows.filter(_older_than(position, kind))
+    rows = rows.order_by('-timestamp', '-id').values('id', 'sender_name', 'timestamp', *fields)[:limit + 1]
+    for row in rows:
+        row['kind'] = kind
+        yield row
+
+
+def history_page(session_id, cursor=None, limit=DEFAULT_PAGE_SIZE):
+    """
+    Return (entries, next_cursor): up to `limit` entries older than `cursor`
+    in chronological order, and the cursor for the page before them.
+    """
+    position = decode_cursor(cursor) if cursor else None
+    entries = list(_fetch(ChatMessage, 'chat', ('content',), session_id, position, limit))
+    entries += _fetch(AudioMessage, 'audio', ('duration',), session_id, position, limit)
+    entries.sort(key=lambda e: (e['timestamp'], KIND_RANK[e['kind']], e['id']), reverse=True)
+
+    next_cursor = None
+    if len(entries) > limit:
+        entries = entries[:limit]
+        next_cursor = encode_cursor(entries[-1])
+
+    messages = []
+    for entry in reversed(entries):
+        message = {
+            'kind': entry['kind'],
+            'id': entry['id'],
+            'sender': entry['sender_name'],
+            'timestamp': entry['timestamp'].isoformat(),
+        }
+        if entry['kind'] == 'chat':
+            message['message'] = entry['content']
+        else:
+            message['url'] = reverse('audio_message_file', args=[entry['id']])
+            message['duration'] = entry['duration']
+        messages.append(message)
+    return messages, next_cursor
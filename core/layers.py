@@ -0,0 +1,501 @@
+"""
+Channel layer shared by several worker processes on one host, without a broker.
+
+Every process binds a Unix domain socket in a common directory and treats the
+other sockets there as its peers. Names handed out by new_channel() embed the
+owning process's node id, so send() goes straight to that process. Group
+membership is held by the process that owns each channel: group_send()
+delivers to local members and forwards the message once to every peer, which
+delivers it to its own members. A message is packed with msgpack once per
+send, however many channels receive it.
+
+Sends to another process are fire-and-forget: when the target channel is full
+there, or the peer cannot keep up, the message is dropped and counted in
+`dropped`, as group_send() already does for full channels. Channel names
+without a "!" are not routed between processes. flush() only clears the
+calling process.
+
+    CHANNEL_LAYERS = {
+        "default": {
+            "BACKEND": "core.layers.UnixSocketChannelLayer",
+            "CONFIG": {"path": "/run/screendial/channels"},
+        }
+    }
+"""
+import asyncio
+import atexit
+import logging
+import os
+import random
+import string
+import threading
+import time
+import uuid
+from collections import defaultdict, deque
+from pathlib import Path
+
+import msgpack
+from channels.exceptions import ChannelFull
+from channels.layers import BaseChannelLayer
+
+logger = logging.getLogger(__name__)
+
+# Frame kinds exchanged between processes: [kind, name, payload]
+SEND, GROUP_SEND, GROUP_ADD, GROUP_DISCARD, HELLO = range(5)
+
+# A socket file that refuses connections for this long belongs to a dead process
+STALE_SOCKET_SECONDS = 10
+
+
+def pack(obj):
+    return msgpack.packb(obj, use_bin_type=True)
+
+
+def unpack(data):
+    return msgpack.unpackb(data, raw=False)
+
+
+def _resolve(waiter):
+    if not waiter.done():
+        waiter.set_result(None)
+
+
+def _wake(waiter):
+    """Resolve a receive() future from whichever thread delivered the message."""
+    loop = waiter.get_loop()
+    try:
+        current = asyncio.get_running_loop()
+    except RuntimeError:
+        current = None
+    if current is loop:
+        _resolve(waiter)
+    elif not loop.is_closed():
+        loop.call_soon_threadsafe(_resolve, waiter)
+
+
+class _Inbox:
+    """Queued messages and waiting receivers of one local channel."""
+
+    __slots__ = ('messages', 'waiters')
+
+    def __init__(self):
+        self.messages = deque()  # (expires_at, packed message)
+        self.waiters = deque()
+
+
+class _FrameProtocol(asyncio.Protocol):
+    def __init__(self, node, peer_id=None):
+        self.node = node
+        self.peer_id = peer_id
+        self.unpacker = msgpack.Unpacker(raw=False)
+        self.transport = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+        self.node.connections.add(self)
+
+    def data_received(self, data):
+        self.unpacker.feed(data)
+        for kind, name, payload in self.unpacker:
+            self.node.dispatch(kind, name, payload)
+
+    def connection_lost(self, exc):
+        self.node.connections.discard(self)
+        if self.peer_id is not None:
+            self.node.forget(self.peer_id, self)
+
+
+class _Peer:
+    __slots__ = ('node_id', 'protocol', 'pending')
+
+    def __init__(self, node_id):
+        self.node_id = node_id
+        self.protocol = None
+        self.pending = []  # frames written before the connection is up
+
+
+class _Node:
+    """
+    This process's socket server and its connections to the peers, driven by
+    a private event loop thread so any caller's loop (or none) can use it.
+    """
+
+    def __init__(self, layer):
+        self.layer = layer
+        self.pid = os.getpid()
+        self.node_id = uuid.uuid4().hex[:16]
+        self.directory = Path(layer.path)
+        self.path = self.directory / f'{self.node_id}.sock'
+        self.peers = {}
+        self.connections = set()
+        self.loop = asyncio.new_event_loop()
+        self.server = None
+
+        self._outbox = []
+        self._outbox_lock = threading.Lock()
+        self._flush_scheduled = False
+
+        started = threading.Event()
+        self.thread = threading.Thread(
+            target=self._run, args=(started,), name=f'channel-layer-{self.node_id}', daemon=True
+        )
+        self.thread.start()
+        started.wait()
+        if self.server is None:
+            raise RuntimeError(f'Could not bind channel layer socket {self.path}')
+        atexit.register(self.close)
+
+    def _run(self, started):
+        asyncio.set_event_loop(self.loop)
+        try:
+            self.loop.run_until_complete(self._start())
+        except Exception:
+            logger.exception('Channel layer node failed to start')
+            started.set()
+            return
+        started.set()
+        self.loop.run_forever()
+        self.loop.close()
+
+    async def _start(self):
+        self.directory.mkdir(mode=0o700, parents=True, exist_ok=True)
+        self.server = await self.loop.create_unix_server(lambda: _FrameProtocol(self), str(self.path))
+        self._discover()
+
+    def close(self):
+        try:
+            self.path.unlink()
+        except OSError:
+            pass
+        if not self.thread.is_alive():
+            return
+        asyncio.run_coroutine_threadsafe(self._stop(), self.loop)
+        if threading.current_thread() is not self.thread:
+            self.thread.join(timeout=5)
+
+    async def _stop(self):
+        self.server.close()
+        for protocol in list(self.connections):
+            protocol.transport.close()
+        # Let the transports release their sockets before the loop stops
+        await asyncio.sleep(0)
+        self.loop.stop()
+
+    # Called from any thread
+
+    def submit(self, node_id, frame):
+        """Queue a frame for one peer, or for every peer if node_id is None."""
+        with self._outbox_lock:
+            self._outbox.append((node_id, frame))
+            if self._flush_scheduled:
+                return
+            self._flush_scheduled = True
+        self.loop.call_soon_threadsafe(self._flush_outbox)
+
+    # Called on the node's loop
+
+    def _flush_outbox(self):
+        with self._outbox_lock:
+            items, self._outbox = self._outbox, []
+            self._flush_scheduled = False
+
+        # One write per peer for everything queued since the last flush
+        chunks = defaultdict(list)
+        for node_id, frame in items:
+            if node_id is None:
+                for peer_id in self.peers:
+                    chunks[peer_id].append(frame)
+            else:
+                if node_id not in self.peers and not self._connect(node_id):
+                    self.layer.dropped += 1
+                    continue
+                chunks[node_id].append(frame)
+
+        for node_id, frames in chunks.items():
+            peer = self.peers.get(node_id)
+            if peer is None:
+                self.layer.dropped += len(frames)
+            elif peer.protocol is None:
+                peer.pending.extend(frames)
+            elif peer.protocol.transport.get_write_buffer_size() > self.layer.max_buffer:
+                self.layer.dropped += len(frames)
+            else:
+                peer.protocol.transport.write(b''.join(frames))
+
+    def _discover(self):
+        for path in self.directory.glob('*.sock'):
+            if path.stem != self.node_id and path.stem not in self.peers:
+                self._connect(path.stem)
+        self.loop.call_later(self.layer.discovery_interval, self._discover)
+
+    def _connect(self, node_id):
+        path = self.directory / f'{node_id}.sock'
+        if not path.exists():
+            return False
+        peer = self.peers[node_id] = _Peer(node_id)
+        self.loop.create_task(self._open(peer, path))
+        return True
+
+    async def _open(self, peer, path):
+        try:
+            _, protocol = await self.loop.create_unix_connection(
+                lambda: _FrameProtocol(self, peer.node_id), str(path)
+            )
+        except OSError as exc:
+            self.forget(peer.node_id)
+            self.layer.dropped += len(peer.pending)
+            if isinstance(exc, ConnectionRefusedError):
+                self._remove_stale(path)
+            return
+        if self.peers.get(peer.node_id) is not peer:
+            protocol.transport.close()
+            return
+        protocol.transport.write(pack([HELLO, self.node_id, None]) + b''.join(peer.pending))
+        peer.pending = []
+        peer.protocol = protocol
+
+    def _remove_stale(self, path):
+        try:
+            if time.time() - path.stat().st_mtime > STALE_SOCKET_SECONDS:
+                path.unlink()
+        except OSError:
+            pass
+
+    def forget(self, node_id, protocol=None):
+        peer = self.peers.get(node_id)
+        if peer is not None and (protocol is None or peer.protocol is protocol):
+            del self.peers[node_id]
+
+    def dispatch(self, kind, name, payload):
+        layer = self.layer
+        if kind == SEND:
+            if not layer._deliver(name, payload):
+                layer.dropped += 1
+        elif kind == GROUP_SEND:
+            layer._deliver_group(name, payload)
+        elif kind == GROUP_ADD:
+            layer._add_member(name, payload)
+        elif kind == GROUP_DISCARD:
+            layer._discard_member(name, payload)
+        elif kind == HELLO:
+            # A new process announced itself; open our side so it gets broadcasts
+            if name not in self.peers:
+                self._connect(name)
+
+
+class UnixSocketChannelLayer(BaseChannelLayer):
+    """
+    Channel layer for worker processes on one host that share `path`.
+    """
+
+    extensions = ['groups', 'flush']
+
+    def __init__(
+        self,
+        path='/tmp/screendial-channels',
+        expiry=60,
+        group_expiry=86400,
+        capacity=100,
+        channel_capacity=None,
+        max_buffer=16 * 1024 * 1024,
+        discovery_interval=1.0,
+        **kwargs,
+    ):
+        super().__init__(expiry=expiry, capacity=capacity, channel_capacity=channel_capacity, **kwargs)
+        self.path = path
+        self.group_expiry = group_expiry
+        self.max_buffer = max_buffer
+        self.discovery_interval = discovery_interval
+        self.dropped = 0
+
+        self._lock = threading.Lock()
+        self._inboxes = {}
+        self._groups = {}
+        self._node = None
+        self._node_lock = threading.Lock()
+        self._last_cleanup = 0.0
+
+    @property
+    def node(self):
+        node = self._node
+        if node is None or node.pid != os.getpid():
+            with self._node_lock:
+                if self._node is None or self._node.pid != os.getpid():
+                    # A forked worker must not inherit its parent's queues
+                    self._inboxes, self._groups = {}, {}
+                    self._node = _Node(self)
+                node = self._node
+        return node
+
+    def metrics(self):
+        """Depth of this process's inboxes and messages dropped on full channels."""
+        with self._lock:
+            depths = [len(inbox.messages) for inbox in self._inboxes.values()]
+        return {
+            'channels': len(depths),
+            'queued': sum(depths),
+            'max_depth': max(depths, default=0),
+            'dropped': self.dropped,
+        }
+
+    def _owner(self, channel):
+        """Node id of the process that receives on `channel`."""
+        if '!' not in channel:
+            return self.node.node_id
+        return channel[:channel.index('!')].rsplit('.', 1)[-1]
+
+    # Channel layer API
+
+    async def send(self, channel, message):
+        assert isinstance(message, dict), 'message is not a dict'
+        self.require_valid_channel_name(channel)
+        assert '__asgi_channel__' not in message
+
+        payload = pack(message)
+        owner = self._owner(channel)
+        if owner == self.node.node_id:
+            if not self._deliver(channel, payload):
+                raise ChannelFull(channel)
+        else:
+            self.node.submit(owner, pack([SEND, channel, payload]))
+
+    async def receive(self, channel):
+        self.require_valid_channel_name(channel)
+        loop = asyncio.get_running_loop()
+        while True:
+            with self._lock:
+                inbox = self._inboxes.setdefault(channel, _Inbox())
+                self._expire(channel, inbox)
+                if inbox.messages:
+                    _, payload = inbox.messages.popleft()
+                    if not inbox.messages and not inbox.waiters:
+                        del self._inboxes[channel]
+                    return unpack(payload)
+                waiter = loop.create_future()
+                inbox.waiters.append(waiter)
+            try:
+                await waiter
+            except BaseException:
+                with self._lock:
+                    if waiter in inbox.waiters:
+                        inbox.waiters.remove(waiter)
+                    elif inbox.messages and inbox.waiters:
+                        # Pass on the wakeup this receiver was given
+                        _wake(inbox.waiters.popleft())
+                    if not inbox.messages and not inbox.waiters:
+                        self._inboxes.pop(channel, None)
+                raise
+
+    async def new_channel(self, prefix='specific.'):
+        return '%s.%s!%s' % (
+            prefix,
+            self.node.node_id,
+            ''.join(random.choice(string.ascii_letters) for i in range(12)),
+        )
+
+    # Groups extension
+
+    async def group_add(self, group, channel):
+        self.require_valid_group_name(group)
+        self.require_valid_channel_name(channel)
+        owner = self._owner(channel)
+        if owner == self.node.node_id:
+            self._add_member(group, channel)
+        else:
+            self.node.submit(owner, pack([GROUP_ADD, group, channel]))
+
+    async def group_discard(self, group, channel):
+        self.require_valid_channel_name(channel)
+        self.require_valid_group_name(group)
+        owner = self._owner(channel)
+        if owner == self.node.node_id:
+            self._discard_member(group, channel)
+        else:
+            self.node.submit(owner, pack([GROUP_DISCARD, group, channel]))
+
+    async def group_send(self, group, message):
+        assert isinstance(message, dict), 'Message is not a dict'
+        self.require_valid_group_name(group)
+
+        payload = pack(message)
+        self._deliver_group(group, payload)
+        self.node.submit(None, pack([GROUP_SEND, group, payload]))
+
+    # Flush extension
+
+    async def flush(self):
+        with self._lock:
+            self._inboxes = {}
+            self._groups = {}
+
+    async def close(self):
+        if self._node is not None and self._node.pid == os.getpid():
+            self._node.close()
+            self._node = None
+
+    # Local delivery; called from callers' loops and the node thread
+
+    def _deliver(self, channel, payload):
+        """Queue a packed message on a local channel; False if it is full."""
+        with self._lock:
+            inbox = self._inboxes.get(channel)
+            if inbox is None:
+                inbox = self._inboxes[channel] = _Inbox()
+            if len(inbox.messages) >= self.get_capacity(channel):
+                return False
+            inbox.messages.append((time.time() + self.expiry, payload))
+            if inbox.waiters:
+                _wake(inbox.waiters.popleft())
+        return True
+
+    def _deliver_group(self, group, payload):
+        self._clean_expired()
+        with self._lock:
+            members = list(self._groups.get(group, ()))
+        for channel in members:
+            # Like InMemoryChannelLayer, full members just miss the message
+            self._deliver(channel, payload)
+
+    def _add_member(self, group, channel):
+        with self._lock:
+            self._groups.setdefault(group, {})[channel] = time.time()
+
+    def _discard_member(self, group, channel):
+        with self._lock:
+            members = self._groups.get(group)
+            if members:
+                members.pop(channel, None)
+                if not members:
+                    del self._groups[group]
+
+    # Expiry
+
+    def _expire(self, channel, inbox):
+        """Drop expired messages of one channel; caller holds the lock."""
+        now = time.time()
+        while inbox.messages and inbox.messages[0][0] < now:
+            inbox.messages.popleft()
+            # A channel that lets messages expire is gone; leave its groups
+            for members in self._groups.values():
+                members.pop(channel, None)
+
+    def _clean_expired(self):
+        # At most once a second, so group_send stays cheap with many channels
+        now = time.time()
+        if now - self._last_cleanup < 1:
+            return
+        self._last_cleanup = now
+
+        with self._lock:
+            for channel, inbox in list(self._inboxes.items()):
+                self._expire(channel, inbox)
+                if not inbox.messages and not inbox.waiters:
+                    del self._inboxes[channel]
+
+            timeout = now - self.group_expiry
+            for group, members in list(self._groups.items()):
+                for channel, joined in list(members.items()):
+                    if joined < timeout:
+                        del members[channel]
+                if not members:
+                    del self._groups[group]
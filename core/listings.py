@@ -0,0 +1,120 @@
+"""
+Shared, cached listing of discoverable sessions.
+
+The listing is the same for every user, so pages are built with a single
+annotated query, cached for a few seconds under a version number, and the
+version is bumped whenever a Session or Participant is saved or deleted, so
+participant counts follow accepts, kicks and leaves. Pages use keyset
+pagination on (created_at, id), newest first. Each user's own and joined
+sessions are left out of their page by visible_page(), which reads on into
+the next shared pages until it has a full one.
+"""
+import base64
+from datetime import datetime
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, Q
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import Participant, Session
+from .seats import MEMBER_STATUSES
+
+VERSION_KEY = 'available_sessions:version'
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 50
+
+
+def encode_cursor(created_at, session_id):
+    raw = f'{created_at.isoformat()}|{session_id}'
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_cursor(cursor):
+    """Return (created_at, id) or None if the cursor is malformed."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor.encode()).decode()
+        created_at, session_id = raw.split('|')
+        return datetime.fromisoformat(created_at), int(session_id)
+    except (ValueError, UnicodeError):
+        return None
+
+
+def _version():
+    return cache.get_or_set(VERSION_KEY, 1, None)
+
+
+def invalidate():
+    try:
+        cache.incr(VERSION_KEY)
+    except ValueError:
+        cache.set(VERSION_KEY, 1, None)
+
+
+def _fetch_page(position, limit):
+    sessions = Session.objects.filter(is_active=True, is_discoverable=True)
+    if position is not None:
+        created_at, session_id = position
+        sessions = sessions.filter(
+            Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=session_id)
+        )
+    rows = list(
+        sessions.annotate(
+            participant_count=Count('participants', filter=Q(participants__status__in=MEMBER_STATUSES))
+        ).values(
+            'id', 'room_code', 'host_id', 'host__username', 'max_participants',
+            'created_at', 'participant_count'
+        ).order_by('-created_at', '-id')[:limit + 1]
+    )
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1]['created_at'], rows[-1]['id'])
+    return rows, next_cursor
+
+
+def available_sessions_page(cursor=None, limit=DEFAULT_PAGE_SIZE):
+    """
+    Return (rows, next_cursor) for one page of the shared listing.
+    Rows are shared between users and must not be mutated.
+    """
+    position = decode_cursor(cursor) if cursor else None
+    key = f'available_sessions:{_version()}:{cursor or ""}:{limit}'
+    page = cache.get(key)
+    if page is None:
+        page = _fetch_page(position, limit)
+        cache.set(key, page, getattr(settings, 'AVAILABLE_SESSIONS_CACHE_SECONDS', 10))
+    return page
+
+
+def visible_page(cursor, limit, hidden, expect_hidden=0):
+    """
+    (rows, next_cursor) for a page of `limit` rows the predicate `hidden`
+    does not reject, read from as many shared pages as it takes. Shared pages
+    are read `expect_hidden` rows longer (up to MAX_PAGE_SIZE), so a user
+    whose own sessions are on the page usually needs just one.
+    """
+    fetch = max(limit, min(limit + expect_hidden, MAX_PAGE_SIZE))
+    rows = []
+    while True:
+        page, next_cursor = available_sessions_page(cursor, fetch)
+        for n, row in enumerate(page, 1):
+            if hidden(row):
+                continue
+            rows.append(row)
+            if len(rows) == limit:
+                if n == len(page) and next_cursor is None:
+                    return rows, None
+                return rows, encode_cursor(row['created_at'], row['id'])
+        if next_cursor is None:
+            return rows, None
+        cursor = next_cursor
+
+
+@receiver(post_save, sender=Session)
+@receiver(post_delete, sender=Session)
+@receiver(post_save, sender=Participant)
+@receiver(post_delete, sender=Participant)
+def _session_changed(sender, **kwargs):
+    invalidate()
@@ -0,0 +1,65 @@
+"""Shared helpers for the bench_* management commands."""
+from contextlib import contextmanager
+
+from channels.layers import DEFAULT_CHANNEL_LAYER, InMemoryChannelLayer, channel_layers
+from django.db import connection
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+from core import tokens
+
+
+def percentile(ordered, p):
+    """The value at fraction `p` of an already sorted list, or 0.0 if it is empty."""
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p))] if ordered else 0.0
+
+
+def session_path(session, user):
+    """The session WebSocket URL with a connect token for `user`."""
+    return f'/ws/session/{session.room_code}/?token={tokens.issue_for(session, user)}'
+
+
+async def drain(sockets):
+    """Discard frames already sent to `sockets`, such as relay plans from joining."""
+    for socket in sockets:
+        while not await socket.receive_nothing():
+            await socket.receive_from()
+
+
+@contextmanager
+def test_database(verbosity=0):
+    """Run the benchmark against a throwaway test database, like the test runner does."""
+    setup_test_environment()
+    old_name = connection.settings_dict['NAME']
+    connection.creation.create_test_db(verbosity=verbosity, autoclobber=True)
+    try:
+        yield
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity)
+        teardown_test_environment()
+
+
+class CountingChannelLayer(InMemoryChannelLayer):
+    """In-memory layer that counts every message put on a channel."""
+
+    def __init__(self, **kwargs):
+        kwargs.setdefault('capacity', 10000)
+        super().__init__(**kwargs)
+        self.deliveries = 0
+
+    async def send(self, channel, message):
+        self.deliveries += 1
+        await super().send(channel, message)
+
+
+@contextmanager
+def counting_channel_layer():
+    previous = channel_layers.backends.get(DEFAULT_CHANNEL_LAYER)
+    layer = CountingChannelLayer()
+    channel_layers.set(DEFAULT_CHANNEL_LAYER, layer)
+    try:
+        yield layer
+    finally:
+        if previous is None:
+            channel_layers.backends.pop(DEFAULT_CHANNEL_LAYER, None)
+        else:
+            channel_layers.set(DEFAULT_CHANNEL_LAYER, previous)
@@ -0,0 +1,155 @@
+import asyncio
+import multiprocessing
+import shutil
+import tempfile
+import time
+
+from channels.layers import InMemoryChannelLayer
+from django.core.management.base import BaseCommand
+
+from core.layers import UnixSocketChannelLayer
+
+from ._bench import percentile
+
+GROUP = 'bench'
+SAMPLES_PER_WORKER = 5000
+
+
+async def run_worker(layer, index, workers, consumers, messages, ready):
+    """
+    One worker's share of a room: it hosts consumers/workers channels in the
+    group and sends messages/workers group messages. Returns delivery count,
+    start and end times and a sample of fan-out latencies in seconds.
+    """
+    local = consumers // workers + (index < consumers % workers)
+    sends = messages // workers + (index < messages % workers)
+    expected = messages * local
+    channels = [await layer.new_channel() for _ in range(local)]
+    for channel in channels:
+        await layer.group_add(GROUP, channel)
+
+    latencies = []
+    done = asyncio.Event()
+    received = 0
+
+    async def consume(channel):
+        nonlocal received
+        while True:
+            message = await layer.receive(channel)
+            latencies.append(time.monotonic() - message['sent'])
+            received += 1
+            if received == expected:
+                done.set()
+
+    tasks = [asyncio.ensure_future(consume(channel)) for channel in channels]
+    await ready()
+    start = time.monotonic()
+    for i in range(sends):
+        await layer.group_send(GROUP, {'type': 'bench', 'sent': time.monotonic(), 'n': i})
+        await asyncio.sleep(0)
+    if expected:
+        try:
+            await asyncio.wait_for(done.wait(), 60)
+        except asyncio.TimeoutError:
+            pass
+    end = time.monotonic()
+    for task in tasks:
+        task.cancel()
+
+    step = max(1, len(latencies) // SAMPLES_PER_WORKER)
+    return received, start, end, latencies[::step]
+
+
+def process_worker(path, index, workers, consumers, messages, barrier, results):
+    async def main():
+        layer = UnixSocketChannelLayer(path=path, capacity=messages + 1)
+
+        async def ready():
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(None, barrier.wait)
+            # Let late starters' announcements reach every peer
+            await asyncio.sleep(0.5)
+            await loop.run_in_executor(None, barrier.wait)
+
+        results.put(await run_worker(layer, index, workers, consumers, messages, ready))
+        await layer.close()
+
+    asyncio.run(main())
+
+
+def run_unix_socket(workers, consumers, messages):
+    context = multiprocessing.get_context('spawn')
+    path = tempfile.mkdtemp(prefix='bench-channels-')
+    barrier = context.Barrier(workers)
+    results = context.Queue()
+    processes = [
+        context.Process(target=process_worker,
+                        args=(path, i, workers, consumers, messages, barrier, results))
+        for i in range(workers)
+    ]
+    try:
+        for process in processes:
+            process.start()
+        outcomes = [results.get(timeout=120) for _ in processes]
+        for process in processes:
+            process.join()
+    finally:
+        shutil.rmtree(path, ignore_errors=True)
+    return outcomes
+
+
+def run_in_memory(workers, consumers, messages):
+    """The same load with every worker as a task sharing one in-memory layer."""
+    async def main():
+        layer = InMemoryChannelLayer(capacity=messages + 1)
+        barrier = asyncio.Barrier(workers)
+
+        async def ready():
+            await barrier.wait()
+
+        return await asyncio.gather(*(
+            run_worker(layer, i, workers, consumers, messages, ready) for i in range(workers)
+        ))
+
+    return asyncio.run(main())
+
+
+def summarize(outcomes, expected):
+    received = sum(o[0] for o in outcomes)
+    elapsed = max(o[2] for o in outcomes) - min(o[1] for o in outcomes)
+    latencies = sorted(sample for o in outcomes for sample in o[3])
+
+    return {
+        'received': received,
+        'lost': expected - received,
+        'per_second': received / elapsed if elapsed else 0.0,
+        'p50': percentile(latencies, 0.5) * 1e3,
+        'p99': percentile(latencies, 0.99) * 1e3,
+    }
+
+
+class Command(BaseCommand):
+    help = 'Compare group fan-out throughput and latency of the in-memory and Unix socket channel layers'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', default='1,2,4,8',
+                            help='Comma separated worker counts')
+        parser.add_argument('--consumers', type=int, default=64,
+                            help='Channels in the group, spread over the workers')
+        parser.add_argument('--messages', type=int, default=1000,
+                            help='Group messages, sent from all workers in turn')
+
+    def handle(self, *args, **options):
+        consumers, messages = options['consumers'], options['messages']
+        expected = consumers * messages
+        self.stdout.write(f'{messages} group messages to {consumers} channels ({expected} deliveries)\n')
+        self.stdout.write(
+            f"{'layer':>12} {'workers':>8} {'deliveries/s':>13} {'p50 ms':>8} {'p99 ms':>8} {'lost':>6}"
+        )
+        for workers in [int(w) for w in options['workers'].split(',')]:
+            for name, run in (('in-memory', run_in_memory), ('unix-socket', run_unix_socket)):
+                stats = summarize(run(workers, consumers, messages), expected)
+                self.stdout.write(
+                    f"{name:>12} {workers:>8} {stats['per_second']:>13.0f} "
+                    f"{stats['p50']:>8.2f} {stats['p99']:>8.2f} {stats['lost']:>6}"
+                )
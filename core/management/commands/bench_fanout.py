@@ -0,0 +1,109 @@
+import asyncio
+import json
+import time
+
+from asgiref.sync import async_to_sync
+from channels.layers import InMemoryChannelLayer
+from django.core.management.base import BaseCommand
+
+from core import wire
+from core.eventlog import RoomLog
+from core.consumers import SessionConsumer
+from core.outbound import PRIORITY_CHAT, OutboundQueue
+
+
+class PerRecipientSessionConsumer(SessionConsumer):
+    """The old behaviour: every recipient builds and encodes the frame itself."""
+
+    async def chat_message(self, event):
+        self.outbound.put(PRIORITY_CHAT, json.dumps({
+            'type': 'chat_message',
+            'message': event['message'],
+            'sender': event['sender'],
+            'suggestion': event.get('suggestion')
+        }))
+
+
+FRAME = {
+    'type': 'chat_message',
+    'message': 'Can everyone see my screen? Press Win + Shift + S to grab the error dialog.',
+    'sender': 'presenter',
+    'suggestion': {'keyword': 'screenshot', 'shortcut': 'Win + Shift + S', 'description': 'Screenshot'},
+}
+
+
+def make_event(per_recipient):
+    if per_recipient:
+        return {'type': 'chat_message', **{k: v for k, v in FRAME.items() if k != 'type'}}
+    return wire.frame_event('chat_message', FRAME)
+
+
+async def run_room(size, messages, codec, per_recipient):
+    """
+    CPU seconds and wire bytes to fan `messages` chat messages out to a room
+    of `size` consumers: the group_send, the channel-layer copies, the
+    handlers and the outbound queues.
+    """
+    layer = InMemoryChannelLayer(capacity=messages + 1)
+    consumer_class = PerRecipientSessionConsumer if per_recipient else SessionConsumer
+    wire_bytes = 0
+
+    async def send(data):
+        nonlocal wire_bytes
+        wire_bytes += len(data)
+
+    # Shared by the room's consumers, as SessionConsumer.connect() sets it up
+    room_log = RoomLog(capacity=messages + 1)
+    consumers = []
+    for _ in range(size):
+        consumer = consumer_class()
+        consumer.channel_name = await layer.new_channel()
+        consumer.codec = codec
+        consumer.room_log = room_log
+        consumer.last_seq = room_log.head
+        consumer.outbound = OutboundQueue(send, encode=codec.dumps, max_items=messages + 1)
+        await layer.group_add('room', consumer.channel_name)
+        wire.acquire(codec)
+        consumers.append(consumer)
+
+    start = time.process_time()
+    for _ in range(messages):
+        await layer.group_send('room', make_event(per_recipient))
+        for consumer in consumers:
+            await consumer.chat_message(await layer.receive(consumer.channel_name))
+    while any(consumer.outbound.depth for consumer in consumers):
+        await asyncio.sleep(0)
+    elapsed = time.process_time() - start
+
+    for consumer in consumers:
+        consumer.outbound.close()
+        wire.release(codec)
+    await asyncio.sleep(0)
+    return elapsed, wire_bytes
+
+
+class Command(BaseCommand):
+    help = 'CPU per fanned-out chat message: per-recipient JSON encoding vs serialize-once codecs'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='2,5,10,25,50,100',
+                            help='Comma separated room sizes')
+        parser.add_argument('--messages', type=int, default=200,
+                            help='Messages fanned out per room size')
+
+    def handle(self, *args, **options):
+        sizes = [int(s) for s in options['sizes'].split(',')]
+        messages = options['messages']
+        runs = [('per-recipient json', wire.JSON, True)]
+        runs += [(f'once {name}', codec, False) for name, codec in wire.CODECS.items()]
+
+        self.stdout.write('CPU microseconds per fanned-out message (bytes per frame)')
+        self.stdout.write(f"{'peers':>6}" + ''.join(f'{label:>24}' for label, _, _ in runs))
+        for size in sizes:
+            cells = []
+            for _, codec, per_recipient in runs:
+                elapsed, wire_bytes = async_to_sync(run_room)(size, messages, codec, per_recipient)
+                per_message = elapsed / messages * 1e6
+                frame_bytes = wire_bytes // (messages * size)
+                cells.append(f'{per_message:>17.0f} ({frame_bytes:>3})')
+            self.stdout.write(f'{size:>6}' + ''.join(cells))
@@ -0,0 +1,92 @@
+import itertools
+import time
+
+from asgiref.sync import async_to_sync
+from channels.auth import AuthMiddlewareStack
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+
+from core import seats
+from core.chatlog import chat_writer
+from core.models import Session
+from core.presence import presence_registry
+from core.routing import websocket_urlpatterns
+
+from ._bench import session_path, test_database
+
+
+def make_room(size):
+    users = [User.objects.create(username=f'member{i}') for i in range(size)]
+    session = Session.objects.create(host=users[0], max_participants=size)
+    for user in users:
+        seats.set_status(session, user, 'accepted')
+    return session, users
+
+
+def session_cookie(user):
+    client = Client()
+    client.force_login(user)
+    return f'{settings.SESSION_COOKIE_NAME}={client.cookies[settings.SESSION_COOKIE_NAME].value}'.encode()
+
+
+async def run_handshakes(app, sockets, count, cold):
+    """Open and close `count` sockets in turn; returns the seconds spent opening them."""
+    elapsed = 0.0
+    for path, headers in itertools.islice(itertools.cycle(sockets), count):
+        if cold:
+            cache.clear()
+        socket = WebsocketCommunicator(app, path, headers=headers)
+        start = time.perf_counter()
+        connected, _ = await socket.connect()
+        assert connected
+        # The presence snapshot completes the handshake
+        await socket.receive_from()
+        elapsed += time.perf_counter() - start
+        await socket.disconnect()
+    await presence_registry.flush()
+    await chat_writer.flush()
+    return elapsed
+
+
+def measure(app, sockets, count, cold):
+    with CaptureQueriesContext(connection) as ctx:
+        elapsed = async_to_sync(run_handshakes)(app, sockets, count, cold)
+    reads = sum(query['sql'].startswith('SELECT') for query in ctx.captured_queries)
+    return count / elapsed, reads / count
+
+
+class Command(BaseCommand):
+    help = 'Session WebSocket handshakes per second with connect tokens vs loading the Django session'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--handshakes', type=int, default=500)
+        parser.add_argument('--members', type=int, default=20,
+                            help='Accepted participants in the room; handshakes cycle through them')
+
+    def handle(self, *args, **options):
+        count = options['handshakes']
+        with test_database():
+            session, users = make_room(options['members'])
+            router = URLRouter(websocket_urlpatterns)
+            with_tokens = [(session_path(session, user), []) for user in users]
+            # The previous stack: every socket also carried the login cookie
+            # through AuthMiddlewareStack, which reads the session and user
+            with_cookies = [(path, [(b'cookie', session_cookie(user))]) for (path, _), user in zip(with_tokens, users)]
+
+            modes = [
+                ('token, cold cache', router, with_tokens, True),
+                ('token, warm cache', router, with_tokens, False),
+                ('token + AuthMiddlewareStack', AuthMiddlewareStack(router), with_cookies, False),
+            ]
+            self.stdout.write(f'{count} handshakes into a room of {len(users)}')
+            self.stdout.write(f"{'mode':>28} {'handshakes/s':>13} {'reads/handshake':>16}")
+            for name, app, sockets, cold in modes:
+                rate, reads = measure(app, sockets, count, cold)
+                self.stdout.write(f'{name:>28} {rate:>13.0f} {reads:>16.2f}')
@@ -0,0 +1,160 @@
+import random
+import re
+import string
+import time
+
+from django.core.management.base import BaseCommand
+
+from core.hints import FuzzyHintIndex, HintMatcher, _words, edit_distance, typo_budget
+
+
+def legacy_match(catalog, text):
+    """The original per-message loop from SessionConsumer.get_command_suggestion."""
+    text = text.lower()
+    for keyword, hint in catalog:
+        pattern = r'\b' + re.escape(keyword.lower()) + r'\b'
+        if re.search(pattern, text):
+            return hint
+    if re.search(r'\btaskbar\b', text):
+        return "Tip: Win+T to focus taskbar."
+    return None
+
+
+def scan_fuzzy_match(catalog, text, max_distance):
+    """Typo-tolerant lookup without an index: compare every keyword."""
+    words = _words(text)
+    phrases = [' '.join(_words(keyword)) for keyword, hint in catalog]
+    max_words = max(p.count(' ') + 1 for p in phrases)
+    spans = {
+        ' '.join(words[start:end])
+        for start in range(len(words))
+        for end in range(start + 1, min(start + max_words, len(words)) + 1)
+    }
+    best = None
+    for index, phrase in enumerate(phrases):
+        budget = typo_budget(len(phrase), max_distance)
+        for span in spans:
+            # Typos never change the first letter
+            if span[0] != phrase[0]:
+                continue
+            distance = edit_distance(span, phrase, budget)
+            if distance <= budget and (best is None or (distance, index) < best):
+                best = (distance, index)
+    return catalog[best[1]][1] if best else None
+
+
+def make_typo(word, rng):
+    i = rng.randrange(len(word))
+    edit = rng.choice(['drop', 'swap', 'replace'])
+    if edit == 'drop':
+        return word[:i] + word[i + 1:]
+    if edit == 'swap' and i + 1 < len(word):
+        return word[:i] + word[i + 1] + word[i] + word[i + 2:]
+    return word[:i] + rng.choice(string.ascii_lowercase) + word[i + 1:]
+
+
+def make_catalog(size, rng):
+    words = set()
+    while len(words) < size:
+        word = ''.join(rng.choices(string.ascii_lowercase, k=rng.randint(3, 9)))
+        if rng.random() < 0.3:
+            word += ' ' + ''.join(rng.choices(string.ascii_lowercase, k=rng.randint(3, 8)))
+        words.add(word)
+    return [(word, f"Tip: hint for {word}") for word in sorted(words, key=lambda w: rng.random())]
+
+
+def make_messages(catalog, count, rng, typos=False):
+    filler = ['hey', 'can', 'you', 'see', 'my', 'screen', 'now', 'the', 'window', 'taskbar', 'ok']
+    messages = []
+    for _ in range(count):
+        words = rng.choices(filler, k=rng.randint(3, 12))
+        if rng.random() < 0.5:
+            keyword = rng.choice(catalog)[0]
+            if typos:
+                keyword = make_typo(keyword, rng)
+            words.insert(rng.randrange(len(words) + 1), keyword)
+        messages.append(' '.join(words))
+    return messages
+
+
+class Command(BaseCommand):
+    help = 'Micro-benchmark of command hint matching per chat message'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='60,1000,10000',
+                            help='Comma separated catalog sizes')
+        parser.add_argument('--messages', type=int, default=500)
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument('--max-distance', type=int, default=2,
+                            help='Typo budget for the fuzzy index')
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        sizes = [int(s) for s in options['sizes'].split(',')]
+
+        max_distance = options['max_distance']
+
+        self.stdout.write('Exact matching')
+        self.stdout.write(f"{'keywords':>9} {'build ms':>9} {'legacy us/msg':>14} {'matcher us/msg':>15} {'speedup':>8}")
+        catalogs = {}
+        for size in sizes:
+            catalog = catalogs[size] = make_catalog(size, rng)
+            messages = make_messages(catalog, options['messages'], rng)
+
+            start = time.perf_counter()
+            matcher = HintMatcher(catalog)
+            build = time.perf_counter() - start
+
+            # Legacy is very slow on large catalogs; time a sample of messages
+            legacy_sample = messages[:max(20, len(messages) * 60 // size)]
+            start = time.perf_counter()
+            expected = [legacy_match(catalog, m) for m in legacy_sample]
+            legacy = (time.perf_counter() - start) / len(legacy_sample)
+
+            start = time.perf_counter()
+            for m in messages:
+                matcher.match(m)
+            compiled = (time.perf_counter() - start) / len(messages)
+
+            got = [matcher.match(m) for m in legacy_sample]
+            if got != expected:
+                self.stderr.write(self.style.ERROR(f'Result mismatch at {size} keywords'))
+
+            self.stdout.write(
+                f"{size:>9} {build * 1e3:>9.1f} {legacy * 1e6:>14.1f} "
+                f"{compiled * 1e6:>15.1f} {legacy / compiled:>7.0f}x"
+            )
+
+        self.stdout.write(f'\nTypo-tolerant matching (max distance {max_distance}, messages with typos)')
+        self.stdout.write(f"{'keywords':>9} {'build ms':>9} {'scan us/msg':>12} {'index us/msg':>13} {'exact us/msg':>13} {'hit rate':>9}")
+        for size in sizes:
+            catalog = catalogs[size]
+            messages = make_messages(catalog, options['messages'], rng, typos=True)
+            matcher = HintMatcher(catalog)
+
+            start = time.perf_counter()
+            index = FuzzyHintIndex(catalog, max_distance)
+            build = time.perf_counter() - start
+
+            scan_sample = messages[:max(10, len(messages) * 60 // size)]
+            start = time.perf_counter()
+            expected = [scan_fuzzy_match(catalog, m, max_distance) for m in scan_sample]
+            scan = (time.perf_counter() - start) / len(scan_sample)
+
+            start = time.perf_counter()
+            results = [index.match(m) for m in messages]
+            fuzzy = (time.perf_counter() - start) / len(messages)
+
+            start = time.perf_counter()
+            for m in messages:
+                matcher.match(m)
+            exact = (time.perf_counter() - start) / len(messages)
+
+            if results[:len(scan_sample)] != expected:
+                self.stderr.write(self.style.ERROR(f'Fuzzy result mismatch at {size} keywords'))
+
+            hit_rate = sum(r is not None for r in results) / len(results)
+            self.stdout.write(
+                f"{size:>9} {build * 1e3:>9.1f} {scan * 1e6:>12.1f} {fuzzy * 1e6:>13.1f} "
+                f"{exact * 1e6:>13.1f} {hit_rate:>8.0%}"
+            )
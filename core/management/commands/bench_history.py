@@ -0,0 +1,85 @@
+import time
+from datetime import timedelta
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.utils import timezone
+
+from core import history
+from core.models import ChatMessage, Session
+
+from ._bench import test_database
+
+
+def seed_messages(session, count, start, batch=20000):
+    """Insert `count` chat messages one millisecond apart."""
+    for offset in range(0, count, batch):
+        ChatMessage.objects.bulk_create(
+            ChatMessage(
+                session=session,
+                sender_name='peer',
+                content=f'message {i}',
+                timestamp=start + timedelta(milliseconds=i),
+            )
+            for i in range(offset, min(offset + batch, count))
+        )
+
+
+def cursor_at(session, depth):
+    """Cursor positioned `depth` messages back from the newest one."""
+    row = ChatMessage.objects.filter(session=session).order_by('-timestamp', '-id').values(
+        'id', 'timestamp'
+    )[depth]
+    return history.encode_cursor({**row, 'kind': 'chat'})
+
+
+def best_of(fn, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+class Command(BaseCommand):
+    help = 'Time chat history page fetches at increasing depth in a large room'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--messages', type=int, default=1_000_000,
+                            help='Messages in the benchmarked room')
+        parser.add_argument('--other', type=int, default=100_000,
+                            help='Messages spread over other rooms')
+        parser.add_argument('--page-size', type=int, default=history.DEFAULT_PAGE_SIZE)
+        parser.add_argument('--repeat', type=int, default=5)
+
+    def handle(self, *args, **options):
+        total = options['messages']
+        limit = options['page_size']
+        with test_database():
+            host = User.objects.create(username='host')
+            room = Session.objects.create(host=host)
+            start = timezone.now() - timedelta(days=30)
+
+            self.stdout.write(f'Seeding {total} messages (+{options["other"]} in other rooms)...')
+            seed_start = time.perf_counter()
+            seed_messages(room, total, start)
+            for i in range(10):
+                seed_messages(Session.objects.create(host=host), options['other'] // 10, start)
+            with connection.cursor() as cursor:
+                cursor.execute('ANALYZE' if connection.vendor != 'postgresql' else 'ANALYZE core_chatmessage')
+            self.stdout.write(f'Seeded in {time.perf_counter() - seed_start:.1f}s\n')
+
+            self.stdout.write(f"{'depth':>10} {'keyset page ms':>15} {'offset page ms':>15}")
+            for fraction in (0, 0.01, 0.1, 0.5, 0.9, 0.999):
+                depth = int((total - limit - 1) * fraction)
+                cursor = cursor_at(room, depth) if depth else None
+
+                keyset = best_of(lambda: history.history_page(room.id, cursor, limit), options['repeat'])
+                offset = best_of(lambda: list(
+                    ChatMessage.objects.filter(session=room).order_by('-timestamp', '-id')
+                    .values('id', 'sender_name', 'timestamp', 'content')[depth:depth + limit]
+                ), options['repeat'])
+
+                self.stdout.write(f"{depth:>10} {keyset * 1e3:>15.2f} {offset * 1e3:>15.2f}")
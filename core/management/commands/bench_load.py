@@ -0,0 +1,245 @@
+import asyncio
+import json
+import random
+import resource
+import subprocess
+import time
+from collections import defaultdict
+from pathlib import Path
+
+from asgiref.sync import async_to_sync
+from channels.db import database_sync_to_async
+from channels.layers import get_channel_layer
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from core import roster, seats, wire
+from core.chatlog import chat_writer
+from core.models import Session
+from core.presence import presence_registry
+from core.realtime import room_group_name
+from core.routing import websocket_urlpatterns
+
+from ._bench import percentile, session_path, test_database
+
+KINDS = ('chat_message', 'signal', 'roster', 'audio_message')
+
+
+def parse_mix(text):
+    mix = {}
+    for part in text.split(','):
+        kind, _, weight = part.partition('=')
+        if kind not in KINDS:
+            raise CommandError(f'Unknown message type in --mix: {kind}')
+        mix[kind] = float(weight)
+    return mix
+
+
+@database_sync_to_async
+def make_rooms(rooms, members):
+    """`rooms` sessions, each with `members` accepted participants (the host first)."""
+    made = []
+    for r in range(rooms):
+        users = [User.objects.create(username=f'r{r}m{m}') for m in range(members)]
+        session = Session.objects.create(host=users[0], max_participants=members)
+        for user in users:
+            seats.set_status(session, user, 'accepted')
+        made.append((session, users))
+    return made
+
+
+def probe_ids(frame):
+    """The probe ids a received frame carries (none for presence and other frames)."""
+    kind = frame.get('type')
+    if kind == 'chat_message':
+        return [int(frame['message'][6:])]
+    if kind == 'roster' and 'changes' in frame:
+        return [int(username[6:]) for username in frame['changes']]
+    if kind == 'audio_message':
+        return [frame['id']]
+    if kind == 'signal':
+        return [frame['data']['probe']]
+    if kind == 'signal_batch':
+        return [data['probe'] for data in frame['data']]
+    return []
+
+
+class LoadRun:
+    def __init__(self, rooms, members, messages, rate, mix, seed):
+        self.rooms, self.members, self.messages, self.rate = rooms, members, messages, rate
+        self.kinds, self.weights = list(mix), list(mix.values())
+        self.rng = random.Random(seed)
+        self.sent = {}  # probe id -> (kind, monotonic send time)
+        self.latencies = defaultdict(list)
+        self.expected = 0
+        self.received = 0
+        self.done = asyncio.Event()
+
+    async def listen(self, socket):
+        while True:
+            output = await socket.receive_output(timeout=3600)
+            if output['type'] != 'websocket.send':
+                return
+            now = time.monotonic()
+            for probe in probe_ids(json.loads(output['text'])):
+                kind, sent = self.sent[probe]
+                self.latencies[kind].append(now - sent)
+                self.received += 1
+            if self.received >= self.expected and self.sending_finished:
+                self.done.set()
+
+    async def drive(self, session, users, sockets):
+        interval = 1 / self.rate if self.rate else 0
+        for _ in range(self.messages):
+            kind = self.rng.choices(self.kinds, self.weights)[0]
+            probe = len(self.sent)
+            sender = self.rng.randrange(len(users))
+            self.sent[probe] = (kind, time.monotonic())
+            if kind == 'chat_message':
+                self.expected += len(users)
+                await sockets[sender].send_json_to({'type': 'chat_message', 'message': f'probe:{probe}'})
+            elif kind == 'roster':
+                # Seat changes are announced by the views, not by a socket
+                self.expected += len(users)
+                await get_channel_layer().group_send(room_group_name(session.room_code), roster.change_event(
+                    f'probe:{probe}', roster.member_entry('pending', f'probe:{probe}', 'join_request')
+                ))
+            elif kind == 'signal':
+                target = self.rng.choice([i for i in range(len(users)) if i != sender])
+                self.expected += 1
+                await sockets[sender].send_json_to({
+                    'type': 'signal', 'target': users[target].username, 'data': {'type': 'candidate', 'probe': probe}
+                })
+            else:
+                # Clips are announced by the upload view, not by a socket
+                self.expected += len(users)
+                await get_channel_layer().group_send(room_group_name(session.room_code), wire.frame_event('audio_message', {
+                    'type': 'audio_message', 'id': probe, 'url': f'/audio/{probe}/', 'duration': 1.0,
+                    'sender': users[sender].username,
+                }))
+            await asyncio.sleep(interval)
+
+    async def run(self, drain):
+        rooms = await make_rooms(self.rooms, self.members)
+        app = URLRouter(websocket_urlpatterns)
+        all_sockets, per_room = [], []
+        for session, users in rooms:
+            sockets = []
+            for user in users:
+                socket = WebsocketCommunicator(app, session_path(session, user))
+                connected, _ = await socket.connect()
+                assert connected
+                sockets.append(socket)
+            per_room.append(sockets)
+            all_sockets += sockets
+
+        self.sending_finished = False
+        listeners = [asyncio.ensure_future(self.listen(socket)) for socket in all_sockets]
+        start = time.monotonic()
+        await asyncio.gather(*(
+            self.drive(session, users, sockets) for (session, users), sockets in zip(rooms, per_room)
+        ))
+        self.sending_finished = True
+        if self.received < self.expected:
+            try:
+                await asyncio.wait_for(self.done.wait(), drain)
+            except asyncio.TimeoutError:
+                pass
+        elapsed = time.monotonic() - start
+
+        for listener in listeners:
+            listener.cancel()
+        for socket in all_sockets:
+            await socket.disconnect()
+        await chat_writer.flush()
+        await presence_registry.flush()
+        return elapsed
+
+    def results(self, elapsed):
+        everything = sorted(latency for values in self.latencies.values() for latency in values)
+
+        def summary(values):
+            values = sorted(values)
+            return {
+                'deliveries': len(values),
+                'p50_ms': percentile(values, 0.50) * 1e3,
+                'p95_ms': percentile(values, 0.95) * 1e3,
+                'p99_ms': percentile(values, 0.99) * 1e3,
+            }
+
+        return {
+            'elapsed_s': elapsed,
+            'messages': len(self.sent),
+            'expected_deliveries': self.expected,
+            'lost': self.expected - self.received,
+            'messages_per_s': len(self.sent) / elapsed,
+            'deliveries_per_s': self.received / elapsed,
+            **summary(everything),
+            'by_type': {kind: summary(values) for kind, values in sorted(self.latencies.items())},
+            # Linux reports kilobytes
+            'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        }
+
+
+def current_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True,
+            cwd=Path(__file__).resolve().parent,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Command(BaseCommand):
+    help = 'Drive mixed room traffic through SessionConsumer and report throughput, latency and memory'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rooms', type=int, default=10)
+        parser.add_argument('--members', type=int, default=8,
+                            help='Participants per room, all connected')
+        parser.add_argument('--messages', type=int, default=200,
+                            help='Messages sent in each room')
+        parser.add_argument('--rate', type=float, default=50,
+                            help='Messages per second per room; 0 sends as fast as possible')
+        parser.add_argument('--mix', default='chat_message=60,signal=25,roster=10,audio_message=5',
+                            help='Relative weights of message types')
+        parser.add_argument('--drain', type=float, default=30,
+                            help='Seconds to wait for outstanding deliveries after the last send')
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument('--output', help='Also write the results to this JSON file')
+
+    def handle(self, *args, **options):
+        if options['members'] < 2:
+            raise CommandError('--members must be at least 2')
+        config = {name: options[name] for name in ('rooms', 'members', 'messages', 'rate', 'mix', 'seed')}
+        run = LoadRun(
+            options['rooms'], options['members'], options['messages'], options['rate'],
+            parse_mix(options['mix']), options['seed'],
+        )
+        with test_database():
+            elapsed = async_to_sync(run.run)(options['drain'])
+        results = run.results(elapsed)
+
+        self.stdout.write(
+            f"{options['rooms']} rooms x {options['members']} members, {results['messages']} messages, "
+            f"{results['expected_deliveries']} deliveries expected, {results['lost']} lost"
+        )
+        self.stdout.write(
+            f"throughput: {results['messages_per_s']:.0f} messages/s, "
+            f"{results['deliveries_per_s']:.0f} deliveries/s; peak RSS {results['peak_rss_mb']:.1f} MB"
+        )
+        self.stdout.write(f"{'type':>20} {'deliveries':>11} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+        for kind, stats in [('all', results), *results['by_type'].items()]:
+            self.stdout.write(
+                f"{kind:>20} {stats['deliveries']:>11} {stats['p50_ms']:>8.2f} "
+                f"{stats['p95_ms']:>8.2f} {stats['p99_ms']:>8.2f}"
+            )
+
+        if options['output']:
+            Path(options['output']).write_text(json.dumps(
+                {'commit': current_commit(), 'config': config, 'results': results}, indent=2
+            ))
+            self.stdout.write(f"Results written to {options['output']}")
@@ -0,0 +1,80 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+
+from core.models import Participant, Session
+
+from ._bench import test_database
+
+# (endpoint, polls per minute before, polls per minute with push + slow fallback)
+INDEX_POLLS = [
+    ('/api/my-invitations/', 60 / 5, 60 / 60),
+    ('/api/available-sessions/', 60 / 10, 60 / 60),
+]
+WAITING_ROOM_POLLS = [
+    ('/session/{room_code}/check-status/', 60 / 2, 60 / 30),
+]
+
+
+class Command(BaseCommand):
+    help = 'Requests and ORM queries per idle user per minute, polling vs push notifications'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sessions', type=int, default=20,
+                            help='Discoverable sessions to seed')
+        parser.add_argument('--participants', type=int, default=5,
+                            help='Accepted participants per seeded session')
+
+    def seed(self, sessions, participants):
+        hosts = [User.objects.create(username=f'host{i}') for i in range(sessions)]
+        guests = [User.objects.create(username=f'guest{i}') for i in range(participants)]
+        for host in hosts:
+            session = Session.objects.create(host=host)
+            Participant.objects.create(user=host, session=session, status='accepted')
+            Participant.objects.bulk_create(
+                Participant(user=guest, session=session, status='accepted') for guest in guests
+            )
+        idle = User.objects.create(username='idle')
+        waiting = Session.objects.create(host=hosts[0], is_discoverable=False)
+        Participant.objects.create(user=idle, session=waiting, status='pending')
+        return idle, waiting
+
+    def measure(self, client, polls, room_code):
+        rows = []
+        for url, before, after in polls:
+            url = url.format(room_code=room_code)
+            with CaptureQueriesContext(connection) as ctx:
+                response = client.get(url)
+            assert response.status_code == 200, (url, response.status_code)
+            rows.append((url, len(ctx.captured_queries), before, after))
+        return rows
+
+    def handle(self, *args, **options):
+        with test_database():
+            idle, waiting = self.seed(options['sessions'], options['participants'])
+            client = Client()
+            client.force_login(idle)
+
+            self.stdout.write(
+                f"{'page / endpoint':<38} {'queries/call':>12} {'req/min before':>15} "
+                f"{'req/min after':>14} {'queries/min before':>19} {'queries/min after':>18}"
+            )
+            for page, polls in (('index', INDEX_POLLS), ('waiting room', WAITING_ROOM_POLLS)):
+                total = [0, 0, 0, 0]
+                for url, queries, before, after in self.measure(client, polls, waiting.room_code):
+                    self.stdout.write(
+                        f"  {url:<36} {queries:>12} {before:>15.0f} {after:>14.0f} "
+                        f"{queries * before:>19.0f} {queries * after:>18.0f}"
+                    )
+                    total = [total[0] + before, total[1] + after,
+                             total[2] + queries * before, total[3] + queries * after]
+                self.stdout.write(
+                    f"{page + ' total':<38} {'':>12} {total[0]:>15.0f} {total[1]:>14.0f} "
+                    f"{total[2]:>19.0f} {total[3]:>18.0f}"
+                )
+            self.stdout.write(
+                '\nWith push, each open page also holds one /ws/notifications/ socket; '
+                'it costs the auth lookups once at connect and no queries while idle.'
+            )
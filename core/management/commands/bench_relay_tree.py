@@ -0,0 +1,102 @@
+import random
+import time
+
+from django.core.management.base import BaseCommand
+
+from core.topology import DEFAULTS, RelayTree
+
+QUALITIES = ('high', 'medium', 'low')
+
+
+def validate(tree):
+    """Every peer hangs off the root, and only the root exceeds its fan-out."""
+    for name, node in tree._nodes.items():
+        assert tree.depth(name) is not None, f'{name} is detached'
+        if node is not tree.root:
+            assert len(node.children) <= node.capacity, f'{name} forwards to too many peers'
+            assert node in node.parent.children
+
+
+def simulate(size, operations, weights, root_fanout, fanout, seed):
+    """
+    Join `size` peers, then run `operations` random leaves, joins and quality
+    changes. Returns the final tree, the depths after the initial joins and
+    per-operation counters.
+    """
+    rng = random.Random(seed)
+    tree = RelayTree('host', root_fanout, fanout)
+    names = [f'peer{i}' for i in range(size)]
+    stats = {'join': [0, 0, 0.0], 'leave': [0, 0, 0.0], 'quality': [0, 0, 0.0]}  # ops, plans, seconds
+
+    def run(kind, call, *args):
+        start = time.perf_counter()
+        plans = call(*args)
+        elapsed = time.perf_counter() - start
+        entry = stats[kind]
+        entry[0] += 1
+        entry[1] += len(plans)
+        entry[2] += elapsed
+
+    for name in names:
+        run('join', tree.add, name, rng.choices(QUALITIES, weights)[0])
+    build_depths = [tree.depth(name) for name in names]
+
+    present, absent = set(names), []
+    next_name = size
+    for _ in range(operations):
+        roll = rng.random()
+        if roll < 0.4 and present:
+            name = rng.choice(sorted(present))
+            present.discard(name)
+            absent.append(name)
+            run('leave', tree.remove, name)
+        elif roll < 0.8:
+            if absent:
+                name = absent.pop(rng.randrange(len(absent)))
+            else:
+                name, next_name = f'peer{next_name}', next_name + 1
+            present.add(name)
+            run('join', tree.add, name, rng.choices(QUALITIES, weights)[0])
+        elif present:
+            run('quality', tree.set_quality, rng.choice(sorted(present)), rng.choices(QUALITIES, weights)[0])
+    validate(tree)
+    return tree, max(build_depths), sum(build_depths) / size, stats
+
+
+class Command(BaseCommand):
+    help = 'Simulate relay-tree planning: host upload, tree depth and rebalancing cost'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='10,25,50,100,250,500',
+                            help='Comma separated room sizes (viewers)')
+        parser.add_argument('--operations', type=int, default=1000,
+                            help='Random leaves, joins and quality changes after the initial joins')
+        parser.add_argument('--mix', default='50,30,20',
+                            help='Percent of high, medium and low quality peers')
+        parser.add_argument('--bitrate', type=float, default=2.5,
+                            help='Screen-share bitrate in Mbit/s')
+        parser.add_argument('--seed', type=int, default=1)
+
+    def handle(self, *args, **options):
+        sizes = [int(s) for s in options['sizes'].split(',')]
+        weights = [int(w) for w in options['mix'].split(',')]
+        bitrate = options['bitrate']
+
+        self.stdout.write(
+            f"{'peers':>6} {'direct up Mb/s':>15} {'tree up Mb/s':>13} {'max depth':>10} {'mean depth':>11} "
+            f"{'plans/join':>11} {'plans/leave':>12} {'moves/leave':>12} {'us/op':>7}"
+        )
+        for size in sizes:
+            tree, max_depth, mean_depth, stats = simulate(
+                size, options['operations'], weights, DEFAULTS['ROOT_FANOUT'], DEFAULTS['FANOUT'], options['seed']
+            )
+            ops = sum(entry[0] for entry in stats.values())
+            seconds = sum(entry[2] for entry in stats.values())
+            joins, leaves = stats['join'], stats['leave']
+            self.stdout.write(
+                f'{size:>6} {size * bitrate:>15.1f} {len(tree.root.children) * bitrate:>13.1f} {max_depth:>10} '
+                f'{mean_depth:>11.2f} {joins[1] / joins[0]:>11.2f} '
+                f'{leaves[1] / max(leaves[0], 1):>12.2f} {tree.moves / max(leaves[0], 1):>12.2f} '
+                f'{seconds / ops * 1e6:>7.1f}'
+            )
+        self.stdout.write('A full rebuild would re-instruct every peer on every change.')
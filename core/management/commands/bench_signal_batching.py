@@ -0,0 +1,105 @@
+import asyncio
+import time
+
+from asgiref.sync import async_to_sync
+from channels.db import database_sync_to_async
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.urls import re_path
+
+from core import seats
+from core.consumers import SessionConsumer
+from core.models import Session
+
+from ._bench import counting_channel_layer, drain, session_path, test_database
+
+
+def consumer_with_window(window):
+    return type('BenchSessionConsumer', (SessionConsumer,), {'signal_batch_window': window})
+
+
+@database_sync_to_async
+def make_room(size):
+    users = [User.objects.create(username=f'peer{i}') for i in range(size)]
+    session = Session.objects.create(host=users[0], max_participants=size)
+    for user in users:
+        seats.set_status(session, user, 'accepted')
+    return session, users
+
+
+async def collect(peer, expected):
+    """Read frames until `expected` signals arrived; return the frame count."""
+    frames = 0
+    while expected > 0:
+        frame = await peer.receive_json_from(timeout=5)
+        frames += 1
+        expected -= len(frame['data']) if frame['type'] == 'signal_batch' else 1
+    return frames
+
+
+async def run_setup(layer, window, size, candidates):
+    """
+    Call setup in a full mesh: every peer sends an offer and a burst of ICE
+    candidates to every other peer, which answer with an answer and their
+    own burst of candidates.
+    """
+    session, users = await make_room(size)
+    app = URLRouter([re_path(r'ws/session/(?P<room_code>\w+)/$', consumer_with_window(window).as_asgi())])
+    peers = []
+    for user in users:
+        peer = WebsocketCommunicator(app, session_path(session, user))
+        connected, _ = await peer.connect()
+        assert connected
+        assert (await peer.receive_json_from())['type'] == 'presence'
+        peers.append(peer)
+    await drain(peers)
+
+    layer.deliveries = 0
+    signals = frames = 0
+    start = time.perf_counter()
+    for kind in ('offer', 'answer'):
+        for sender, peer in enumerate(peers):
+            for target, user in enumerate(users):
+                if target == sender:
+                    continue
+                for data in [{'type': kind}] + [{'type': 'candidate', 'n': n} for n in range(candidates)]:
+                    await peer.send_json_to({'type': 'signal', 'target': user.username, 'data': data})
+                    signals += 1
+        per_peer = (size - 1) * (candidates + 1)
+        frames += sum(await asyncio.gather(*(collect(peer, per_peer) for peer in peers)))
+    elapsed = time.perf_counter() - start
+    deliveries = layer.deliveries
+
+    for peer in peers:
+        await peer.disconnect()
+    await database_sync_to_async(User.objects.all().delete)()
+    return signals, frames, deliveries, elapsed
+
+
+class Command(BaseCommand):
+    help = 'Frames and channel-layer deliveries saved by batching signals during mesh call setup'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--peers', type=int, default=10)
+        parser.add_argument('--candidates', type=int, default=8,
+                            help='ICE candidates each side sends per peer connection')
+        parser.add_argument('--window', type=float, default=0.02,
+                            help='Batching window in seconds')
+
+    def handle(self, *args, **options):
+        size, candidates = options['peers'], options['candidates']
+        with test_database():
+            results = []
+            for window in (None, options['window']):
+                with counting_channel_layer() as layer:
+                    results.append(async_to_sync(run_setup)(layer, window, size, candidates))
+
+        (signals, old_frames, old_deliveries, old_elapsed), (_, new_frames, new_deliveries, new_elapsed) = results
+        self.stdout.write(f'{size}-peer mesh, {candidates} candidates per side: {signals} signals')
+        self.stdout.write(f"{'mode':>10} {'frames':>8} {'deliveries':>11} {'setup ms':>9}")
+        self.stdout.write(f"{'unbatched':>10} {old_frames:>8} {old_deliveries:>11} {old_elapsed * 1e3:>9.1f}")
+        self.stdout.write(f"{'batched':>10} {new_frames:>8} {new_deliveries:>11} {new_elapsed * 1e3:>9.1f}")
+        saved = old_frames - new_frames
+        self.stdout.write(f'frames saved: {saved} ({saved / old_frames:.0%})')
@@ -0,0 +1,123 @@
+import json
+import time
+
+from asgiref.sync import async_to_sync
+from channels.db import database_sync_to_async
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.urls import re_path
+
+from core import seats
+from core.consumers import SessionConsumer
+from core.models import Session
+
+from ._bench import counting_channel_layer, drain, session_path, test_database
+
+
+class DirectSessionConsumer(SessionConsumer):
+    # Each signal is awaited before the next is sent, so batching would only add its window
+    signal_batch_window = None
+
+
+class BroadcastSessionConsumer(DirectSessionConsumer):
+    """The old behaviour: targeted signals are broadcast and filtered by each consumer."""
+    direct_signaling = False
+
+
+def make_app(consumer):
+    return URLRouter([re_path(r'ws/session/(?P<room_code>\w+)/$', consumer.as_asgi())])
+
+
+@database_sync_to_async
+def make_room(size):
+    users = [User.objects.create(username=f'peer{i}') for i in range(size)]
+    session = Session.objects.create(host=users[0], max_participants=size)
+    for user in users:
+        seats.set_status(session, user, 'accepted')
+    return session, users
+
+
+async def receive_signal(peer):
+    """The next frame that isn't presence; diffs are flushed at any point of the run."""
+    while True:
+        frame = json.loads(await peer.receive_from())
+        if frame['type'] != 'presence':
+            return frame
+
+
+async def run_mesh(layer, consumer, size, candidates):
+    """Every pair of peers exchanges offer, answer and ICE candidates both ways."""
+    session, users = await make_room(size)
+    app = make_app(consumer)
+    peers = []
+    for user in users:
+        peer = WebsocketCommunicator(app, session_path(session, user))
+        connected, _ = await peer.connect()
+        assert connected
+        # Every socket starts with a presence snapshot
+        assert (await peer.receive_json_from())['type'] == 'presence'
+        peers.append(peer)
+    await drain(peers)
+
+    layer.deliveries = 0
+    start = time.perf_counter()
+    signals = 0
+    frames = 0
+    for a in range(size):
+        for b in range(a + 1, size):
+            exchange = [(a, b, 'offer'), (b, a, 'answer')]
+            exchange += [(a, b, 'candidate'), (b, a, 'candidate')] * candidates
+            for sender, target, kind in exchange:
+                await peers[sender].send_json_to({
+                    'type': 'signal',
+                    'target': users[target].username,
+                    'data': {'type': kind},
+                })
+                signals += 1
+                assert (await receive_signal(peers[target]))['type'] == 'signal'
+                frames += 1
+    elapsed = time.perf_counter() - start
+    deliveries = layer.deliveries
+
+    # Nobody but the targets may see a signal
+    for peer in peers:
+        while not await peer.receive_nothing():
+            assert json.loads(await peer.receive_from())['type'] == 'presence'
+
+    for peer in peers:
+        await peer.disconnect()
+    await database_sync_to_async(User.objects.all().delete)()
+    return signals, deliveries, frames, elapsed
+
+
+class Command(BaseCommand):
+    help = 'Compare channel-layer traffic of broadcast vs direct WebRTC signaling in a mesh room'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='2,4,8,16',
+                            help='Comma separated room sizes')
+        parser.add_argument('--candidates', type=int, default=3,
+                            help='ICE candidates sent by each side of every pair')
+
+    def handle(self, *args, **options):
+        sizes = [int(s) for s in options['sizes'].split(',')]
+        with test_database():
+            self.stdout.write(
+                f"{'peers':>6} {'signals':>8} {'broadcast deliveries':>21} "
+                f"{'direct deliveries':>18} {'frames':>7} {'broadcast ms':>13} {'direct ms':>10}"
+            )
+            for size in sizes:
+                with counting_channel_layer() as layer:
+                    before = async_to_sync(run_mesh)(layer, BroadcastSessionConsumer, size, options['candidates'])
+                with counting_channel_layer() as layer:
+                    after = async_to_sync(run_mesh)(layer, DirectSessionConsumer, size, options['candidates'])
+                signals, old_deliveries, old_frames, old_elapsed = before
+                _, new_deliveries, new_frames, new_elapsed = after
+                if old_frames != new_frames:
+                    self.stderr.write(self.style.ERROR(f'Frame mismatch at {size} peers'))
+                self.stdout.write(
+                    f"{size:>6} {signals:>8} {old_deliveries:>21} {new_deliveries:>18} "
+                    f"{new_frames:>7} {old_elapsed * 1e3:>13.1f} {new_elapsed * 1e3:>10.1f}"
+                )
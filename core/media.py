@@ -0,0 +1,76 @@
+"""
+Serving stored media files with HTTP Range support, so browsers can seek in
+and progressively load audio messages instead of fetching them whole.
+"""
+import mimetypes
+import re
+
+from django.http import FileResponse, HttpResponse, StreamingHttpResponse
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+CHUNK_SIZE = 64 * 1024
+
+
+def parse_range(header, size):
+    """
+    Return (start, end) inclusive for a single-range 'Range' header, None if
+    the header should be ignored, or False if it cannot be satisfied.
+    """
+    match = RANGE_RE.match(header.strip())
+    if not match:
+        # Multiple ranges or other units: just send the whole file
+        return None
+    first, last = match.groups()
+    if not first and not last:
+        return None
+    if not first:
+        # Suffix range: the last N bytes
+        length = int(last)
+        if length == 0:
+            return False
+        return max(size - length, 0), size - 1
+    start = int(first)
+    end = int(last) if last else size - 1
+    if start >= size or end < start:
+        return False
+    return start, min(end, size - 1)
+
+
+def _iter_range(fileobj, start, length):
+    try:
+        fileobj.seek(start)
+        remaining = length
+        while remaining > 0:
+            chunk = fileobj.read(min(CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+    finally:
+        fileobj.close()
+
+
+def ranged_file_response(request, field_file, content_type=None):
+    """Serve a FieldFile, honouring a single byte range if requested."""
+    content_type = content_type or mimetypes.guess_type(field_file.name)[0] or 'application/octet-stream'
+    size = field_file.size
+    byte_range = parse_range(request.headers.get('Range', ''), size)
+
+    if byte_range is False:
+        response = HttpResponse(status=416)
+        response['Content-Range'] = f'bytes */{size}'
+        return response
+
+    fileobj = field_file.open('rb')
+    if byte_range is None:
+        response = FileResponse(fileobj, content_type=content_type)
+    else:
+        start, end = byte_range
+        length = end - start + 1
+        response = StreamingHttpResponse(
+            _iter_range(fileobj, start, length), status=206, content_type=content_type
+        )
+        response['Content-Length'] = str(length)
+        response['Content-Range'] = f'bytes {start}-{end}/{size}'
+    response['Accept-Ranges'] = 'bytes'
+    return response
@@ -0,0 +1,231 @@
+"""
+Process metrics in the Prometheus text format, served at /metrics.
+
+Hot paths record into preallocated counters and histogram buckets, which
+costs a dict lookup, a bisect and a couple of additions per observation.
+Components that already keep their own numbers (the chat write-behind
+buffer, presence, outbound queues, signal batching, the channel layer and
+the room registry) are only read when /metrics is scraped.
+
+With METRICS['ENABLED'] off, nothing is recorded and /metrics is not routed.
+Otherwise /metrics is served to staff users and to scrapers that present
+METRICS['TOKEN']. Rooms are only reported in aggregate, so room codes never
+show up in the output.
+"""
+import bisect
+import hmac
+import time
+
+from channels.layers import InMemoryChannelLayer, get_channel_layer
+from django.conf import settings
+
+from . import eventlog, outbound, roomcache, roster, signaling
+from .chatlog import chat_writer
+from .presence import presence_registry
+from .rooms import registry
+
+DEFAULTS = {
+    'ENABLED': True,
+    # Scrapers send it as 'Authorization: Bearer <TOKEN>'; without one nobody,
+    # staff included, can read /metrics
+    'TOKEN': '',
+    # Upper bounds of the rooms-by-socket-count buckets
+    'ROOM_SIZE_BUCKETS': (1, 2, 5, 10, 20, 50, 100),
+    # Upper bounds, in seconds, of the latency histogram buckets
+    'BUCKETS': (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5),
+}
+
+_config = {**DEFAULTS, **getattr(settings, 'METRICS', {})}
+ENABLED = _config['ENABLED']
+
+_metrics = []
+_collectors = []
+
+
+class Counter:
+    kind = 'counter'
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help = help_text
+        self.labels = labels
+        self._values = {}
+        _metrics.append(self)
+
+    def inc(self, *label_values, amount=1):
+        self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def lines(self):
+        for label_values, value in sorted(self._values.items()):
+            yield _sample(self.name, self.labels, label_values, value)
+
+
+class Histogram:
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, labels=(), buckets=None):
+        self.name = name
+        self.help = help_text
+        self.labels = labels
+        self.buckets = tuple(buckets or _config['BUCKETS'])
+        # label values -> per-bucket counts (the last one is +Inf), then the sum
+        self._series = {}
+        _metrics.append(self)
+
+    def observe(self, value, *label_values):
+        series = self._series.get(label_values)
+        if series is None:
+            series = self._series[label_values] = [0] * (len(self.buckets) + 1) + [0.0]
+        series[bisect.bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def lines(self):
+        bounds = [_number(bound) for bound in self.buckets] + ['+Inf']
+        for label_values, series in sorted(self._series.items()):
+            cumulative = 0
+            for bound, count in zip(bounds, series):
+                cumulative += count
+                yield _sample(f'{self.name}_bucket', self.labels + ('le',), label_values + (bound,), cumulative)
+            yield _sample(f'{self.name}_sum', self.labels, label_values, series[-1])
+            yield _sample(f'{self.name}_count', self.labels, label_values, cumulative)
+
+
+def collector(func):
+    """
+    Register `func` to be called on every scrape. It returns an iterable of
+    (name, kind, help, samples) with samples as (labels dict, value) pairs.
+    """
+    _collectors.append(func)
+    return func
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _sample(name, labels, label_values, value):
+    if labels:
+        pairs = ','.join(f'{label}="{_escape(v)}"' for label, v in zip(labels, label_values))
+        return f'{name}{{{pairs}}} {_number(value)}'
+    return f'{name} {_number(value)}'
+
+
+def render():
+    lines = []
+    for metric in _metrics:
+        lines.append(f'# HELP {metric.name} {metric.help}')
+        lines.append(f'# TYPE {metric.name} {metric.kind}')
+        lines.extend(metric.lines())
+    for func in _collectors:
+        for name, kind, help_text, samples in func():
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {kind}')
+            for labels, value in samples:
+                lines.append(_sample(name, tuple(labels), tuple(labels.values()), value))
+    return '\n'.join(lines) + '\n'
+
+
+# Client message types with their own receive series; anything else is 'other'
+RECEIVE_TYPES = frozenset(('chat_message', 'signal', 'user_join', 'history', 'heartbeat', 'roster'))
+
+receive_seconds = Histogram(
+    'screendial_ws_receive_seconds', 'Time SessionConsumer.receive took, by message type', ('type',)
+)
+suggest_seconds = Histogram(
+    'screendial_hint_suggest_seconds', 'Time get_command_suggestion spent looking up a hint'
+)
+ws_connects = Counter('screendial_ws_connects_total', 'Session WebSocket connections opened')
+http_seconds = Histogram(
+    'screendial_http_request_seconds', 'Time to answer HTTP requests, by URL name', ('view',)
+)
+http_responses = Counter(
+    'screendial_http_responses_total', 'HTTP responses by URL name and status class', ('view', 'status')
+)
+
+
+class MetricsMiddleware:
+    """Times every request and labels it with the resolved URL name."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not ENABLED:
+            return self.get_response(request)
+        start = time.perf_counter()
+        response = self.get_response(request)
+        match = request.resolver_match
+        view = match.url_name if match is not None and match.url_name else 'unmatched'
+        http_seconds.observe(time.perf_counter() - start, view)
+        http_responses.inc(view, f'{response.status_code // 100}xx')
+        return response
+
+
+def _family(prefix, kind, help_text, values, counters=()):
+    """Families for a component's metrics() dict; keys in `counters` are cumulative."""
+    for key, value in values.items():
+        if key in counters:
+            yield f'{prefix}_{key}_total', 'counter', f'{help_text}: {key}', [({}, value)]
+        else:
+            yield f'{prefix}_{key}', kind, f'{help_text}: {key}', [({}, value)]
+
+
+def authorized(request):
+    """Whether `request` may read /metrics."""
+    token = _config['TOKEN']
+    if not token:
+        return False
+    if hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}'):
+        return True
+    return request.user.is_active and request.user.is_staff
+
+
+@collector
+def _rooms():
+    counts = sorted(registry.socket_counts().values())
+    yield ('screendial_ws_connections', 'gauge', 'Open session WebSockets in this process',
+           [({}, sum(counts))])
+    yield ('screendial_rooms', 'gauge', 'Rooms with an open session WebSocket in this process',
+           [({}, len(counts))])
+    # Cumulative, like histogram buckets, with a fixed set of labels
+    bounds = _config['ROOM_SIZE_BUCKETS']
+    yield ('screendial_rooms_by_sockets', 'gauge', 'Rooms with at most `le` open session WebSockets',
+           [({'le': _number(bound)}, bisect.bisect_right(counts, bound)) for bound in bounds]
+           + [({'le': '+Inf'}, len(counts))])
+
+
+@collector
+def _channel_layer():
+    layer = get_channel_layer()
+    if layer is None:
+        return
+    if hasattr(layer, 'metrics'):
+        values = layer.metrics()
+    elif isinstance(layer, InMemoryChannelLayer):
+        depths = [queue.qsize() for queue in layer.channels.values()]
+        values = {'channels': len(depths), 'queued': sum(depths), 'max_depth': max(depths, default=0)}
+    else:
+        return
+    yield from _family('screendial_channel_layer', 'gauge', 'Channel layer', values, counters=('dropped',))
+
+
+@collector
+def _components():
+    yield from _family('screendial_chatlog', 'gauge', 'Chat write-behind buffer', chat_writer.metrics(),
+                       counters=('flushes', 'failed_flushes', 'written', 'dropped', 'rejected'))
+    yield from _family('screendial_presence', 'gauge', 'Presence registry', presence_registry.metrics(),
+                       counters=('flushes', 'failed_flushes', 'rows_written'))
+    yield from _family('screendial_outbound', 'gauge', 'Outbound send queues', outbound.metrics(),
+                       counters=('dropped', 'coalesced', 'slow_disconnects', 'send_errors'))
+    yield from _family('screendial_signaling', 'gauge', 'Signal batching', signaling.metrics(),
+                       counters=('signals', 'frames', 'frames_saved'))
+    yield from _family('screendial_room_events', 'gauge', 'Sequenced room events', eventlog.metrics(),
+                       counters=('recorded', 'resumed', 'replayed', 'resyncs'))
+    yield from _family('screendial_roster', 'gauge', 'Room rosters', roster.metrics(),
+                       counters=('built', 'deltas', 'unchanged', 'snapshots'))
+    yield from _family('screendial_room_cache', 'gauge', 'Session lookup cache', roomcache.metrics(),
+                       counters=('hits', 'misses', 'invalidations'))
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-17 18:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0006_alter_commandsuggestion_keyword'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='session',
+            name='is_fuzzy_hints_enabled',
+            field=models.BooleanField(default=False, help_text='Also match command hints with small typos'),
+        ),
+    ]
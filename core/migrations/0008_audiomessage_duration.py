@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-17 18:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0007_session_is_fuzzy_hints_enabled'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='audiomessage',
+            name='duration',
+            field=models.FloatField(default=0, help_text='Length of the clip in seconds'),
+        ),
+    ]
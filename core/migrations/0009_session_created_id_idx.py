@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-17 18:31
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0008_audiomessage_duration'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='session',
+            index=models.Index(fields=['-created_at', '-id'], name='session_created_id_idx'),
+        ),
+    ]
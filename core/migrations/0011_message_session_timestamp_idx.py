@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-17 18:34
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0010_alter_chatmessage_timestamp'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='audiomessage',
+            index=models.Index(fields=['session', 'timestamp'], name='audiomessage_session_ts_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='chatmessage',
+            index=models.Index(fields=['session', 'timestamp'], name='chatmessage_session_ts_idx'),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.2.18 on 2026-10-17 18:42
+
+from django.db import migrations, models
+from django.db.models import Count, Q
+
+from core.seats import SEAT_STATUSES
+
+
+def count_occupancy(apps, schema_editor):
+    Session = apps.get_model('core', 'Session')
+    sessions = Session.objects.annotate(
+        seats=Count('participants', filter=Q(participants__status__in=SEAT_STATUSES))
+    )
+    for session in sessions:
+        Session.objects.filter(pk=session.pk).update(occupancy=session.seats)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0011_message_session_timestamp_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='session',
+            name='occupancy',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(count_occupancy, migrations.RunPython.noop),
+    ]
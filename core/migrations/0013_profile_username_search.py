@@ -0,0 +1,35 @@
+# Generated by Django 5.2.18 on 2026-10-17 18:49
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def fill_username_lower(apps, schema_editor):
+    Profile = apps.get_model('core', 'Profile')
+    profiles = list(Profile.objects.select_related('user'))
+    for profile in profiles:
+        profile.username_lower = profile.user.username.lower()
+    Profile.objects.bulk_update(profiles, ['username_lower'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0012_session_occupancy'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='profile',
+            name='username_lower',
+            field=models.CharField(default='', editable=False, max_length=150),
+        ),
+        migrations.RunPython(fill_username_lower, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='profile',
+            index=models.Index(
+                condition=models.Q(('is_discoverable', True)), fields=['username_lower'], name='profile_search_idx'
+            ),
+        ),
+    ]
@@ -1,4 +1,5 @@
 from django.db import models
+from django.utils import timezone
 from django.contrib.auth.models import User
 import random
 import string
@@ -12,9 +13,18 @@ class Session(models.Model):
     is_active = models.BooleanField(default=True)
     is_discoverable = models.BooleanField(default=True, help_text="Allow others to see this session in Available Sessions")
     max_participants = models.IntegerField(default=10)
+    # Participants holding a seat (core.seats.SEAT_STATUSES); only changed through core.seats
+    occupancy = models.PositiveIntegerField(default=0)
     is_suggestions_enabled = models.BooleanField(default=True)
+    is_fuzzy_hints_enabled = models.BooleanField(default=False, help_text="Also match command hints with small typos")
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            # Keyset pagination of the available sessions listing
+            models.Index(fields=['-created_at', '-id'], name='session_created_id_idx'),
+        ]
+
     def __str__(self):
         return f"Session {self.room_code} by {self.host.username}"
 
@@ -54,7 +64,14 @@ class ChatMessage(models.Model):
     sender = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True)
     sender_name = models.CharField(max_length=50) # In case sender is Guest
     content = models.TextField()
-    timestamp = models.DateTimeField(auto_now_add=True)
+    # Set when the message is sent, not when the write-behind buffer flushes it
+    timestamp = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            # Keyset pagination of a session's chat history
+            models.Index(fields=['session', 'timestamp'], name='chatmessage_session_ts_idx'),
+        ]
 
     def __str__(self):
         return f"Message by {self.sender_name}"
@@ -64,8 +81,14 @@ class AudioMessage(models.Model):
     sender = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True)
     sender_name = models.CharField(max_length=50)
     audio_file = models.FileField(upload_to='audio_messages/')
+    duration = models.FloatField(default=0, help_text="Length of the clip in seconds")
     timestamp = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['session', 'timestamp'], name='audiomessage_session_ts_idx'),
+        ]
+
     def __str__(self):
         return f"Audio by {self.sender_name}"
 
@@ -89,6 +112,15 @@ class CommandSuggestion(models.Model):
 class Profile(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='profile')
     is_discoverable = models.BooleanField(default=True, help_text="Allow hosts to find you by username in search")
+    # Lowercased copy of user.username for indexed prefix search
+    username_lower = models.CharField(max_length=150, default='', editable=False)
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=['username_lower'], condition=models.Q(is_discoverable=True), name='profile_search_idx'
+            ),
+        ]
 
     def __str__(self):
         return f"Profile of {self.user.username}"
@@ -100,10 +132,11 @@ from django.dispatch import receiver
 @receiver(post_save, sender=User)
 def create_user_profile(sender, instance, created, **kwargs):
     if created:
-        Profile.objects.create(user=instance)
+        Profile.objects.create(user=instance, username_lower=instance.username.lower())
 
 @receiver(post_save, sender=User)
 def save_user_profile(sender, instance, **kwargs):
     if not hasattr(instance, 'profile'):
-        Profile.objects.create(user=instance)
+        Profile.objects.create(user=instance, username_lower=instance.username.lower())
+    instance.profile.username_lower = instance.username.lower()
     instance.profile.save()
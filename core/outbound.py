@@ -0,0 +1,220 @@
+"""
+Bounded, prioritized send queues for WebSocket connections.
+
+Consumer handlers put outgoing frames on their connection's OutboundQueue
+instead of awaiting self.send, so a client on a slow link only ever delays
+itself. A writer task drains the queue highest priority first: signaling,
+control and sequenced room events (chat, joins, audio messages), then chat,
+then bulk (history pages). Sequenced events share the control lane so they
+go out in order and none is lost to eviction.
+
+The queue holds at most MAX_ITEMS frames. When it is full, the oldest frame
+of the lowest priority at or below the new one's is dropped, or the new
+frame is if everything queued outranks it; control frames are never
+dropped, so a connection with MAX_ITEMS of them queued is closed as too slow
+instead. Frames put with a coalescing key replace (or merge into) a queued
+frame with the same key instead of queueing behind it. A connection whose
+backlog stays at or above SLOW_THRESHOLD for SLOW_TIMEOUT seconds is
+reported as too slow, and the consumer closes it. If sending a frame fails,
+the error is logged, the queue closes and the consumer closes the socket,
+rather than leaving a dead writer behind that silently loses every later
+frame.
+"""
+import asyncio
+import json
+import logging
+import time
+import weakref
+from collections import deque
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'MAX_ITEMS': 256,
+    'SLOW_THRESHOLD': 128,
+    'SLOW_TIMEOUT': 10.0,
+}
+
+PRIORITY_CONTROL, PRIORITY_CHAT, PRIORITY_BULK = range(3)
+PRIORITY_NAMES = ('control', 'chat', 'bulk')
+
+# WebSocket close code sent to clients that cannot keep up
+SLOW_CLIENT_CLOSE_CODE = 4008
+# WebSocket close code sent when a frame could not be sent (internal error)
+SEND_FAILED_CLOSE_CODE = 1011
+
+_config = {**DEFAULTS, **getattr(settings, 'OUTBOUND_QUEUE', {})}
+_queues = weakref.WeakSet()
+_totals = {'dropped': 0, 'coalesced': 0, 'slow_disconnects': 0, 'send_errors': 0}
+
+
+class _Frame:
+    __slots__ = ('payload', 'key', 'queued_at')
+
+    def __init__(self, payload, key):
+        self.payload = payload
+        self.key = key
+        self.queued_at = time.monotonic()
+
+
+class OutboundQueue:
+    def __init__(self, send, on_slow=None, encode=json.dumps, max_items=None, slow_threshold=None,
+                 slow_timeout=None, on_error=None):
+        self._send = send
+        self._encode = encode
+        self._on_slow = on_slow
+        self._on_error = on_error
+        self.max_items = max_items or _config['MAX_ITEMS']
+        self.slow_threshold = slow_threshold or _config['SLOW_THRESHOLD']
+        self.slow_timeout = _config['SLOW_TIMEOUT'] if slow_timeout is None else slow_timeout
+
+        self._lanes = tuple(deque() for _ in PRIORITY_NAMES)
+        self._keyed = {}
+        self._ready = asyncio.Event()
+        self._task = None
+        self._pressure_since = None
+        self.closed = False
+
+        self.sent = 0
+        self.dropped = 0
+        self.coalesced = 0
+        self.max_depth = 0
+        _queues.add(self)
+
+    @property
+    def depth(self):
+        return sum(len(lane) for lane in self._lanes)
+
+    def metrics(self):
+        now = time.monotonic()
+        oldest = [lane[0].queued_at for lane in self._lanes if lane]
+        return {
+            'depth': self.depth,
+            **{f'{name}_depth': len(lane) for name, lane in zip(PRIORITY_NAMES, self._lanes)},
+            'oldest_ms': (now - min(oldest)) * 1000 if oldest else 0.0,
+            'max_depth': self.max_depth,
+            'sent': self.sent,
+            'dropped': self.dropped,
+            'coalesced': self.coalesced,
+        }
+
+    def put(self, priority, payload, key=None, merge=None):
+        """
+        Queue a frame (a dict, or already encoded text or bytes). With a `key`, a
+        queued frame with the same key is replaced, or combined with
+        merge(old, new), instead. Returns False if the frame was dropped.
+        """
+        if self.closed:
+            return False
+
+        if key is not None and key in self._keyed:
+            frame = self._keyed[key]
+            frame.payload = merge(frame.payload, payload) if merge else payload
+            self.coalesced += 1
+            _totals['coalesced'] += 1
+            return True
+
+        if priority == PRIORITY_CONTROL:
+            if len(self._lanes[PRIORITY_CONTROL]) >= self.max_items:
+                self._close_slow()
+                return False
+        elif self.depth >= self.max_items:
+            if not self._evict(priority):
+                self._count_drop()
+                return False
+
+        frame = _Frame(payload, key)
+        self._lanes[priority].append(frame)
+        if key is not None:
+            self._keyed[key] = frame
+        self.max_depth = max(self.max_depth, self.depth)
+        self._check_pressure()
+
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._run())
+        self._ready.set()
+        return True
+
+    def close(self):
+        self.closed = True
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def _evict(self, priority):
+        """Drop the oldest frame of the lowest priority not above `priority`."""
+        for lane in reversed(self._lanes[priority:]):
+            if lane:
+                frame = lane.popleft()
+                if frame.key is not None:
+                    self._keyed.pop(frame.key, None)
+                self._count_drop()
+                return True
+        return False
+
+    def _count_drop(self):
+        self.dropped += 1
+        _totals['dropped'] += 1
+
+    def _check_pressure(self):
+        if self.depth < self.slow_threshold:
+            self._pressure_since = None
+            return
+        now = time.monotonic()
+        if self._pressure_since is None:
+            self._pressure_since = now
+        elif now - self._pressure_since >= self.slow_timeout:
+            self._close_slow()
+
+    def _close_slow(self):
+        if self.closed:
+            return
+        _totals['slow_disconnects'] += 1
+        logger.warning('Closing slow WebSocket client: %s', self.metrics())
+        self.close()
+        if self._on_slow is not None:
+            self._on_slow()
+
+    def _pop(self):
+        for lane in self._lanes:
+            if lane:
+                frame = lane.popleft()
+                if frame.key is not None:
+                    self._keyed.pop(frame.key, None)
+                return frame
+        return None
+
+    async def _run(self):
+        try:
+            while True:
+                frame = self._pop()
+                if frame is None:
+                    self._ready.clear()
+                    await self._ready.wait()
+                    continue
+                payload = frame.payload
+                await self._send(payload if isinstance(payload, (str, bytes)) else self._encode(payload))
+                self.sent += 1
+                self._check_pressure()
+        except Exception:
+            _totals['send_errors'] += 1
+            logger.exception('Closing WebSocket client after a failed send: %s', self.metrics())
+            # Not close(): that would cancel this task while it reports the error
+            self.closed = True
+            if self._on_error is not None:
+                self._on_error()
+        finally:
+            self._task = None
+
+
+def metrics():
+    """Totals over every live connection in this process."""
+    queues = list(_queues)
+    return {
+        'connections': len(queues),
+        'queued': sum(queue.depth for queue in queues),
+        'max_depth': max((queue.depth for queue in queues), default=0),
+        **_totals,
+    }
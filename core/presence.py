@@ -0,0 +1,217 @@
+"""
+Who is online in each room, and how well they are connected.
+
+Session consumers report connects, disconnects and heartbeats to a
+process-wide PresenceRegistry, which keeps the live state in memory. At most
+once per FLUSH_INTERVAL it writes whatever changed to Participant: two
+set-based UPDATEs that move accepted participants to and from
+'disconnected', and one bulk_update of connection_quality and channel_name.
+It then pushes the changes to each affected room as one 'presence' diff.
+Sockets that miss heartbeats for STALE_AFTER seconds count as gone.
+
+State is per process: with several workers, each one reports the sockets it
+holds, and the database is the merged view used for connect snapshots.
+"""
+import asyncio
+import logging
+import time
+from collections import defaultdict
+
+from channels.db import database_sync_to_async
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.db import transaction
+
+from .models import Participant
+from .realtime import room_group_name
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'FLUSH_INTERVAL': 1.0,
+    'HEARTBEAT_INTERVAL': 15,
+    'STALE_AFTER': 45,
+}
+
+QUALITIES = {choice for choice, _ in Participant.CONNECTION_QUALITY_CHOICES}
+
+
+class _Member:
+    __slots__ = ('participant_id', 'channels', 'quality')
+
+    def __init__(self, participant_id, quality):
+        self.participant_id = participant_id
+        self.channels = {}  # channel name -> last heartbeat (monotonic)
+        self.quality = quality
+
+    def state(self):
+        """(online, quality, channel_name) as it should be stored."""
+        if not self.channels:
+            return False, self.quality, None
+        # The most recently active socket is the one to address directly
+        channel = max(self.channels, key=self.channels.get)
+        return True, self.quality, channel
+
+
+class PresenceRegistry:
+    def __init__(self, flush_interval, stale_after):
+        self.flush_interval = flush_interval
+        self.stale_after = stale_after
+        self._rooms = defaultdict(dict)  # room_code -> username -> _Member
+        self._dirty = set()  # (room_code, username)
+        self._written = {}  # participant_id -> last stored state
+        self._timer = None
+        self._timer_loop = None
+
+        self.flushes = 0
+        self.rows_written = 0
+        self.failed_flushes = 0
+
+    def metrics(self):
+        return {
+            'rooms': len(self._rooms),
+            'members': sum(len(members) for members in self._rooms.values()),
+            'pending_changes': len(self._dirty),
+            'flushes': self.flushes,
+            'failed_flushes': self.failed_flushes,
+            'rows_written': self.rows_written,
+        }
+
+    def connect(self, room_code, username, participant_id, channel_name, quality='high'):
+        member = self._rooms[room_code].get(username)
+        if member is None:
+            member = self._rooms[room_code][username] = _Member(participant_id, quality)
+        member.channels[channel_name] = time.monotonic()
+        self._changed(room_code, username)
+
+    def disconnect(self, room_code, username, channel_name):
+        member = self._rooms.get(room_code, {}).get(username)
+        if member is not None and member.channels.pop(channel_name, None) is not None:
+            self._changed(room_code, username)
+
+    def heartbeat(self, room_code, username, participant_id, channel_name, quality=None):
+        member = self._rooms.get(room_code, {}).get(username)
+        if member is None or channel_name not in member.channels:
+            # A socket we had given up on is alive after all
+            self.connect(room_code, username, participant_id, channel_name, quality or 'high')
+            return
+        member.channels[channel_name] = time.monotonic()
+        if quality in QUALITIES and quality != member.quality:
+            member.quality = quality
+            self._changed(room_code, username)
+
+    def snapshot(self, room_code):
+        """Online members of a room as seen by this process."""
+        return {
+            username: {'online': bool(member.channels), 'quality': member.quality}
+            for username, member in self._rooms.get(room_code, {}).items()
+            if member.channels
+        }
+
+    def _changed(self, room_code, username):
+        self._dirty.add((room_code, username))
+        self._schedule()
+
+    def _schedule(self):
+        loop = asyncio.get_running_loop()
+        if self._timer is not None and self._timer_loop is loop:
+            return
+        self._timer_loop = loop
+        self._timer = loop.call_later(self.flush_interval, self._on_timer)
+
+    def _on_timer(self):
+        self._timer = None
+        asyncio.ensure_future(self._tick())
+
+    async def _tick(self):
+        await self.flush()
+        # Keep ticking while anyone is here, to notice silent sockets
+        if self._rooms:
+            self._schedule()
+
+    def _expire_stale(self):
+        deadline = time.monotonic() - self.stale_after
+        for room_code, members in self._rooms.items():
+            for username, member in members.items():
+                stale = [channel for channel, seen in member.channels.items() if seen < deadline]
+                for channel in stale:
+                    del member.channels[channel]
+                if stale:
+                    self._dirty.add((room_code, username))
+
+    async def flush(self):
+        self._expire_stale()
+        dirty, self._dirty = self._dirty, set()
+
+        changes = []
+        for room_code, username in dirty:
+            member = self._rooms.get(room_code, {}).get(username)
+            if member is None:
+                continue
+            state = member.state()
+            if self._written.get(member.participant_id) != state:
+                changes.append((room_code, username, member.participant_id, state))
+        if not changes:
+            self._forget_offline(dirty)
+            return
+
+        try:
+            await database_sync_to_async(self._write)(changes)
+        except Exception:
+            logger.exception('Failed to write presence of %d participants', len(changes))
+            self.failed_flushes += 1
+            self._dirty |= dirty
+            return
+
+        self.flushes += 1
+        self.rows_written += len(changes)
+        for _, _, participant_id, state in changes:
+            self._written[participant_id] = state
+        self._forget_offline(dirty)
+        await self._push(changes)
+
+    def _write(self, changes):
+        online = [pid for _, _, pid, (is_online, _, _) in changes if is_online]
+        offline = [pid for _, _, pid, (is_online, _, _) in changes if not is_online]
+        with transaction.atomic():
+            # Only flip between these two, so a kick or reject always wins
+            if online:
+                Participant.objects.filter(id__in=online, status='disconnected').update(status='accepted')
+            if offline:
+                Participant.objects.filter(id__in=offline, status='accepted').update(status='disconnected')
+            Participant.objects.bulk_update(
+                [Participant(id=pid, connection_quality=quality, channel_name=channel)
+                 for _, _, pid, (_, quality, channel) in changes],
+                ['connection_quality', 'channel_name'],
+            )
+
+    def _forget_offline(self, keys):
+        for room_code, username in keys:
+            members = self._rooms.get(room_code)
+            member = members.get(username) if members else None
+            if member is not None and not member.channels:
+                del members[username]
+                self._written.pop(member.participant_id, None)
+                if not members:
+                    del self._rooms[room_code]
+
+    async def _push(self, changes):
+        channel_layer = get_channel_layer()
+        if channel_layer is None:
+            return
+        rooms = defaultdict(dict)
+        for room_code, username, _, (is_online, quality, _) in changes:
+            rooms[room_code][username] = {'online': is_online, 'quality': quality}
+        for room_code, members in rooms.items():
+            await channel_layer.group_send(room_group_name(room_code), {
+                'type': 'presence',
+                'changes': members,
+            })
+
+
+_config = {**DEFAULTS, **getattr(settings, 'PRESENCE', {})}
+HEARTBEAT_INTERVAL = _config['HEARTBEAT_INTERVAL']
+presence_registry = PresenceRegistry(
+    flush_interval=_config['FLUSH_INTERVAL'],
+    stale_after=_config['STALE_AFTER'],
+)
@@ -0,0 +1,79 @@
+"""
+Helpers for pushing server-side state changes from views to connected
+WebSocket consumers over the channel layer.
+"""
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.conf import settings
+
+# Session fields each SessionConsumer keeps a live copy of
+SESSION_SETTINGS_FIELDS = ('is_suggestions_enabled', 'is_fuzzy_hints_enabled', 'is_discoverable')
+
+# Every NotificationConsumer listens here for changes to the public session listing
+LOBBY_GROUP = 'lobby'
+
+# Channel layers whose groups never reach another process
+SINGLE_PROCESS_LAYERS = ('channels.layers.InMemoryChannelLayer',)
+
+
+def room_group_name(room_code):
+    return f'session_{room_code}'
+
+
+def user_group_name(user_id):
+    return f'user_{user_id}'
+
+
+def single_process_layer():
+    """Whether the default channel layer keeps every room within this process."""
+    layer = getattr(settings, 'CHANNEL_LAYERS', {}).get('default', {})
+    return layer.get('BACKEND') in SINGLE_PROCESS_LAYERS
+
+
+def session_settings(session):
+    return {field: getattr(session, field) for field in SESSION_SETTINGS_FIELDS}
+
+
+def group_send(group, event):
+    channel_layer = get_channel_layer()
+    if channel_layer is None:
+        return
+    async_to_sync(channel_layer.group_send)(group, event)
+
+
+def push_session_settings(session):
+    """Tell every consumer in the room about the session's current settings."""
+    group_send(room_group_name(session.room_code), {
+        'type': 'session_settings',
+        'settings': session_settings(session),
+    })
+
+
+def evict_member(room_code, username, status):
+    """
+    Drop every live socket `username` has in the room, wherever it is
+    connected, after they were kicked or rejected.
+    """
+    group_send(room_group_name(room_code), {
+        'type': 'evict',
+        'username': username,
+        'status': status,
+    })
+
+
+def notify_user(user_id, event, **data):
+    """Push an event to all of a user's notification sockets."""
+    group_send(user_group_name(user_id), {
+        'type': 'notify',
+        'event': event,
+        'data': data,
+    })
+
+
+def notify_lobby(event='sessions_changed', **data):
+    """Tell every connected user that the available sessions listing changed."""
+    group_send(LOBBY_GROUP, {
+        'type': 'notify',
+        'event': event,
+        'data': data,
+    })
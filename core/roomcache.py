@@ -0,0 +1,145 @@
+"""
+Read-through cache of session lookups.
+
+Nearly every room view, and every SessionConsumer handshake, starts by
+resolving a room code to its session and then the user's participant row.
+Both answers change rarely, so they are kept in the Django cache:
+
+* room code -> the session's id, host and settings
+* (session id, user id) -> the participant's id, status, request type and
+  display name
+
+Missing sessions and participants are cached too, so polling a room the user
+has no seat in stays off the database. Entries are dropped whenever a Session
+or Participant is saved or deleted, which covers every change made through
+seats.set_status(). They are dropped again when the transaction commits, so a
+reader racing the write cannot cache the old row for long.
+
+Presence flips members between 'accepted' and 'disconnected' with bulk
+updates that send no signals. A cached member status may therefore show
+either one, and callers treat the two alike (seats.MEMBER_STATUSES).
+Occupancy moves with every seat change and is never cached.
+
+Invalidation only reaches other processes through a shared backend (Redis,
+Memcached, the database cache). With a process-local one such as the default
+LocMemCache, a worker could keep serving a row another worker has changed.
+So by default the cache is on when the backend is shared, or when the
+channel layer keeps everything in one process anyway (the shipped
+InMemoryChannelLayer setup), and off for several workers sharing only a
+local cache. Whether a socket may join is always decided against the
+database (SessionConsumer.authorize).
+"""
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.http import Http404
+
+from .models import Participant, Session
+from .realtime import SESSION_SETTINGS_FIELDS, single_process_layer
+
+# Backends whose entries live in one process only
+LOCAL_BACKENDS = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+DEFAULTS = {
+    # None: on when the default cache is shared or there is only one process
+    'ENABLED': None,
+    # Seconds an entry may be served before it is read again
+    'TIMEOUT': 300,
+}
+
+_config = {**DEFAULTS, **getattr(settings, 'ROOM_CACHE', {})}
+if _config['ENABLED'] is None:
+    _config['ENABLED'] = (
+        settings.CACHES['default']['BACKEND'] not in LOCAL_BACKENDS or single_process_layer()
+    )
+
+SESSION_FIELDS = ('id', 'room_code', 'host_id', 'host__username', 'is_active', 'max_participants',
+                  *SESSION_SETTINGS_FIELDS)
+MEMBER_FIELDS = ('id', 'status', 'request_type', 'display_name')
+
+_totals = {'hits': 0, 'misses': 0, 'invalidations': 0}
+
+
+def metrics():
+    return dict(_totals)
+
+
+def _session_key(room_code):
+    return f'room:{room_code}'
+
+
+def _member_key(session_id, user_id):
+    return f'room_member:{session_id}:{user_id}'
+
+
+def _read_through(key, fetch):
+    if not _config['ENABLED']:
+        return fetch()
+    entry = cache.get(key)
+    if entry is None:
+        _totals['misses'] += 1
+        # Cached as {} when there is no row
+        entry = fetch() or {}
+        cache.set(key, entry, _config['TIMEOUT'])
+    else:
+        _totals['hits'] += 1
+    return entry or None
+
+
+def get_session(room_code):
+    """
+    The session with `room_code` as a dict of SESSION_FIELDS, or None.
+    Entries are shared and must not be mutated.
+    """
+    return _read_through(
+        _session_key(room_code),
+        lambda: Session.objects.filter(room_code=room_code).values(*SESSION_FIELDS).first(),
+    )
+
+
+def get_member(session_id, user_id):
+    """`user_id`'s participant row in the session as a dict of MEMBER_FIELDS, or None."""
+    if user_id is None:
+        return None
+    return _read_through(
+        _member_key(session_id, user_id),
+        lambda: Participant.objects.filter(session_id=session_id, user_id=user_id).values(*MEMBER_FIELDS).first(),
+    )
+
+
+def get_session_or_404(room_code, active_only=False):
+    session = get_session(room_code)
+    if session is None or (active_only and not session['is_active']):
+        raise Http404('No session matches the given room code.')
+    return session
+
+
+def get_member_or_404(session_id, user_id):
+    member = get_member(session_id, user_id)
+    if member is None:
+        raise Http404('Not a participant of this session.')
+    return member
+
+
+def _forget(key):
+    _totals['invalidations'] += 1
+    cache.delete(key)
+    transaction.on_commit(lambda: cache.delete(key))
+
+
+@receiver(post_save, sender=Session)
+@receiver(post_delete, sender=Session)
+def _session_changed(sender, instance, **kwargs):
+    _forget(_session_key(instance.room_code))
+
+
+@receiver(post_save, sender=Participant)
+@receiver(post_delete, sender=Participant)
+def _participant_changed(sender, instance, **kwargs):
+    if instance.user_id is not None:
+        _forget(_member_key(instance.session_id, instance.user_id))
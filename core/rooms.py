@@ -0,0 +1,44 @@
+"""
+Process-local registry of who is connected to which room.
+
+Maps room_code -> username -> the channel names of that user's open sockets
+(one per tab), so consumers can address a participant directly with
+channel_layer.send instead of broadcasting to the whole room group.
+"""
+from collections import defaultdict
+
+
+class RoomRegistry:
+    def __init__(self):
+        self._rooms = defaultdict(dict)
+
+    def add(self, room_code, username, channel_name):
+        self._rooms[room_code].setdefault(username, set()).add(channel_name)
+
+    def remove(self, room_code, username, channel_name):
+        members = self._rooms.get(room_code)
+        if not members:
+            return
+        channels = members.get(username)
+        if channels is not None:
+            channels.discard(channel_name)
+            if not channels:
+                del members[username]
+        if not members:
+            del self._rooms[room_code]
+
+    def channels(self, room_code, username):
+        return tuple(self._rooms.get(room_code, {}).get(username, ()))
+
+    def usernames(self, room_code):
+        return list(self._rooms.get(room_code, {}))
+
+    def socket_counts(self):
+        """Open sockets per room."""
+        return {
+            room_code: sum(len(channels) for channels in members.values())
+            for room_code, members in self._rooms.items()
+        }
+
+
+registry = RoomRegistry()
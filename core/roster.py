@@ -0,0 +1,179 @@
+"""
+Server-owned participant roster for each room, synced to pages by version.
+
+A room's roster maps each username holding a seat to what the page shows of
+them: status ('pending' or 'accepted'), display name and request type. It is
+built in memory from the Participant rows the first socket in a process
+loads anyway, and dropped when the room's last socket here closes, since
+nothing keeps it current after that.
+
+Every seat change goes through seats.set_status(), and its post_save sends a
+'roster_change' event to the room once the transaction commits. Accepting,
+rejecting, kicking, inviting, declining an invitation and joining all arrive
+the same way, wherever the view ran. Deleted participants (admin deletes,
+cascades) are removed the same way by post_delete. The room code and
+username come from the relations set_status() already loaded. A save made
+without them costs one small query each, never a full related-object load. The first socket in a process to receive
+the event applies it and bumps the version. The others find the resulting
+delta by event_id, so each change is one version and one encoding per
+process.
+
+A page starts from the snapshot sent on connect and applies deltas whose
+version follows its own. When one doesn't, a delta went missing and it asks
+for a fresh snapshot.
+"""
+import itertools
+import uuid
+from collections import OrderedDict
+
+from django.db import transaction
+from django.contrib.auth.models import User
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from . import seats, wire
+from .models import Participant, Session
+from .realtime import group_send, room_group_name
+
+# Deltas remembered per room, for sockets that receive the event after the first
+REMEMBERED_DELTAS = 64
+
+_totals = {'built': 0, 'deltas': 0, 'unchanged': 0, 'snapshots': 0}
+
+_epochs = itertools.count(1)
+
+
+def member_entry(status, display_name, request_type):
+    """What pages see of a participant, or None once they no longer hold a seat."""
+    if not seats.holds_seat(status):
+        return None
+    # Presence tells connected from disconnected members apart
+    return {
+        'status': 'pending' if status == 'pending' else 'accepted',
+        'display_name': display_name,
+        'request_type': request_type,
+    }
+
+
+def change_event(username, member):
+    """A channel-layer event setting `username`'s roster entry to `member` (None removes them)."""
+    return {'type': 'roster_change', 'event_id': wire.new_event_id(), 'username': username, 'member': member}
+
+
+class Roster:
+    def __init__(self, members):
+        # Unique per roster: versions of different rosters can't be compared
+        self.epoch = f'{uuid.uuid4().hex[:8]}{next(_epochs)}'
+        self.version = 0
+        self.members = members
+        self._deltas = OrderedDict()
+
+    def apply(self, event):
+        """
+        The delta frame for a roster_change event, encoded by codec name as
+        for wire.encoded(), or None if the roster already matched it.
+        """
+        event_id = event['event_id']
+        if event_id in self._deltas:
+            return self._deltas[event_id]
+        username, member = event['username'], event['member']
+        if self.members.get(username) == member:
+            delta = None
+            _totals['unchanged'] += 1
+        else:
+            if member is None:
+                del self.members[username]
+            else:
+                self.members[username] = member
+            self.version += 1
+            delta = {'encoded': wire.encode_all({
+                'type': 'roster',
+                'epoch': self.epoch,
+                'version': self.version,
+                'changes': {username: member}
+            })}
+            _totals['deltas'] += 1
+        self._deltas[event_id] = delta
+        if len(self._deltas) > REMEMBERED_DELTAS:
+            self._deltas.popitem(last=False)
+        return delta
+
+    def snapshot(self):
+        _totals['snapshots'] += 1
+        return {'type': 'roster', 'epoch': self.epoch, 'version': self.version, 'members': dict(self.members)}
+
+
+class RoomRosters:
+    def __init__(self):
+        self._rosters = {}
+
+    def get(self, room_code):
+        return self._rosters.get(room_code)
+
+    def build(self, room_code, rows):
+        """
+        The room's roster, built from (username, status, display_name,
+        request_type) rows unless another socket here built it first.
+        """
+        roster = self._rosters.get(room_code)
+        if roster is None:
+            members = {}
+            for username, status, display_name, request_type in rows:
+                member = member_entry(status, display_name, request_type)
+                if member is not None:
+                    members[username] = member
+            roster = self._rosters[room_code] = Roster(members)
+            _totals['built'] += 1
+        return roster
+
+    def drop(self, room_code):
+        self._rosters.pop(room_code, None)
+
+    def metrics(self):
+        return {
+            'rooms': len(self._rosters),
+            'members': sum(len(roster.members) for roster in self._rosters.values()),
+            **_totals,
+        }
+
+
+rosters = RoomRosters()
+
+
+def metrics():
+    return rosters.metrics()
+
+
+def _room_and_username(participant):
+    if Participant.session.is_cached(participant):
+        room_code = participant.session.room_code
+    else:
+        room_code = Session.objects.filter(id=participant.session_id).values_list('room_code', flat=True).first()
+    if Participant.user.is_cached(participant):
+        username = participant.user.username
+    else:
+        username = User.objects.filter(id=participant.user_id).values_list('username', flat=True).first()
+    return room_code, username
+
+
+def _announce(participant, member):
+    room_code, username = _room_and_username(participant)
+    if room_code is None or username is None:
+        return
+    event = change_event(username, member)
+    # Changes that roll back are never announced
+    transaction.on_commit(lambda: group_send(room_group_name(room_code), event))
+
+
+@receiver(post_save, sender=Participant)
+def _participant_changed(sender, instance, **kwargs):
+    if instance.user_id is None:
+        return
+    _announce(instance, member_entry(instance.status, instance.display_name, instance.request_type))
+
+
+@receiver(post_delete, sender=Participant)
+def _participant_deleted(sender, instance, **kwargs):
+    if instance.user_id is None:
+        return
+    _announce(instance, None)
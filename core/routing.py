@@ -1,6 +1,9 @@
+from channels.auth import AuthMiddlewareStack
 from django.urls import re_path
 from . import consumers
 
 websocket_urlpatterns = [
+    # Authenticated by the signed connect token in its query string
     re_path(r'ws/session/(?P<room_code>\w+)/$', consumers.SessionConsumer.as_asgi()),
+    re_path(r'ws/notifications/$', AuthMiddlewareStack(consumers.NotificationConsumer.as_asgi())),
 ]
@@ -0,0 +1,73 @@
+"""
+Seat accounting for sessions.
+
+A participant holds a seat while their status is pending, accepted or
+disconnected (accepted, with no socket open), and Session.occupancy counts
+those seats. Every status change that can take or release a seat goes
+through set_status(), which locks the session row and moves the counter
+with an F() update in the same transaction as the participant row.
+Simultaneous joins therefore cannot overfill max_participants, and capacity
+checks never need a COUNT.
+"""
+from django.db import transaction
+from django.db.models import F
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
+
+from .models import Participant, Session
+
+SEAT_STATUSES = ('pending', 'accepted', 'disconnected')
+# Accepted into the session, whether or not currently connected
+MEMBER_STATUSES = ('accepted', 'disconnected')
+
+
+class SessionFull(Exception):
+    """Raised when a participant needs a seat and the session has none left."""
+
+
+def holds_seat(status):
+    return status in SEAT_STATUSES
+
+
+def set_status(session, user, status, **fields):
+    """
+    Create or update `user`'s participant row in `session` with `status` and
+    any other `fields`, taking or releasing a seat as needed.
+
+    Returns (participant, created). Raises SessionFull if a seat is needed
+    and none is free; nothing is changed in that case.
+    """
+    with transaction.atomic():
+        # Seat changes in one session happen one at a time
+        Session.objects.select_for_update().only('id').get(pk=session.pk)
+
+        # The session and user come along for post_save receivers (roster)
+        participant = (
+            Participant.objects.filter(session=session, user=user).select_related('session', 'user').first()
+        )
+        delta = holds_seat(status) - (participant is not None and holds_seat(participant.status))
+
+        seats = Session.objects.filter(pk=session.pk)
+        if delta > 0:
+            if not seats.filter(occupancy__lt=F('max_participants')).update(occupancy=F('occupancy') + 1):
+                raise SessionFull(session.room_code)
+        elif delta < 0:
+            seats.update(occupancy=F('occupancy') - 1)
+
+        created = participant is None
+        if created:
+            participant = Participant.objects.create(session=session, user=user, status=status, **fields)
+        else:
+            participant.status = status
+            for name, value in fields.items():
+                setattr(participant, name, value)
+            participant.save(update_fields=['status', *fields])
+
+    session.occupancy += delta
+    return participant, created
+
+
+@receiver(post_delete, sender=Participant)
+def _participant_deleted(sender, instance, **kwargs):
+    if holds_seat(instance.status):
+        Session.objects.filter(pk=instance.session_id).update(occupancy=F('occupancy') - 1)
@@ -0,0 +1,80 @@
+"""
+Batching of WebRTC signaling messages.
+
+Trickle ICE sends candidates in bursts of small messages. With batching on,
+each session consumer holds the signals its client sends to a target for
+WINDOW seconds, then forwards them as one channel-layer event. The target
+gets one 'signal_batch' frame listing the payloads in the order they were
+sent. A signal that is alone in its window still goes out as a plain
+'signal' frame.
+"""
+import asyncio
+
+from django.conf import settings
+
+DEFAULTS = {
+    'ENABLED': False,
+    'WINDOW': 0.02,
+}
+
+_totals = {'signals': 0, 'frames': 0}
+
+
+class SignalBatcher:
+    def __init__(self, window, forward):
+        self.window = window
+        self._forward = forward  # async (target, payloads)
+        self._pending = {}  # target -> payloads, in arrival order
+        self._timers = {}
+        # Batches go out one at a time, so they cannot overtake each other
+        self._lock = asyncio.Lock()
+
+        self.signals = 0
+        self.frames = 0
+
+    def metrics(self):
+        return {
+            'signals': self.signals,
+            'frames': self.frames,
+            'frames_saved': self.signals - self.frames,
+            'pending': sum(len(payloads) for payloads in self._pending.values()),
+        }
+
+    def add(self, target, payload):
+        self.signals += 1
+        _totals['signals'] += 1
+        pending = self._pending.get(target)
+        if pending is not None:
+            pending.append(payload)
+            return
+        self._pending[target] = [payload]
+        self._timers[target] = asyncio.get_running_loop().call_later(self.window, self._on_timer, target)
+
+    def _on_timer(self, target):
+        del self._timers[target]
+        asyncio.ensure_future(self._send(target, self._pending.pop(target)))
+
+    async def _send(self, target, payloads):
+        async with self._lock:
+            self.frames += 1
+            _totals['frames'] += 1
+            await self._forward(target, payloads)
+
+    async def flush(self):
+        """Forward everything held back, e.g. when the socket closes."""
+        for timer in self._timers.values():
+            timer.cancel()
+        self._timers = {}
+        pending, self._pending = self._pending, {}
+        for target, payloads in pending.items():
+            await self._send(target, payloads)
+
+
+def metrics():
+    """Totals over every connection in this process."""
+    return {**_totals, 'frames_saved': _totals['signals'] - _totals['frames']}
+
+
+_config = {**DEFAULTS, **getattr(settings, 'SIGNAL_BATCHING', {})}
+# None when batching is off
+BATCH_WINDOW = _config['WINDOW'] if _config['ENABLED'] else None
@@ -60,10 +60,37 @@ function showNotification(message, type = 'info') {
     }, 4000);
 }
 
+// ========== PUSH NOTIFICATIONS ==========
+
+// Polling is only a slow fallback; changes arrive over the notification socket
+const FALLBACK_POLL_INTERVAL = 60000;
+
+/**
+ * Open the per-user notification socket and call onEvent(data) for every
+ * pushed event (invitation, join_request, request_status, invite_response,
+ * sessions_changed). Reconnects with backoff if the socket drops.
+ */
+function connectNotifications(onEvent) {
+    const protocol = window.location.protocol === 'https:' ? 'wss://' : 'ws://';
+    let retryDelay = 1000;
+
+    function open() {
+        const socket = new WebSocket(protocol + window.location.host + '/ws/notifications/');
+        socket.onopen = () => { retryDelay = 1000; };
+        socket.onmessage = (e) => onEvent(JSON.parse(e.data));
+        socket.onclose = () => {
+            setTimeout(open, retryDelay);
+            retryDelay = Math.min(retryDelay * 2, 30000);
+        };
+    }
+
+    open();
+}
+
 // ========== PARTICIPANT FUNCTIONS ==========
 
 /**
- * Poll invitations for the current user every 2 seconds
+ * Show invitations as they are pushed, with a slow polling fallback
  * Shows modal when invitation received
  */
 function startPollingInvitations() {
@@ -81,10 +108,13 @@ function startPollingInvitations() {
         .catch(err => console.log('Poll invitations error:', err));
     }
 
+    connectNotifications(data => {
+        if (data.type === 'invitation') poll();
+    });
+
     // Initial poll
     poll();
-    // Poll every 2 seconds
-    return setInterval(poll, 2000);
+    return setInterval(poll, FALLBACK_POLL_INTERVAL);
 }
 
 /**
@@ -227,7 +257,7 @@ function joinWithCode(roomCode) {
 // ========== HOST FUNCTIONS ==========
 
 /**
- * Poll pending join requests for host every 2 seconds
+ * Refresh pending join requests for host when one is pushed, with a slow polling fallback
  */
 function startPollingRequests(roomCode) {
     function poll() {
@@ -244,10 +274,13 @@ function startPollingRequests(roomCode) {
         .catch(err => console.log('Poll requests error:', err));
     }
 
+    connectNotifications(data => {
+        if (data.type === 'join_request' && data.room_code === roomCode) poll();
+    });
+
     // Initial poll
     poll();
-    // Poll every 2 seconds
-    return setInterval(poll, 2000);
+    return setInterval(poll, FALLBACK_POLL_INTERVAL);
 }
 
 /**
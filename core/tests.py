@@ -1,3 +1,1596 @@
-from django.test import TestCase
+import asyncio
+import json
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import async_to_sync, sync_to_async
+from channels.db import database_sync_to_async
+from channels.exceptions import ChannelFull
+from channels.layers import get_channel_layer
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.cache import cache
+from django.db import OperationalError, connection, connections, transaction
+from django.test import Client, SimpleTestCase, TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import URLPattern, get_resolver, reverse
+from django.utils import timezone
+
+from . import eventlog, hints, media, metrics, roomcache, roster, seats, tokens, topology, wire
+from .chatlog import ChatWriteBehind, chat_writer
+from .consumers import FORBIDDEN_CLOSE_CODE, REMOVED_CLOSE_CODE, merge_presence
+from .layers import UnixSocketChannelLayer
+from .models import AudioMessage, ChatMessage, CommandSuggestion, Notification, Session, Participant
+from .outbound import PRIORITY_BULK, PRIORITY_CHAT, PRIORITY_CONTROL, OutboundQueue
+from .presence import PresenceRegistry, presence_registry
+from .realtime import room_group_name
+from .routing import websocket_urlpatterns
+from .signaling import SignalBatcher
+from .topology import RelayTree
+
+
+def session_path(session, user):
+    return f'/ws/session/{session.room_code}/?token={tokens.issue_for(session, user)}'
+
+
+async def receive_all(socket, kind):
+    """Every frame of type `kind` until the socket goes quiet."""
+    frames = []
+    while not await socket.receive_nothing(timeout=0.2):
+        frame = await socket.receive_json_from()
+        if frame['type'] == kind:
+            frames.append(frame)
+    return frames
+
+
+class RoomSocketTestCase(TransactionTestCase):
+    """
+    A session with an accepted host and guest, for tests that open its
+    WebSockets. Tests finish with close_all(), which flushes the chat and
+    presence buffers and closes every socket opened through open().
+    """
+
+    session_fields = {}
+    # None leaves the guest without a participant row
+    guest_status = 'accepted'
+
+    def setUp(self):
+        cache.clear()
+        self.host = User.objects.create(username='host')
+        self.guest = User.objects.create(username='guest')
+        self.session = Session.objects.create(host=self.host, **self.session_fields)
+        seats.set_status(self.session, self.host, 'accepted')
+        if self.guest_status is not None:
+            seats.set_status(self.session, self.guest, self.guest_status)
+        self.app = URLRouter(websocket_urlpatterns)
+        self.sockets = []
+
+    async def connect(self, user, resume=None, subprotocols=None):
+        """An accepted socket for `user`, and the subprotocol it was accepted with."""
+        path = session_path(self.session, user) + (f'&resume={resume}' if resume else '')
+        socket = WebsocketCommunicator(self.app, path, subprotocols=subprotocols)
+        connected, subprotocol = await socket.connect()
+        self.assertTrue(connected)
+        self.sockets.append(socket)
+        return socket, subprotocol
+
+    async def open(self, user, resume=None):
+        return (await self.connect(user, resume))[0]
+
+    async def close_all(self):
+        await chat_writer.flush()
+        for socket in self.sockets:
+            if not socket.future.done():
+                await socket.disconnect()
+        await presence_registry.flush()
+
+
+class HintMatcherTests(SimpleTestCase):
+    CATALOG = [
+        ('screen share', 'share'),
+        ('screenshot', 'screenshot'),
+        ('screen', 'screen'),
+        ('copy', 'copy'),
+        ('paste', 'paste'),
+        ('Task Manager', 'task manager'),
+        ('c++', 'c++'),
+        ('alt-tab', 'alt-tab'),
+        ('taskbar settings', 'taskbar settings'),
+    ]
+
+    @staticmethod
+    def regex_loop(entries, text):
+        """The per-keyword regex loop HintMatcher replaced."""
+        text = text.lower()
+        for keyword, hint in entries:
+            if re.search(r'\b' + re.escape(keyword.lower()) + r'\b', text):
+                return hint
+        for word, hint in hints.FALLBACK_HINTS:
+            if re.search(r'\b' + re.escape(word) + r'\b', text):
+                return hint
+        return None
+
+    def test_matches_the_regex_loop(self):
+        matcher = hints.HintMatcher(self.CATALOG)
+        for text in [
+            '',
+            'nothing to see here',
+            'take a screenshot of my screen',       # catalog order, not text order
+            'paste it, then copy it',
+            'screen share now',
+            'screenshots',                           # no boundary after the keyword
+            'my screen.',
+            'COPY that',
+            'copying and pasting',
+            'open task manager',
+            'open task  manager',
+            'i write c++ daily',
+            'c++11',
+            'press alt-tab twice',
+            'alt-tabbing',
+            'right-click the taskbar',               # fallback
+            'taskbar settings are hidden',           # catalog wins over the fallback
+            'the taskbars',
+            'screen_share',
+            'über screen',
+        ]:
+            with self.subTest(text):
+                self.assertEqual(matcher.match(text), self.regex_loop(self.CATALOG, text))
+
+
+class FuzzyHintTests(TestCase):
+    CATALOG = [
+        ('screenshot', 'Tip: screenshot'),
+        ('paste', 'Tip: paste'),
+        ('copy', 'Tip: copy'),
+        ('task manager', 'Tip: task manager'),
+    ]
+
+    def setUp(self):
+        self.index = hints.FuzzyHintIndex(self.CATALOG)
+
+    def test_typos_find_their_keyword(self):
+        for text, hint in [
+            ('how do I take a screenshto', 'Tip: screenshot'),   # transposition
+            ('screnshot please', 'Tip: screenshot'),             # deletion
+            ('pastr it here', 'Tip: paste'),                     # substitution
+            ('open task manger', 'Tip: task manager'),           # within a phrase
+        ]:
+            with self.subTest(text):
+                self.assertEqual(self.index.match(text), hint)
+
+    def test_near_misses_are_rejected(self):
+        for text in ('what a taste', 'share your screen', 'wasted time', 'ask a manager'):
+            with self.subTest(text):
+                self.assertIsNone(self.index.match(text))
+
+    def test_short_keywords_must_match_exactly(self):
+        self.assertEqual(self.index.match('copy that'), 'Tip: copy')
+        for text in ('copt that', 'cop that', 'coppy that'):
+            with self.subTest(text):
+                self.assertIsNone(self.index.match(text))
+
+    def test_catalog_changes_from_other_processes_show_up_after_the_ttl(self):
+        hints.invalidate()
+        self.assertEqual(hints.suggest_from_memory('paste it'), (False, None))
+        row = CommandSuggestion.objects.create(keyword='paste', suggestion='Ctrl+V', description='paste')
+        self.assertEqual(hints.suggest('paste it'), 'Tip: Ctrl+V - paste')
+        self.assertEqual(hints.suggest_from_memory('paste it'), (True, 'Tip: Ctrl+V - paste'))
+
+        # Written without signals, as another process would
+        CommandSuggestion.objects.filter(id=row.id).update(suggestion='Win+V')
+        self.assertEqual(hints.suggest('paste it'), 'Tip: Ctrl+V - paste')
+        with mock.patch.object(hints.time, 'monotonic', return_value=time.monotonic() + 31):
+            self.assertEqual(hints.suggest_from_memory('paste it'), (False, None))
+            self.assertEqual(hints.suggest('paste it'), 'Tip: Win+V - paste')
+
+    def test_sessions_start_with_fuzzy_hints_off(self):
+        CommandSuggestion.objects.create(keyword='paste', suggestion='Ctrl+V', description='paste')
+        host = User.objects.create(username='host')
+        self.assertFalse(Session.objects.create(host=host).is_fuzzy_hints_enabled)
+        self.assertIsNone(hints.suggest('pastr it here'))
+        self.assertEqual(hints.suggest('pastr it here', fuzzy=True), 'Tip: Ctrl+V - paste')
+
+
+class AvailableSessionsTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.viewer = User.objects.create(username='viewer')
+        self.client.force_login(self.viewer)
+
+    def make_sessions(self, count, participants=3):
+        for i in range(Session.objects.count(), Session.objects.count() + count):
+            host = User.objects.create(username=f'host{i}')
+            session = Session.objects.create(host=host)
+            Participant.objects.create(user=host, session=session, status='accepted')
+            for j in range(participants - 1):
+                guest = User.objects.create(username=f'guest{i}_{j}')
+                Participant.objects.create(user=guest, session=session, status='accepted')
+
+    def count_queries(self, **params):
+        cache.clear()
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(reverse('available_sessions'), params)
+        self.assertEqual(response.status_code, 200)
+        return len(ctx.captured_queries), response.json()
+
+    def test_query_count_does_not_grow_with_sessions(self):
+        self.make_sessions(3)
+        small, data = self.count_queries()
+        self.assertEqual(len(data['sessions']), 3)
+
+        self.make_sessions(30)
+        large, data = self.count_queries(limit=50)
+        self.assertEqual(len(data['sessions']), 33)
+        self.assertEqual(small, large)
+
+    def test_participant_counts(self):
+        self.make_sessions(2, participants=4)
+        session = Session.objects.first()
+        Participant.objects.create(
+            user=User.objects.create(username='pending'),
+            session=session, status='pending'
+        )
+        _, data = self.count_queries()
+        self.assertEqual([s['participant_count'] for s in data['sessions']], [4, 4])
+
+    def test_cursor_pagination(self):
+        self.make_sessions(5, participants=1)
+        seen = []
+        cursor = None
+        while True:
+            params = {'limit': 2}
+            if cursor:
+                params['cursor'] = cursor
+            data = self.client.get(reverse('available_sessions'), params).json()
+            seen += [s['room_code'] for s in data['sessions']]
+            cursor = data['next_cursor']
+            if not cursor:
+                break
+        expected = list(Session.objects.order_by('-created_at', '-id').values_list('room_code', flat=True))
+        self.assertEqual(seen, expected)
+
+    def test_excludes_own_sessions(self):
+        self.make_sessions(2, participants=1)
+        joined = Session.objects.first()
+        Participant.objects.create(user=self.viewer, session=joined, status='pending')
+        Session.objects.create(host=self.viewer)
+        _, data = self.count_queries()
+        self.assertEqual([s['id'] for s in data['sessions']],
+                         list(Session.objects.exclude(host=self.viewer).exclude(id=joined.id)
+                              .order_by('-created_at', '-id').values_list('id', flat=True)))
+
+    def test_listing_cache_invalidated_on_session_change(self):
+        self.make_sessions(2, participants=1)
+        url = reverse('available_sessions')
+        self.assertEqual(len(self.client.get(url).json()['sessions']), 2)
+
+        hidden = Session.objects.first()
+        hidden.is_discoverable = False
+        hidden.save()
+        self.assertEqual(len(self.client.get(url).json()['sessions']), 1)
+
+    def test_own_sessions_never_leave_a_page_short(self):
+        self.make_sessions(3, participants=1)
+        for session in Session.objects.order_by('-created_at', '-id')[:2]:
+            Participant.objects.create(user=self.viewer, session=session, status='accepted')
+        data = self.client.get(reverse('available_sessions'), {'limit': 2}).json()
+        self.assertEqual(len(data['sessions']), 1)
+        self.assertIsNone(data['next_cursor'])
+
+        self.make_sessions(3, participants=1)
+        Session.objects.create(host=self.viewer)
+        seen, cursor = [], None
+        while True:
+            params = {'limit': 2, 'cursor': cursor} if cursor else {'limit': 2}
+            data = self.client.get(reverse('available_sessions'), params).json()
+            self.assertTrue(data['sessions'])
+            seen += [s['id'] for s in data['sessions']]
+            if not (cursor := data['next_cursor']):
+                break
+        self.assertEqual(len(seen), 4)
+
+    def test_participant_counts_follow_seat_changes(self):
+        self.make_sessions(1, participants=1)
+        session = Session.objects.get()
+        url = reverse('available_sessions')
+        self.assertEqual(self.client.get(url).json()['sessions'][0]['participant_count'], 1)
+        seats.set_status(session, User.objects.create(username='joiner'), 'accepted')
+        self.assertEqual(self.client.get(url).json()['sessions'][0]['participant_count'], 2)
+
+    def test_invalid_cursor(self):
+        response = self.client.get(reverse('available_sessions'), {'cursor': 'not-a-cursor'})
+        self.assertEqual(response.status_code, 400)
+
+
+class ChatHistoryTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.host = User.objects.create(username='host')
+        self.session = Session.objects.create(host=self.host)
+        Participant.objects.create(user=self.host, session=self.session, status='accepted')
+        self.client.force_login(self.host)
+
+    def fetch(self, **params):
+        response = self.client.get(reverse('chat_history', args=[self.session.room_code]), params)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_pages_walk_back_through_mixed_messages(self):
+        start = timezone.now()
+        for i in range(7):
+            ChatMessage.objects.create(session=self.session, sender_name='host',
+                                       content=f'line {i}', timestamp=start + timedelta(seconds=i))
+        # Same timestamp as a chat line, so the kind tie-break is exercised
+        audio = AudioMessage.objects.create(session=self.session, sender_name='host', audio_file='a.webm')
+        AudioMessage.objects.filter(id=audio.id).update(timestamp=start + timedelta(seconds=3))
+
+        pages = []
+        cursor = None
+        while True:
+            params = {'limit': 3}
+            if cursor:
+                params['before'] = cursor
+            data = self.fetch(**params)
+            pages.insert(0, data['messages'])
+            cursor = data['next_cursor']
+            if not cursor:
+                break
+
+        messages = [m for page in pages for m in page]
+        self.assertEqual(
+            [m.get('message', 'audio') for m in messages],
+            ['line 0', 'line 1', 'line 2', 'line 3', 'audio', 'line 4', 'line 5', 'line 6']
+        )
+
+    def test_requires_accepted_participant(self):
+        self.client.force_login(User.objects.create(username='outsider'))
+        response = self.client.get(reverse('chat_history', args=[self.session.room_code]))
+        self.assertEqual(response.status_code, 403)
+
+    def test_invalid_cursor(self):
+        response = self.client.get(reverse('chat_history', args=[self.session.room_code]),
+                                   {'before': 'nope'})
+        self.assertEqual(response.status_code, 400)
+
+
+class ChatWriteBehindTests(TransactionTestCase):
+    def setUp(self):
+        self.host = User.objects.create(username='host')
+        self.session = Session.objects.create(host=self.host)
+
+    def writer(self, batch_size=3, flush_interval=60, max_pending=10):
+        return ChatWriteBehind(batch_size=batch_size, flush_interval=flush_interval, max_pending=max_pending)
+
+    async def add(self, writer, content, session_id=None):
+        await writer.add(session_id=session_id or self.session.id, sender_name='host', content=content)
+
+    async def stored(self):
+        return await database_sync_to_async(
+            lambda: list(ChatMessage.objects.order_by('id').values_list('content', flat=True))
+        )()
+
+    async def settle(self, writer, flushes, timeout=2):
+        deadline = time.monotonic() + timeout
+        while writer.flushes < flushes and time.monotonic() < deadline:
+            await asyncio.sleep(0.01)
+
+    async def test_a_full_batch_is_written_at_once(self):
+        writer = self.writer()
+        await self.add(writer, 'one')
+        await self.add(writer, 'two')
+        await asyncio.sleep(0.05)
+        self.assertEqual((writer.flushes, writer.depth), (0, 2))
+        await self.add(writer, 'three')
+        await self.settle(writer, 1)
+        self.assertEqual(writer.metrics()['written'], 3)
+        self.assertEqual(await self.stored(), ['one', 'two', 'three'])
+
+    async def test_a_partial_batch_is_written_after_the_interval(self):
+        writer = self.writer(flush_interval=0.05)
+        await self.add(writer, 'one')
+        await self.settle(writer, 1)
+        self.assertEqual((writer.flushes, writer.written, writer.depth), (1, 1, 0))
+
+    async def test_rejected_rows_do_not_hold_up_the_rest(self):
+        gone = await database_sync_to_async(Session.objects.create)(host=self.host)
+        gone_id = gone.id
+        await database_sync_to_async(gone.delete)()
+        writer = self.writer()
+        await self.add(writer, 'before')
+        await self.add(writer, 'orphan', session_id=gone_id)
+        with self.assertLogs('core.chatlog', 'WARNING') as logs:
+            await self.add(writer, 'after')
+            await self.settle(writer, 1)
+        self.assertIn(f'sessions [{gone_id}]', logs.output[0])
+        self.assertEqual(await self.stored(), ['before', 'after'])
+        self.assertEqual((writer.written, writer.rejected, writer.depth, writer.failed_flushes), (2, 1, 0, 0))
+
+    async def test_overflow_drops_while_the_database_is_down(self):
+        writer = self.writer(batch_size=100, max_pending=2)
+        with mock.patch.object(ChatMessage.objects, 'bulk_create', side_effect=OperationalError('down')), \
+                self.assertLogs('core.chatlog', 'ERROR'):
+            for content in ('one', 'two', 'three'):
+                await self.add(writer, content)
+        self.assertEqual((writer.failed_flushes, writer.dropped, writer.depth), (1, 1, 2))
+
+        # Nothing written during the outage, and the kept messages are stored once it ends
+        await writer.flush()
+        self.assertEqual(await self.stored(), ['one', 'two'])
+
+
+class SeatTests(TestCase):
+    def setUp(self):
+        self.host = User.objects.create(username='host')
+        self.session = Session.objects.create(host=self.host, max_participants=2)
+        seats.set_status(self.session, self.host, 'accepted')
+
+    def occupancy(self):
+        return Session.objects.get(pk=self.session.pk).occupancy
+
+    def test_counter_follows_status_changes(self):
+        guest = User.objects.create(username='guest')
+        seats.set_status(self.session, guest, 'pending')
+        self.assertEqual(self.occupancy(), 2)
+        seats.set_status(self.session, guest, 'accepted')
+        self.assertEqual(self.occupancy(), 2)
+        seats.set_status(self.session, guest, 'kicked')
+        self.assertEqual(self.occupancy(), 1)
+        Participant.objects.filter(user=self.host).delete()
+        self.assertEqual(self.occupancy(), 0)
+
+    def test_full_session_is_left_unchanged(self):
+        seats.set_status(self.session, User.objects.create(username='first'), 'pending')
+        late = User.objects.create(username='late')
+        with self.assertRaises(seats.SessionFull):
+            seats.set_status(self.session, late, 'pending')
+        self.assertEqual(self.occupancy(), 2)
+        self.assertFalse(Participant.objects.filter(user=late).exists())
+
+    def test_join_paths_share_the_limit(self):
+        self.client.force_login(self.host)
+        response = self.client.post(reverse('invite_participant'),
+                                    {'username': User.objects.create(username='invited').username,
+                                     'session_id': self.session.id})
+        self.assertEqual(response.status_code, 200)
+
+        self.client.force_login(User.objects.create(username='joiner'))
+        response = self.client.post(reverse('join_with_code'), {'room_code': self.session.room_code})
+        self.assertEqual(response.status_code, 400)
+
+
+class ConcurrentJoinTests(TransactionTestCase):
+    def test_simultaneous_joins_do_not_overfill(self):
+        host = User.objects.create(username='host')
+        session = Session.objects.create(host=host, max_participants=10)
+        seats.set_status(session, host, 'accepted')
+        users = [User.objects.create(username=f'joiner{i}') for i in range(100)]
+        start = threading.Barrier(len(users))
+
+        def join(user):
+            client = Client()
+            client.force_login(user)
+            start.wait()
+            try:
+                return client.post(reverse('join_with_code'), {'room_code': session.room_code}).status_code
+            finally:
+                connections.close_all()
+
+        with ThreadPoolExecutor(max_workers=len(users)) as pool:
+            codes = list(pool.map(join, users))
+
+        self.assertEqual(codes.count(200), 9)
+        self.assertEqual(codes.count(400), 91)
+        session.refresh_from_db()
+        self.assertEqual(session.occupancy, 10)
+        self.assertEqual(session.participants.filter(status__in=seats.SEAT_STATUSES).count(), 10)
+
+
+class UserSearchTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.host = User.objects.create(username='host')
+        self.session = Session.objects.create(host=self.host)
+        seats.set_status(self.session, self.host, 'accepted')
+        self.client.force_login(self.host)
+        for name in ['Alice', 'alfred', 'albert', 'bob', 'Alan']:
+            User.objects.create(username=name)
+        hidden = User.objects.create(username='alhidden')
+        hidden.profile.is_discoverable = False
+        hidden.profile.save()
+
+    def search(self, **params):
+        response = self.client.get(reverse('search_users', args=[self.session.room_code]), params)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_prefix_is_case_insensitive(self):
+        self.assertEqual(self.search(q='AL')['users'], ['Alan', 'albert', 'alfred', 'Alice'])
+
+    def test_excludes_participants(self):
+        seats.set_status(self.session, User.objects.get(username='albert'), 'pending')
+        self.assertEqual(self.search(q='al')['users'], ['Alan', 'alfred', 'Alice'])
+
+    def test_pages(self):
+        first = self.search(q='al', limit=3)
+        self.assertEqual(first['users'], ['Alan', 'albert', 'alfred'])
+        second = self.search(q='al', limit=3, after=first['next_after'])
+        self.assertEqual(second['users'], ['Alice'])
+        self.assertIsNone(second['next_after'])
+
+    def test_host_only(self):
+        self.client.force_login(User.objects.get(username='bob'))
+        response = self.client.get(reverse('search_users', args=[self.session.room_code]), {'q': 'a'})
+        self.assertEqual(response.status_code, 403)
+
+
+class PresenceTests(TransactionTestCase):
+    def setUp(self):
+        cache.clear()
+        self.host = User.objects.create(username='host')
+        self.session = Session.objects.create(host=self.host)
+        self.guest = User.objects.create(username='guest')
+        self.host_p, _ = seats.set_status(self.session, self.host, 'accepted')
+        self.guest_p, _ = seats.set_status(self.session, self.guest, 'accepted')
+        self.registry = PresenceRegistry(flush_interval=60, stale_after=45)
+        self.room = self.session.room_code
+
+    def stored(self, participant):
+        participant.refresh_from_db()
+        return participant.status, participant.connection_quality, participant.channel_name
+
+    async def test_changes_are_written_in_one_flush(self):
+        self.registry.connect(self.room, 'host', self.host_p.id, 'chan-host')
+        self.registry.connect(self.room, 'guest', self.guest_p.id, 'chan-guest')
+        self.registry.heartbeat(self.room, 'guest', self.guest_p.id, 'chan-guest', 'low')
+        self.registry.disconnect(self.room, 'host', 'chan-host')
+        await self.registry.flush()
+
+        self.assertEqual(self.registry.flushes, 1)
+        self.assertEqual(await database_sync_to_async(self.stored)(self.host_p), ('disconnected', 'high', None))
+        self.assertEqual(await database_sync_to_async(self.stored)(self.guest_p), ('accepted', 'low', 'chan-guest'))
+
+        self.registry.connect(self.room, 'host', self.host_p.id, 'chan-host-2')
+        await self.registry.flush()
+        self.assertEqual(await database_sync_to_async(self.stored)(self.host_p), ('accepted', 'high', 'chan-host-2'))
+
+    async def test_unchanged_state_is_not_rewritten(self):
+        self.registry.connect(self.room, 'guest', self.guest_p.id, 'chan-guest')
+        await self.registry.flush()
+        self.registry.heartbeat(self.room, 'guest', self.guest_p.id, 'chan-guest', 'high')
+        await self.registry.flush()
+        self.assertEqual(self.registry.flushes, 1)
+
+    async def test_kick_is_not_overwritten(self):
+        self.registry.connect(self.room, 'guest', self.guest_p.id, 'chan-guest')
+        await self.registry.flush()
+        await database_sync_to_async(seats.set_status)(self.session, self.guest, 'kicked')
+        self.registry.disconnect(self.room, 'guest', 'chan-guest')
+        await self.registry.flush()
+        self.assertEqual((await database_sync_to_async(self.stored)(self.guest_p))[0], 'kicked')
+
+    async def test_silent_sockets_go_offline(self):
+        self.registry.stale_after = 0
+        self.registry.connect(self.room, 'guest', self.guest_p.id, 'chan-guest')
+        await self.registry.flush()
+        self.assertEqual(self.registry.snapshot(self.room), {})
+        self.assertEqual((await database_sync_to_async(self.stored)(self.guest_p))[0], 'disconnected')
+
+
+# A worker process for UnixSocketChannelLayerTests: it joins 'room' and echoes
+# whatever reaches its channel back to the message's reply_to
+ECHO_WORKER = """
+import asyncio, sys
+from core.layers import UnixSocketChannelLayer
+
+async def main():
+    layer = UnixSocketChannelLayer(path=sys.argv[1])
+    channel = await layer.new_channel()
+    await layer.group_add('room', channel)
+    print(channel, flush=True)
+    while True:
+        message = await layer.receive(channel)
+        await layer.send(message['reply_to'], {'type': 'echo', 'text': message['text'], 'channel': channel})
+
+asyncio.run(main())
+"""
+
+
+class UnixSocketChannelLayerTests(SimpleTestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp(prefix='screendial-test-channels-')
+        self.layers = []
+        self.workers = []
+
+    def tearDown(self):
+        for worker in self.workers:
+            worker.kill()
+            worker.wait()
+            worker.stdout.close()
+        for layer in self.layers:
+            async_to_sync(layer.close)()
+        shutil.rmtree(self.path, ignore_errors=True)
+
+    def layer(self, **config):
+        layer = UnixSocketChannelLayer(path=self.path, **config)
+        self.layers.append(layer)
+        return layer
+
+    async def start_worker(self):
+        """Start an echo worker process; returns its process and channel name."""
+        worker = subprocess.Popen(
+            [sys.executable, '-c', ECHO_WORKER, self.path], cwd=settings.BASE_DIR, stdout=subprocess.PIPE, text=True
+        )
+        self.workers.append(worker)
+        channel = await asyncio.wait_for(asyncio.to_thread(worker.stdout.readline), 10)
+        return worker, channel.strip()
+
+    async def receive(self, layer, channel, timeout=5):
+        return await asyncio.wait_for(layer.receive(channel), timeout)
+
+    async def receive_nothing(self, layer, channel):
+        with self.assertRaises(asyncio.TimeoutError):
+            await self.receive(layer, channel, timeout=0.3)
+
+    async def test_messages_and_groups_cross_processes(self):
+        layer = self.layer()
+        reply_to = await layer.new_channel()
+        worker, channel = await self.start_worker()
+
+        await layer.send(channel, {'type': 'ping', 'text': 'direct', 'reply_to': reply_to})
+        self.assertEqual((await self.receive(layer, reply_to))['text'], 'direct')
+
+        await layer.group_send('room', {'type': 'ping', 'text': 'group', 'reply_to': reply_to})
+        self.assertEqual((await self.receive(layer, reply_to))['channel'], channel)
+
+        # Membership of a remote channel is changed where the channel lives
+        await layer.group_discard('room', channel)
+        await layer.group_send('room', {'type': 'ping', 'text': 'gone', 'reply_to': reply_to})
+        await self.receive_nothing(layer, reply_to)
+        await layer.group_add('other', channel)
+        await layer.group_send('other', {'type': 'ping', 'text': 'back', 'reply_to': reply_to})
+        self.assertEqual((await self.receive(layer, reply_to))['text'], 'back')
+
+    async def test_a_replacement_worker_is_reached_after_one_dies(self):
+        layer = self.layer()
+        reply_to = await layer.new_channel()
+        worker, channel = await self.start_worker()
+        await layer.send(channel, {'type': 'ping', 'text': 'first', 'reply_to': reply_to})
+        await self.receive(layer, reply_to)
+
+        worker.kill()
+        worker.wait()
+        # Sends to the dead process are lost, not raised. They only count as
+        # dropped once this process has noticed the peer is gone.
+        await layer.send(channel, {'type': 'ping', 'text': 'lost', 'reply_to': reply_to})
+        await self.receive_nothing(layer, reply_to)
+
+        worker, channel = await self.start_worker()
+        await layer.send(channel, {'type': 'ping', 'text': 'direct', 'reply_to': reply_to})
+        self.assertEqual((await self.receive(layer, reply_to))['text'], 'direct')
+        await layer.group_send('room', {'type': 'ping', 'text': 'group', 'reply_to': reply_to})
+        self.assertEqual((await self.receive(layer, reply_to))['channel'], channel)
+        await self.receive_nothing(layer, reply_to)
+
+    async def test_full_channels_refuse_messages(self):
+        layer = self.layer(capacity=2)
+        channel = await layer.new_channel()
+        await layer.group_add('room', channel)
+        await layer.send(channel, {'type': 'ping', 'n': 1})
+        await layer.send(channel, {'type': 'ping', 'n': 2})
+        with self.assertRaises(ChannelFull):
+            await layer.send(channel, {'type': 'ping', 'n': 3})
+        # Group members that are full just miss the message
+        await layer.group_send('room', {'type': 'ping', 'n': 4})
+        self.assertEqual([(await layer.receive(channel))['n'] for _ in range(2)], [1, 2])
+        self.assertEqual(layer.metrics()['queued'], 0)
+
+    async def test_expired_messages_take_their_channel_out_of_groups(self):
+        layer = self.layer(expiry=0.05)
+        channel = await layer.new_channel()
+        await layer.group_add('room', channel)
+        await layer.send(channel, {'type': 'ping', 'n': 1})
+        await asyncio.sleep(0.1)
+        await layer.group_send('room', {'type': 'ping', 'n': 2})
+        await self.receive_nothing(layer, channel)
+
+
+class OutboundQueueTests(SimpleTestCase):
+    def make_queue(self, **kwargs):
+        self.sent = []
+        self.gate = asyncio.Event()
+        self.slow_calls = 0
+
+        async def send(text):
+            await self.gate.wait()
+            self.sent.append(json.loads(text))
+
+        def on_slow():
+            self.slow_calls += 1
+
+        return OutboundQueue(send, on_slow=on_slow, **kwargs)
+
+    async def drain(self, queue):
+        self.gate.set()
+        while queue.depth:
+            await asyncio.sleep(0)
+        await asyncio.sleep(0)
+
+    async def test_higher_priorities_are_sent_first(self):
+        queue = self.make_queue()
+        queue.put(PRIORITY_BULK, {'n': 1})
+        await asyncio.sleep(0)  # the first frame is now being written
+        queue.put(PRIORITY_CHAT, {'n': 2})
+        queue.put(PRIORITY_CONTROL, {'n': 3})
+        queue.put(PRIORITY_CHAT, {'n': 4})
+        await self.drain(queue)
+        self.assertEqual([frame['n'] for frame in self.sent], [1, 3, 2, 4])
+        queue.close()
+
+    async def test_superseded_frames_are_coalesced(self):
+        queue = self.make_queue()
+        queue.put(PRIORITY_CHAT, {'n': 0})
+        await asyncio.sleep(0)
+        queue.put(PRIORITY_CONTROL, {'type': 'heartbeat_ack', 'sent': 1}, key='ack')
+        queue.put(PRIORITY_CONTROL, {'type': 'heartbeat_ack', 'sent': 2}, key='ack')
+        queue.put(PRIORITY_CONTROL, {'type': 'presence', 'changes': {'a': 1}}, key='presence', merge=merge_presence)
+        queue.put(PRIORITY_CONTROL, {'type': 'presence', 'changes': {'b': 2}}, key='presence', merge=merge_presence)
+        self.assertEqual(queue.metrics()['coalesced'], 2)
+        await self.drain(queue)
+        self.assertEqual(self.sent[1:], [
+            {'type': 'heartbeat_ack', 'sent': 2},
+            {'type': 'presence', 'changes': {'a': 1, 'b': 2}},
+        ])
+        queue.close()
+
+    async def test_full_queue_drops_lowest_priority_first(self):
+        queue = self.make_queue(max_items=3, slow_threshold=100)
+        queue.put(PRIORITY_CHAT, {'n': 'chat-1'})
+        queue.put(PRIORITY_BULK, {'n': 'bulk'})
+        queue.put(PRIORITY_CHAT, {'n': 'chat-2'})
+        queue.put(PRIORITY_CHAT, {'n': 'chat-3'})  # evicts the bulk frame
+        queue.put(PRIORITY_CONTROL, {'n': 'signal'})  # always queued
+        self.assertFalse(queue.put(PRIORITY_BULK, {'n': 'bulk-2'}))
+        queue.put(PRIORITY_CHAT, {'n': 'chat-4'})  # evicts the oldest chat frame
+        self.assertEqual(queue.metrics()['dropped'], 3)
+        await self.drain(queue)
+        self.assertEqual([frame['n'] for frame in self.sent], ['signal', 'chat-2', 'chat-3', 'chat-4'])
+        queue.close()
+
+    async def test_persistently_slow_client_is_reported(self):
+        queue = self.make_queue(slow_threshold=2, slow_timeout=0.01)
+        for n in range(3):
+            queue.put(PRIORITY_CHAT, {'n': n})
+        self.assertEqual(self.slow_calls, 0)
+        await asyncio.sleep(0.02)
+        with self.assertLogs('core.outbound', 'WARNING'):
+            queue.put(PRIORITY_CHAT, {'n': 3})
+        self.assertEqual(self.slow_calls, 1)
+        self.assertTrue(queue.closed)
+        self.assertFalse(queue.put(PRIORITY_CONTROL, {'n': 4}))
+
+    async def test_control_backlog_closes_instead_of_dropping(self):
+        queue = self.make_queue(max_items=3, slow_threshold=100)
+        for n in range(3):
+            self.assertTrue(queue.put(PRIORITY_CONTROL, {'n': n}))
+        with self.assertLogs('core.outbound', 'WARNING'):
+            self.assertFalse(queue.put(PRIORITY_CONTROL, {'n': 3}))
+        self.assertEqual((self.slow_calls, queue.dropped), (1, 0))
+        self.assertTrue(queue.closed)
+
+    async def test_failed_send_is_logged_and_closes_the_queue(self):
+        errors = []
+
+        async def send(text):
+            raise ConnectionResetError('gone')
+
+        queue = OutboundQueue(send, on_error=lambda: errors.append(True))
+        with self.assertLogs('core.outbound', 'ERROR') as logs:
+            queue.put(PRIORITY_CHAT, {'n': 1})
+            await asyncio.sleep(0)
+        self.assertIn('ConnectionResetError', logs.output[0])
+        self.assertEqual(errors, [True])
+        self.assertTrue(queue.closed)
+        self.assertIsNone(queue._task)
+        self.assertFalse(queue.put(PRIORITY_CHAT, {'n': 2}))
+
+
+async def receive_frame(socket, kind):
+    """The next frame of type `kind`, skipping the rest."""
+    while (frame := await socket.receive_json_from())['type'] != kind:
+        pass
+    return frame
+
+
+class SessionSettingsPushTests(RoomSocketTestCase):
+    async def chat(self, socket, message):
+        await socket.send_json_to({'type': 'chat_message', 'message': message})
+        return (await receive_frame(socket, 'chat_message'))['suggestion']
+
+    async def test_host_changes_reach_open_sockets_without_rereading_the_session(self):
+        await database_sync_to_async(CommandSuggestion.objects.create)(
+            keyword='paste', suggestion='Ctrl+V', description='paste'
+        )
+        host = await self.open(self.host)
+        self.assertEqual(await self.chat(host, 'paste it'), 'Tip: Ctrl+V - paste')
+
+        client = Client()
+        await sync_to_async(client.force_login)(self.host)
+        response = await sync_to_async(client.post)(
+            reverse('session_control', args=[self.session.room_code]),
+            {'action': 'toggle_suggestions', 'username': 'host'}
+        )
+        self.assertEqual(response.json()['is_enabled'], False)
+        # The pushed settings are applied by the time a heartbeat comes back
+        await host.send_json_to({'type': 'heartbeat', 'sent': 1})
+        await receive_frame(host, 'heartbeat_ack')
+        self.assertIsNone(await self.chat(host, 'paste it'))
+
+        # Only pushed changes count; the consumer keeps its own copy
+        await database_sync_to_async(
+            Session.objects.filter(id=self.session.id).update
+        )(is_suggestions_enabled=True)
+        self.assertIsNone(await self.chat(host, 'paste it'))
+        await self.close_all()
+
+
+class DirectSignalTests(RoomSocketTestCase):
+    def setUp(self):
+        super().setUp()
+        self.viewer = User.objects.create(username='viewer')
+        seats.set_status(self.session, self.viewer, 'accepted')
+
+    async def test_targeted_signals_skip_the_room_group(self):
+        layer = get_channel_layer()
+        host = await self.open(self.host)
+        guest = await self.open(self.guest)
+        viewer = await self.open(self.viewer)
+        for socket in (host, guest, viewer):
+            await receive_all(socket, 'presence')
+
+        def signal_groups():
+            # Presence flushes may use the room group meanwhile
+            return [c.args[0] for c in group_send.call_args_list if c.args[1]['type'] == 'signal']
+
+        with mock.patch.object(layer, 'group_send', wraps=layer.group_send) as group_send:
+            await host.send_json_to({'type': 'signal', 'target': 'guest', 'data': {'sdp': 'offer'}})
+            frame = await receive_frame(guest, 'signal')
+            self.assertEqual((frame['sender'], frame['data']), ('host', {'sdp': 'offer'}))
+            self.assertEqual(await receive_all(viewer, 'signal'), [])
+            self.assertEqual(signal_groups(), [])
+
+            # Someone not connected here is reached through the room
+            await host.send_json_to({'type': 'signal', 'target': 'elsewhere', 'data': {'sdp': 'offer'}})
+            await receive_all(host, 'signal')
+            self.assertEqual(signal_groups(), [room_group_name(self.session.room_code)])
+        self.assertEqual(await receive_all(guest, 'signal'), [])
+        await self.close_all()
+
+
+class NotificationTests(TransactionTestCase):
+    def setUp(self):
+        self.host = User.objects.create(username='host')
+        self.invitee = User.objects.create(username='invitee')
+        self.session = Session.objects.create(host=self.host)
+        seats.set_status(self.session, self.host, 'accepted')
+        self.app = URLRouter(websocket_urlpatterns)
+
+    async def logged_in(self, user):
+        client = Client()
+        await sync_to_async(client.force_login)(user)
+        return client
+
+    async def open(self, client):
+        cookie = f'{settings.SESSION_COOKIE_NAME}={client.cookies[settings.SESSION_COOKIE_NAME].value}'
+        socket = WebsocketCommunicator(self.app, '/ws/notifications/', headers=[(b'cookie', cookie.encode())])
+        connected, _ = await socket.connect()
+        self.assertTrue(connected)
+        return socket
+
+    async def test_invitations_and_listing_changes_are_pushed(self):
+        socket = await self.open(await self.logged_in(self.invitee))
+        host = await self.logged_in(self.host)
+
+        await sync_to_async(host.post)(
+            reverse('invite_participant'), {'username': 'invitee', 'session_id': self.session.id}
+        )
+        self.assertEqual(await socket.receive_json_from(), {
+            'type': 'invitation', 'session_id': self.session.id,
+            'room_code': self.session.room_code, 'host': 'host',
+        })
+
+        await sync_to_async(host.post)(reverse('toggle_discoverability', args=[self.session.room_code]))
+        self.assertEqual(await socket.receive_json_from(), {'type': 'sessions_changed'})
+        self.assertTrue(await socket.receive_nothing())
+        await socket.disconnect()
+
+    async def test_anonymous_sockets_are_refused(self):
+        socket = WebsocketCommunicator(self.app, '/ws/notifications/')
+        connected, _ = await socket.connect()
+        self.assertFalse(connected)
+
+
+class WireCodecTests(RoomSocketTestCase):
+    async def receive(self, socket, loads, kind):
+        # Skips relay plans and other frames sent around the ones under test
+        while True:
+            frame = loads(await socket.receive_from())
+            if frame['type'] == kind:
+                return frame
+
+    async def test_each_socket_gets_its_negotiated_codec(self):
+        msgpack = wire.CODECS['msgpack'].loads
+        binary, subprotocol = await self.connect(self.host, subprotocols=['screendial.msgpack', 'screendial.json'])
+        text = await self.open(self.guest)
+        self.assertEqual(subprotocol, 'screendial.msgpack')
+        self.assertEqual(msgpack(await binary.receive_from())['type'], 'presence')
+        self.assertEqual(json.loads(await text.receive_from())['type'], 'presence')
+
+        await binary.send_to(bytes_data=wire.CODECS['msgpack'].dumps({'type': 'chat_message', 'message': 'hi'}))
+        frame = await self.receive(binary, msgpack, 'chat_message')
+        self.assertEqual((frame['message'], frame['sender']), ('hi', 'host'))
+        self.assertEqual((await self.receive(text, json.loads, 'chat_message'))['message'], 'hi')
+        await self.close_all()
+
+    def test_missing_codec_is_encoded_from_json(self):
+        event = wire.frame_event('chat_message', {'type': 'chat_message', 'message': 'caf\u00e9'}, target=None)
+        self.assertEqual(set(event['encoded']), {'json'})
+        self.assertEqual(
+            wire.CODECS['cbor'].loads(wire.encoded(event, wire.CODECS['cbor'])),
+            {'type': 'chat_message', 'message': 'caf\u00e9'},
+        )
+
+
+class SignalBatcherTests(SimpleTestCase):
+    async def test_signals_per_target_are_forwarded_together_in_order(self):
+        forwarded = []
+
+        async def forward(target, payloads):
+            forwarded.append((target, payloads))
+
+        batcher = SignalBatcher(0.01, forward)
+        batcher.add('bob', 'offer')
+        batcher.add('carol', 'offer')
+        for n in range(3):
+            batcher.add('bob', f'candidate-{n}')
+        self.assertEqual(forwarded, [])
+        await asyncio.sleep(0.05)
+
+        self.assertEqual(sorted(forwarded), [
+            ('bob', ['offer', 'candidate-0', 'candidate-1', 'candidate-2']),
+            ('carol', ['offer']),
+        ])
+        self.assertEqual(batcher.metrics()['frames_saved'], 3)
+
+        batcher.add('bob', 'candidate-3')
+        await batcher.flush()
+        self.assertEqual(forwarded[-1], ('bob', ['candidate-3']))
+
+
+class RelayTreeTests(SimpleTestCase):
+    def make_tree(self):
+        return RelayTree('host', 2, {'high': 2, 'medium': 1, 'low': 0})
+
+    def test_peers_fill_the_shallowest_free_slots(self):
+        tree = self.make_tree()
+        for name in ('a', 'b', 'c', 'd', 'e'):
+            tree.add(name, 'high')
+        self.assertEqual(tree.plan('host'), {'pull_from': None, 'forward_to': ['a', 'b']})
+        # Peers at the same depth take turns
+        self.assertEqual(tree.plan('a'), {'pull_from': 'host', 'forward_to': ['c', 'e']})
+        self.assertEqual(tree.plan('d'), {'pull_from': 'b', 'forward_to': []})
+
+    def test_join_only_instructs_the_new_peer_and_its_parent(self):
+        tree = self.make_tree()
+        tree.add('a', 'high')
+        self.assertEqual(set(tree.add('b', 'low')), {'b', 'host'})
+
+    def test_leaving_moves_only_the_orphaned_subtrees(self):
+        tree = self.make_tree()
+        for name in ('a', 'b', 'c', 'd', 'e', 'f', 'g'):
+            tree.add(name, 'high')
+        plans = tree.remove('a')  # c and e, with g below c, need new parents
+        self.assertEqual(tree.plan('host')['forward_to'], ['b', 'c'])
+        self.assertEqual(tree.plan('c')['forward_to'], ['g', 'e'])
+        self.assertEqual(set(plans), {'host', 'c', 'e'})
+        self.assertEqual(tree.depth('g'), 2)
+
+    def test_quality_drop_moves_excess_children(self):
+        tree = self.make_tree()
+        for name in ('a', 'b', 'c', 'd', 'e'):
+            tree.add(name, 'high')
+        self.assertEqual(set(tree.set_quality('a', 'medium')), {'a', 'b', 'e'})
+        self.assertEqual(tree.plan('a')['forward_to'], ['c'])
+        self.assertEqual(tree.plan('e')['pull_from'], 'b')
+
+    def test_host_cannot_be_removed(self):
+        tree = self.make_tree()
+        tree.add('a', 'high')
+        self.assertEqual(tree.remove('host'), {})
+        self.assertEqual(set(tree.remove('a')), {'host'})
+
+    def test_trees_are_only_planned_within_one_process(self):
+        self.assertTrue(topology.single_process_layer())
+        with override_settings(CHANNEL_LAYERS={'default': {'BACKEND': 'core.layers.UnixSocketChannelLayer'}}):
+            self.assertFalse(topology.single_process_layer())
+
+    def test_host_takes_the_overflow(self):
+        tree = self.make_tree()
+        for name in ('a', 'b', 'c'):
+            tree.add(name, 'low')
+        self.assertEqual(tree.plan('host')['forward_to'], ['a', 'b', 'c'])
+
+
+@mock.patch.dict(metrics._config, TOKEN='s3cret')
+class MetricsTests(TestCase):
+    def test_histogram_buckets_are_cumulative(self):
+        histogram = metrics.Histogram('test_seconds', 'Test', ('kind',), buckets=(0.1, 1.0))
+        metrics._metrics.remove(histogram)
+        for value in (0.05, 0.1, 0.5, 2.0):
+            histogram.observe(value, 'a')
+        self.assertEqual(list(histogram.lines()), [
+            'test_seconds_bucket{kind="a",le="0.1"} 2',
+            'test_seconds_bucket{kind="a",le="1.0"} 3',
+            'test_seconds_bucket{kind="a",le="+Inf"} 4',
+            'test_seconds_sum{kind="a"} 2.65',
+            'test_seconds_count{kind="a"} 4',
+        ])
+
+    def staff_client(self):
+        client = Client()
+        client.force_login(User.objects.create(username='ops', is_staff=True))
+        return client
+
+    def test_endpoint_reports_requests_and_components(self):
+        Client().get(reverse('index'))
+        response = self.staff_client().get('/metrics')
+        self.assertEqual(response.status_code, 200)
+        body = response.content.decode()
+        self.assertIn('screendial_http_request_seconds_count{view="index"}', body)
+        self.assertIn('screendial_chatlog_queue_depth ', body)
+        self.assertIn('screendial_presence_members ', body)
+        self.assertIn('screendial_channel_layer_queued ', body)
+
+    def test_only_staff_and_the_scrape_token_get_in(self):
+        client = Client()
+        self.assertEqual(client.get('/metrics').status_code, 403)
+        client.force_login(User.objects.create(username='member'))
+        self.assertEqual(client.get('/metrics').status_code, 403)
+        self.assertEqual(Client().get('/metrics', HTTP_AUTHORIZATION='Bearer wrong').status_code, 403)
+        self.assertEqual(Client().get('/metrics', HTTP_AUTHORIZATION='Bearer s3cret').status_code, 200)
+
+    def test_nobody_gets_in_without_a_token(self):
+        with mock.patch.dict(metrics._config, TOKEN=''):
+            self.assertEqual(self.staff_client().get('/metrics').status_code, 403)
+            self.assertEqual(Client().get('/metrics', HTTP_AUTHORIZATION='Bearer ').status_code, 403)
+
+    def test_rooms_are_reported_without_their_codes(self):
+        counts = {'ROOMA1': 1, 'ROOMB2': 3, 'ROOMC3': 30}
+        with mock.patch.object(metrics.registry, 'socket_counts', return_value=counts):
+            body = self.staff_client().get('/metrics').content.decode()
+        for room_code in counts:
+            self.assertNotIn(room_code, body)
+        self.assertIn('screendial_rooms 3', body)
+        self.assertIn('screendial_rooms_by_sockets{le="2"} 1', body)
+        self.assertIn('screendial_rooms_by_sockets{le="5"} 2', body)
+        self.assertIn('screendial_rooms_by_sockets{le="+Inf"} 3', body)
+
+
+def format_queries(captured):
+    return '\n'.join(f'{n}. {query["sql"]}' for n, query in enumerate(captured, 1))
+
+
+# Seconds any single request or handshake may take against the seeded data
+WALL_CLOCK_BUDGET = 0.5
+
+MEDIA_ROOT = tempfile.mkdtemp(prefix='screendial-test-media-')
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT)
+class QueryBudgetTests(TestCase):
+    """
+    Every URL in core/urls.py is requested against a realistically sized
+    database, and may issue at most its budgeted number of queries. Raising a
+    budget should be a deliberate decision, not a side effect.
+    """
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(MEDIA_ROOT, ignore_errors=True)
+
+    @classmethod
+    def setUpTestData(cls):
+        users = [User.objects.create(username=f'user{i:03d}') for i in range(300)]
+        for i in range(60):
+            session = Session.objects.create(host=users[i], max_participants=20)
+            for offset, status in enumerate(('accepted', 'accepted', 'disconnected', 'pending', 'kicked'), 61):
+                seats.set_status(session, users[(i + offset) % 300], status, request_type='join_request')
+        for user in users[:50]:
+            Notification.objects.bulk_create(Notification(user=user, message=f'note {n}') for n in range(20))
+
+        cls.host = User.objects.create(username='host')
+        cls.guest = User.objects.create(username='guest')
+        cls.waiting = User.objects.create(username='waiting')
+        cls.invitee = User.objects.create(username='invitee')
+        cls.staff = User.objects.create(username='staff', is_staff=True)
+        cls.session = Session.objects.create(host=cls.host, max_participants=100)
+        seats.set_status(cls.session, cls.host, 'accepted')
+        seats.set_status(cls.session, cls.guest, 'accepted')
+        seats.set_status(cls.session, cls.waiting, 'pending', request_type='join_request')
+        seats.set_status(cls.session, cls.invitee, 'pending', request_type='invite')
+        for user in users[100:140]:
+            seats.set_status(cls.session, user, 'accepted')
+        for user in users[140:160]:
+            seats.set_status(cls.session, user, 'pending', request_type='join_request')
+        ChatMessage.objects.bulk_create(
+            ChatMessage(session=cls.session, sender=cls.guest, sender_name='guest', content=f'message {n}')
+            for n in range(500)
+        )
+        cls.audio = AudioMessage.objects.create(
+            session=cls.session, sender=cls.guest, sender_name='guest',
+            audio_file=ContentFile(b'\0' * 4096, name='clip.webm'), duration=1.5,
+        )
+
+    def cases(self):
+        """url name -> (user, method, url args, data, expected status, query budget)"""
+        room = self.session.room_code
+        session_id = self.session.id
+        return {
+            'index': (self.host, 'get', [], {}, 200, 5),
+            'register': (None, 'get', [], {}, 200, 0),
+            'login': (None, 'get', [], {}, 200, 0),
+            'logout': (self.guest, 'post', [], {}, 302, 4),
+            'create_session': (self.guest, 'post', [], {'max_participants': 5}, 302, 9),
+            'join_session': (self.guest, 'post', [], {'room_code': room}, 302, 5),
+            'session_room': (self.host, 'get', [room], {}, 200, 5),
+            'session_control': (self.host, 'post', [room], {'action': 'accept', 'username': 'waiting'}, 200, 11),
+            'add_participant': (self.host, 'post', [room], {'username': 'user200'}, 200, 12),
+            'delete_session': (self.host, 'post', [room], {}, 302, 4),
+            'waiting_room': (self.waiting, 'get', [room], {}, 200, 4),
+            'check_status': (self.waiting, 'get', [room], {}, 200, 4),
+            'toggle_discoverability': (self.host, 'post', [room], {}, 200, 5),
+            'upload_audio': (self.guest, 'post', [room], {
+                'audio': SimpleUploadedFile('clip.webm', b'\0' * 1024, content_type='audio/webm'), 'duration': 1,
+            }, 200, 5),
+            'audio_message_file': (self.host, 'get', [self.audio.id], {}, 200, 4),
+            'profile': (self.guest, 'get', [], {}, 200, 3),
+            'invite_participant': (self.host, 'post', [], {'username': 'user250', 'session_id': session_id}, 200, 12),
+            'my_invitations': (self.invitee, 'get', [], {}, 200, 3),
+            'available_sessions': (self.guest, 'get', [], {}, 200, 4),
+            'respond_invite': (self.invitee, 'post', [], {'session_id': session_id, 'action': 'accepted'}, 200, 9),
+            'join_with_code': (self.invitee, 'post', [], {'room_code': Session.objects.first().room_code}, 200, 9),
+            'session_requests': (self.host, 'get', [room], {}, 200, 4),
+            'handle_request': (self.host, 'post', [], {
+                'username': 'waiting', 'session_id': session_id, 'action': 'accepted',
+            }, 200, 12),
+            'chat_history': (self.guest, 'get', [room], {}, 200, 6),
+            'search_users': (self.host, 'get', [room], {'q': 'user1'}, 200, 4),
+            'metrics': (self.staff, 'get', [], {}, 200, 2),
+        }
+
+    def test_every_url_has_a_budget(self):
+        names = {pattern.name for pattern in get_resolver('core.urls').url_patterns if isinstance(pattern, URLPattern)}
+        self.assertEqual(names - set(self.cases()), set())
+
+    @mock.patch.dict(metrics._config, TOKEN='s3cret')
+    def test_views_stay_within_budget(self):
+        for name, (user, method, args, data, status, budget) in self.cases().items():
+            with self.subTest(name), transaction.atomic():
+                cache.clear()
+                client = Client()
+                if user is not None:
+                    client.force_login(user)
+                start = time.perf_counter()
+                with CaptureQueriesContext(connection) as ctx:
+                    response = getattr(client, method)(reverse(name, args=args), data)
+                elapsed = time.perf_counter() - start
+                self.assertEqual(response.status_code, status, name)
+                queries = len(ctx.captured_queries)
+                self.assertLessEqual(
+                    queries, budget,
+                    f'{name} ran {queries} queries (budget {budget}):\n{format_queries(ctx.captured_queries)}'
+                )
+                self.assertLess(elapsed, WALL_CLOCK_BUDGET, f'{name} took {elapsed:.3f}s')
+                transaction.set_rollback(True)
+
+
+class RangeHeaderTests(SimpleTestCase):
+    def test_parse_range(self):
+        for header, expected in [
+            ('bytes=0-99', (0, 99)),
+            ('bytes=4000-', (4000, 4095)),          # open-ended
+            ('bytes=-10', (4086, 4095)),            # suffix
+            ('bytes=-9999', (0, 4095)),             # suffix longer than the file
+            ('bytes=4000-9999', (4000, 4095)),      # end clamped to the file
+            ('bytes=4096-', False),
+            ('bytes=50-10', False),
+            ('bytes=-0', False),
+            ('', None),
+            ('bytes=-', None),
+            ('bytes=abc', None),
+            ('bytes=0-1,5-6', None),                # multiple ranges get the whole file
+            ('items=0-99', None),
+        ]:
+            with self.subTest(header):
+                self.assertEqual(media.parse_range(header, 4096), expected)
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT, AUDIO_MESSAGE_MAX_BYTES=4096)
+class AudioMessageTests(TestCase):
+    CLIP = bytes(range(256)) * 16
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.host = User.objects.create(username='host')
+        cls.guest = User.objects.create(username='guest')
+        cls.outsider = User.objects.create(username='outsider')
+        cls.session = Session.objects.create(host=cls.host)
+        seats.set_status(cls.session, cls.host, 'accepted')
+        seats.set_status(cls.session, cls.guest, 'accepted')
+        cls.audio = AudioMessage.objects.create(
+            session=cls.session, sender=cls.guest, sender_name='guest',
+            audio_file=ContentFile(cls.CLIP, name='clip.webm'), duration=1.5,
+        )
+
+    def fetch(self, **headers):
+        self.client.force_login(self.host)
+        response = self.client.get(reverse('audio_message_file', args=[self.audio.id]), headers=headers)
+        # Draining streaming_content through the test client also closes the file
+        body = b''.join(response.streaming_content) if response.streaming else response.content
+        return response, body
+
+    def upload(self, user, clip):
+        self.client.force_login(user)
+        data = {'duration': 2} if clip is None else {'audio': clip, 'duration': 2}
+        return self.client.post(reverse('upload_audio', args=[self.session.room_code]), data)
+
+    def test_ranges_are_served_partially(self):
+        for header, start, end in [('bytes=0-99', 0, 99), ('bytes=4000-', 4000, 4095), ('bytes=-10', 4086, 4095)]:
+            with self.subTest(header):
+                response, body = self.fetch(Range=header)
+                self.assertEqual(response.status_code, 206)
+                self.assertEqual(response['Content-Range'], f'bytes {start}-{end}/4096')
+                self.assertEqual(response['Content-Length'], str(end - start + 1))
+                self.assertEqual(body, self.CLIP[start:end + 1])
+
+    def test_unsatisfiable_range(self):
+        response, body = self.fetch(Range='bytes=5000-')
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], 'bytes */4096')
+        self.assertEqual(body, b'')
+
+    def test_malformed_range_gets_the_whole_file(self):
+        for header in (None, 'bytes=abc', 'bytes=0-1,5-6'):
+            with self.subTest(header):
+                response, body = self.fetch(**({'Range': header} if header else {}))
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(response['Accept-Ranges'], 'bytes')
+                self.assertEqual(body, self.CLIP)
+
+    def test_upload_checks_size_and_type(self):
+        for clip, status in [
+            (SimpleUploadedFile('big.webm', b'\0' * 4097, content_type='audio/webm'), 413),
+            (SimpleUploadedFile('huge.webm', b'\0' * 128 * 1024, content_type='audio/webm'), 413),
+            (SimpleUploadedFile('notes.txt', b'hello', content_type='text/plain'), 400),
+            (None, 400),
+        ]:
+            with self.subTest(getattr(clip, 'name', None)):
+                self.assertEqual(self.upload(self.guest, clip).status_code, status)
+        self.assertEqual(AudioMessage.objects.count(), 1)
+
+        clip = SimpleUploadedFile('hi.webm', b'\0' * 4096, content_type='audio/webm')
+        self.assertEqual(self.upload(self.outsider, clip).status_code, 403)
+        clip.seek(0)
+        response = self.upload(self.guest, clip)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(AudioMessage.objects.get(id=response.json()['audio']['id']).audio_file.size, 4096)
+
+
+@mock.patch.dict(roomcache._config, ENABLED=True)
+class HandshakeBudgetTests(RoomSocketTestCase):
+    """
+    The session WebSocket handshake, held to the same budgets as the views,
+    with the room cache on as it is in a deployment with a shared cache.
+    """
+
+    # The membership check and the member list for the presence snapshot
+    budget = 2
+    session_fields = {'max_participants': 100}
+
+    def setUp(self):
+        super().setUp()
+        for i in range(40):
+            seats.set_status(self.session, User.objects.create(username=f'user{i:03d}'), 'accepted')
+
+    async def test_handshake_stays_within_budget(self):
+        # Rendering the room page leaves the session and seat in the cache
+        client = Client()
+        await sync_to_async(client.force_login)(self.guest)
+        await sync_to_async(client.get)(reverse('session_room', args=[self.session.room_code]))
+
+        # The consumer's queries run on the main thread, so that is where they are captured
+        ctx = CaptureQueriesContext(connection)
+        await sync_to_async(ctx.__enter__)()
+        start = time.perf_counter()
+        socket = await self.open(self.guest)
+        self.assertEqual((await socket.receive_json_from())['type'], 'presence')
+        elapsed = time.perf_counter() - start
+        await sync_to_async(ctx.__exit__)(None, None, None)
+        captured = await sync_to_async(lambda: ctx.captured_queries)()
+
+        self.assertLessEqual(
+            len(captured), self.budget,
+            f'the handshake ran {len(captured)} queries (budget {self.budget}):\n{format_queries(captured)}'
+        )
+        self.assertLess(elapsed, WALL_CLOCK_BUDGET, f'the handshake took {elapsed:.3f}s')
+        await self.close_all()
+
+
+# Tests run on the process-local LocMemCache, which leaves the room cache off
+# by default; these exercise it as deployed with a shared backend
+@mock.patch.dict(roomcache._config, ENABLED=True)
+class RoomCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.host = User.objects.create(username='host')
+        self.guest = User.objects.create(username='guest')
+        self.session = Session.objects.create(host=self.host)
+        seats.set_status(self.session, self.host, 'accepted')
+
+    def test_repeated_checks_skip_the_database(self):
+        seats.set_status(self.session, self.guest, 'pending')
+        client = Client()
+        client.force_login(self.guest)
+        url = reverse('check_status', args=[self.session.room_code])
+        self.assertEqual(client.get(url).json()['status'], 'pending')
+        # Only the login session and user are loaded
+        with self.assertNumQueries(2):
+            self.assertEqual(client.get(url).json()['status'], 'pending')
+
+    def test_status_changes_are_seen_at_once(self):
+        seats.set_status(self.session, self.guest, 'pending')
+        self.assertEqual(roomcache.get_member(self.session.id, self.guest.id)['status'], 'pending')
+        seats.set_status(self.session, self.guest, 'kicked')
+        self.assertEqual(roomcache.get_member(self.session.id, self.guest.id)['status'], 'kicked')
+
+    def test_missing_participant_is_cached_until_created(self):
+        self.assertIsNone(roomcache.get_member(self.session.id, self.guest.id))
+        with self.assertNumQueries(0):
+            self.assertIsNone(roomcache.get_member(self.session.id, self.guest.id))
+        seats.set_status(self.session, self.guest, 'accepted')
+        self.assertEqual(roomcache.get_member(self.session.id, self.guest.id)['status'], 'accepted')
+
+    def test_session_saves_invalidate(self):
+        self.assertTrue(roomcache.get_session(self.session.room_code)['is_active'])
+        self.session.is_active = False
+        self.session.save()
+        self.assertFalse(roomcache.get_session(self.session.room_code)['is_active'])
+        self.session.delete()
+        self.assertIsNone(roomcache.get_session(self.session.room_code))
+
+
+class ConnectTokenTests(RoomSocketTestCase):
+    guest_status = None
+
+    async def attempt(self, path):
+        socket = WebsocketCommunicator(self.app, path)
+        connected, code = await socket.connect()
+        if connected:
+            await socket.disconnect()
+        return connected, code
+
+    def test_token_round_trip(self):
+        token = tokens.issue_for(self.session, self.host)
+        identity = tokens.verify(token, self.session.room_code)
+        self.assertEqual((identity.user_id, identity.role), (self.host.id, tokens.ROLE_HOST))
+        self.assertIsNone(tokens.verify(token, 'other'))
+        self.assertIsNone(tokens.verify(token[:-2] + 'xx', self.session.room_code))
+
+    async def test_bad_tokens_are_refused_without_queries(self):
+        room = self.session.room_code
+        forged = tokens.issue_for(self.session, self.host)[:-2] + 'xx'
+        for path in (f'/ws/session/{room}/', f'/ws/session/{room}/?token={forged}'):
+            ctx = CaptureQueriesContext(connection)
+            await sync_to_async(ctx.__enter__)()
+            self.assertEqual(await self.attempt(path), (False, FORBIDDEN_CLOSE_CODE))
+            await sync_to_async(ctx.__exit__)(None, None, None)
+            self.assertEqual(await sync_to_async(len)(ctx.captured_queries), 0)
+
+    async def test_only_accepted_participants_get_in(self):
+        path = session_path(self.session, self.guest)
+        self.assertEqual(await self.attempt(path), (False, FORBIDDEN_CLOSE_CODE))
+        await database_sync_to_async(seats.set_status)(self.session, self.guest, 'pending')
+        self.assertEqual(await self.attempt(path), (False, FORBIDDEN_CLOSE_CODE))
+        await database_sync_to_async(seats.set_status)(self.session, self.guest, 'accepted')
+        self.assertTrue((await self.attempt(path))[0])
+        # A token issued before a kick no longer works
+        await database_sync_to_async(seats.set_status)(self.session, self.guest, 'kicked')
+        self.assertEqual(await self.attempt(path), (False, FORBIDDEN_CLOSE_CODE))
+        await self.close_all()
+
+    @mock.patch.dict(roomcache._config, ENABLED=True)
+    async def test_a_stale_cache_entry_does_not_let_anyone_in(self):
+        await database_sync_to_async(seats.set_status)(self.session, self.guest, 'accepted')
+        await database_sync_to_async(roomcache.get_member)(self.session.id, self.guest.id)
+        # As written by another worker, whose invalidation never reached here
+        await database_sync_to_async(
+            Participant.objects.filter(session=self.session, user=self.guest).update
+        )(status='kicked')
+        self.assertEqual(
+            await self.attempt(session_path(self.session, self.guest)), (False, FORBIDDEN_CLOSE_CODE)
+        )
+
+
+class EvictionTests(RoomSocketTestCase):
+    async def test_kicked_sockets_are_closed_and_hear_nothing_more(self):
+        host = await self.open(self.host)
+        guest = await self.open(self.guest)
+        client = Client()
+        await sync_to_async(client.force_login)(self.host)
+        response = await sync_to_async(client.post)(
+            reverse('session_control', args=[self.session.room_code]), {'action': 'kick', 'username': 'guest'}
+        )
+        self.assertEqual(response.status_code, 200)
+
+        # Frames sent before the kick may come first
+        while (output := await guest.receive_output())['type'] != 'websocket.close':
+            pass
+        self.assertEqual(output['code'], REMOVED_CLOSE_CODE)
+
+        await host.send_json_to({'type': 'chat_message', 'message': 'after'})
+        while (await host.receive_json_from()).get('message') != 'after':
+            pass
+        self.assertTrue(await guest.receive_nothing())
+        await self.close_all()
+
+
+class RoomEventLogTests(SimpleTestCase):
+    def event(self, message):
+        return wire.frame_event('chat_message', {'type': 'chat_message', 'message': message})
+
+    def test_each_event_is_numbered_once(self):
+        log = eventlog.RoomLog(capacity=10)
+        first, second = self.event('a'), self.event('b')
+        self.assertEqual(log.record(first).seq, 1)
+        # Another socket receiving its own copy of the same event
+        self.assertEqual(log.record(dict(first)).seq, 1)
+        self.assertEqual(log.record(second).seq, 2)
+        self.assertEqual([entry.seq for entry in log.since(0)], [1, 2])
+        self.assertEqual(log.since(2), [])
+
+    def test_frames_carry_the_sequence_number(self):
+        entry = eventlog.RoomLog(capacity=10).record(self.event('café'))
+        for codec in wire.CODECS.values():
+            self.assertEqual(
+                codec.loads(entry.frame(codec)), {'seq': 1, 'type': 'chat_message', 'message': 'café'}
+            )
+
+    def test_gaps_older_than_the_buffer_need_a_resync(self):
+        log = eventlog.RoomLog(capacity=3)
+        for n in range(5):
+            log.record(self.event(str(n)))
+        self.assertEqual([entry.seq for entry in log.since(2)], [3, 4, 5])
+        self.assertIsNone(log.since(1))
+        self.assertIsNone(log.since(6))
+
+
+class ResumeTests(RoomSocketTestCase):
+    async def test_reconnect_gets_only_what_it_missed(self):
+        host = await self.open(self.host)
+        guest = await self.open(self.guest)
+        [position] = await receive_all(guest, 'resume')
+        self.assertEqual(position['status'], 'fresh')
+        await host.send_json_to({'type': 'chat_message', 'message': 'seen'})
+        [seen] = await receive_all(guest, 'chat_message')
+        await guest.disconnect()
+
+        for message in ('missed 1', 'missed 2'):
+            await host.send_json_to({'type': 'chat_message', 'message': message})
+        guest = await self.open(self.guest, f"{position['epoch']}:{seen['seq']}")
+        frames = await receive_all(guest, 'chat_message')
+        self.assertEqual([frame['message'] for frame in frames], ['missed 1', 'missed 2'])
+        self.assertEqual([frame['seq'] for frame in frames], [seen['seq'] + 1, seen['seq'] + 2])
+        await guest.disconnect()
+
+        # A position from another log cannot be resumed
+        guest = await self.open(self.guest, 'other:1')
+        [status] = await receive_all(guest, 'resume')
+        self.assertEqual(status['status'], 'resync')
+        await self.close_all()
+
+    async def test_a_gap_nobody_here_listened_to_is_resynced(self):
+        guest = await self.open(self.guest)
+        [position] = await receive_all(guest, 'resume')
+        await guest.disconnect()
+
+        # Sent from another worker while no socket of the room is open here
+        await get_channel_layer().group_send(room_group_name(self.session.room_code), wire.frame_event(
+            'chat_message', {'type': 'chat_message', 'message': 'unseen', 'sender': 'host'}
+        ))
+        guest = await self.open(self.guest, f"{position['epoch']}:{position['seq']}")
+        [status] = await receive_all(guest, 'resume')
+        self.assertEqual(status['status'], 'resync')
+        await self.close_all()
+
+
+class RosterTests(RoomSocketTestCase):
+    def setUp(self):
+        super().setUp()
+        self.waiting = User.objects.create(username='waiting')
+        seats.set_status(self.session, self.host, 'accepted', display_name='Host')
+        seats.set_status(self.session, self.guest, 'accepted', display_name='Guest', request_type='invite')
+        seats.set_status(self.session, self.waiting, 'pending', display_name='Waiting')
+
+    async def test_seat_changes_reach_every_socket_as_numbered_deltas(self):
+        host = await self.open(self.host)
+        guest = await self.open(self.guest)
+        [snapshot] = await receive_all(guest, 'roster')
+        self.assertEqual(snapshot['members'], {
+            'host': {'status': 'accepted', 'display_name': 'Host', 'request_type': 'join_request'},
+            'guest': {'status': 'accepted', 'display_name': 'Guest', 'request_type': 'invite'},
+            'waiting': {'status': 'pending', 'display_name': 'Waiting', 'request_type': 'join_request'},
+        })
+        await receive_all(host, 'roster')
+
+        set_status = database_sync_to_async(seats.set_status)
+        await set_status(self.session, self.waiting, 'accepted')
+        await set_status(self.session, self.waiting, 'kicked')
+        for socket in (host, guest):
+            accepted, kicked = await receive_all(socket, 'roster')
+            self.assertEqual(accepted['epoch'], snapshot['epoch'])
+            self.assertEqual(accepted['version'], snapshot['version'] + 1)
+            self.assertEqual(accepted['changes']['waiting']['status'], 'accepted')
+            self.assertEqual(kicked['version'], snapshot['version'] + 2)
+            self.assertEqual(kicked['changes'], {'waiting': None})
+
+        # A page that missed one asks for the whole roster again
+        await guest.send_json_to({'type': 'roster'})
+        [resync] = await receive_all(guest, 'roster')
+        self.assertEqual(resync['version'], snapshot['version'] + 2)
+        self.assertEqual(set(resync['members']), {'host', 'guest'})
+        await self.close_all()
+
+    async def test_deleted_participants_leave_the_roster(self):
+        host = await self.open(self.host)
+        [snapshot] = await receive_all(host, 'roster')
+        await database_sync_to_async(Participant.objects.filter(user=self.waiting).delete)()
+        [delta] = await receive_all(host, 'roster')
+        self.assertEqual((delta['version'], delta['changes']), (snapshot['version'] + 1, {'waiting': None}))
+        await self.close_all()
+
+    def test_seat_changes_are_announced_without_loading_relations(self):
+        participant = Participant.objects.get(user=self.waiting)
+        # One query for the room code, one for the username: no model loads
+        with self.assertNumQueries(3):
+            participant.save()
+        self.assertFalse(Participant.session.is_cached(participant))
+
+
+class RosterDeltaTests(SimpleTestCase):
+    def test_each_change_is_one_version(self):
+        members = roster.Roster({'guest': roster.member_entry('accepted', 'Guest', 'invite')})
+        joined = roster.change_event('waiting', roster.member_entry('pending', 'Waiting', 'join_request'))
+        delta = members.apply(joined)
+        # Every socket in the process shares the first one's delta
+        self.assertIs(members.apply(dict(joined)), delta)
+        self.assertEqual(members.version, 1)
+        self.assertEqual(wire.JSON.loads(delta['encoded']['json'])['changes'], {
+            'waiting': {'status': 'pending', 'display_name': 'Waiting', 'request_type': 'join_request'},
+        })
+        # Presence flips aside, a member still accepted is no change
+        offline = roster.change_event('guest', roster.member_entry('disconnected', 'Guest', 'invite'))
+        self.assertIsNone(members.apply(offline))
+        self.assertEqual(members.version, 1)
@@ -0,0 +1,57 @@
+"""
+Signed connect tokens for the session WebSocket.
+
+session_room issues a token that names the user, the session and their role.
+The page passes it to the socket in the query string (?token=...). The
+handshake checks the signature and age in memory, so no session-store or
+user read happens the way it would under AuthMiddlewareStack. Membership is
+then confirmed with one indexed Participant query. It deliberately skips
+roomcache, so a user kicked after their token was issued is turned away on
+every worker at once. The rest of the handshake reads the session settings
+(through roomcache) and the room's seat rows for the roster and presence.
+
+Tokens expire after MAX_AGE seconds. Each heartbeat ack carries a fresh one,
+so an open page always holds a token it can reconnect with.
+"""
+from collections import namedtuple
+
+from django.conf import settings
+from django.core import signing
+
+DEFAULTS = {
+    'MAX_AGE': 120,
+}
+
+_config = {**DEFAULTS, **getattr(settings, 'CONNECT_TOKENS', {})}
+MAX_AGE = _config['MAX_AGE']
+
+SALT = 'screendial.connect'
+ROLE_HOST = 'host'
+ROLE_PARTICIPANT = 'participant'
+
+Identity = namedtuple('Identity', 'user_id username session_id room_code role')
+
+
+def issue(identity):
+    return signing.dumps(list(identity), salt=SALT)
+
+
+def issue_for(session, user):
+    """A token for `user` in `session`, given as a model instance or a roomcache entry."""
+    session_id, room_code, host_id = (
+        (session['id'], session['room_code'], session['host_id']) if isinstance(session, dict)
+        else (session.id, session.room_code, session.host_id)
+    )
+    role = ROLE_HOST if user.id == host_id else ROLE_PARTICIPANT
+    return issue(Identity(user.id, user.username, session_id, room_code, role))
+
+
+def verify(token, room_code):
+    """The Identity in `token` if it is genuine, unexpired and for `room_code`, else None."""
+    if not token:
+        return None
+    try:
+        identity = Identity(*signing.loads(token, salt=SALT, max_age=MAX_AGE))
+    except (signing.BadSignature, TypeError, ValueError):
+        return None
+    return identity if identity.room_code == room_code else None
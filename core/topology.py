@@ -0,0 +1,213 @@
+"""
+Relay trees for screen sharing.
+
+Rather than every viewer pulling the shared screen from the host, viewers
+are arranged in a tree rooted at the host. Each peer pulls the stream from
+its parent and forwards it to its children. The number of children a peer
+may take depends on its reported connection quality (FANOUT). The host takes
+at most ROOT_FANOUT, so its upload stays flat however large the room grows.
+
+A peer that joins is attached to the shallowest peer with a free slot. When
+a peer leaves, or its quality drops below what its children need, only the
+subtrees that hung from it move. Each moves as a whole to the shallowest
+free slot outside itself, and the rest of the tree is untouched. Every
+operation returns the plans of the peers whose parent or children changed,
+so only those peers need new instructions.
+
+A tree must see every viewer and the host, and plans reach peers through
+the sockets this process holds. That only holds when the whole room lives in
+one process. With a channel layer that spans workers (UnixSocketChannelLayer,
+Redis), a viewer on another worker than the host would be told to pull from
+a host that never hears of them, and each worker would give the host its own
+ROOT_FANOUT. So relay trees are only planned with a single-process layer.
+Otherwise every viewer pulls from the host directly, as without RELAY_TREE.
+"""
+import heapq
+import itertools
+
+from django.conf import settings
+
+from .realtime import single_process_layer
+
+DEFAULTS = {
+    'ENABLED': False,
+    'ROOT_FANOUT': 4,
+    'FANOUT': {'high': 3, 'medium': 1, 'low': 0},
+}
+
+
+class _Node:
+    __slots__ = ('name', 'capacity', 'parent', 'children')
+
+    def __init__(self, name, capacity):
+        self.name = name
+        self.capacity = capacity
+        self.parent = None
+        self.children = []
+
+    def has_slot(self):
+        return len(self.children) < self.capacity
+
+
+class RelayTree:
+    def __init__(self, root, root_fanout, fanout):
+        self.fanout = fanout
+        self.root = _Node(root, root_fanout)
+        self._nodes = {root: self.root}
+        # (depth when pushed, order, name) of peers that may have a free slot
+        self._slots = []
+        self._order = itertools.count()
+        self._push_slot(self.root, 0)
+
+        self.moves = 0  # subtrees re-attached after a leave or quality drop
+
+    def __len__(self):
+        return len(self._nodes) - 1
+
+    def __contains__(self, name):
+        return name in self._nodes
+
+    def plan(self, name):
+        node = self._nodes[name]
+        return {
+            'pull_from': node.parent.name if node.parent else None,
+            'forward_to': [child.name for child in node.children],
+        }
+
+    def depth(self, name):
+        """Hops from the root, or None if `name` is not attached to it."""
+        node, depth = self._nodes[name], 0
+        while node.parent is not None:
+            node, depth = node.parent, depth + 1
+        return depth if node is self.root else None
+
+    def add(self, name, quality):
+        if name in self._nodes:
+            return self.set_quality(name, quality)
+        node = self._nodes[name] = _Node(name, self.fanout.get(quality, 0))
+        changed = set()
+        self._attach(node, changed)
+        return self._plans(changed)
+
+    def remove(self, name):
+        node = self._nodes.get(name)
+        if node is None or node is self.root:
+            return {}
+        del self._nodes[name]
+        changed = set()
+        parent = node.parent
+        parent.children.remove(node)
+        changed.add(parent.name)
+        self._push_slot(parent)
+        orphans, node.children = node.children, []
+        self._reattach(orphans, changed)
+        return self._plans(changed)
+
+    def set_quality(self, name, quality):
+        node = self._nodes[name]
+        if node is self.root:
+            return {}
+        node.capacity = self.fanout.get(quality, 0)
+        changed = set()
+        if len(node.children) > node.capacity:
+            # The most recently attached children move
+            orphans = node.children[node.capacity:]
+            del node.children[node.capacity:]
+            changed.add(name)
+            self._reattach(orphans, changed)
+        else:
+            self._push_slot(node)
+        return self._plans(changed)
+
+    def _plans(self, names):
+        return {name: self.plan(name) for name in names if name in self._nodes}
+
+    def _reattach(self, orphans, changed):
+        # Orphans that can forward the most take the shallowest slots
+        for orphan in sorted(orphans, key=lambda node: -node.capacity):
+            orphan.parent = None
+            self._attach(orphan, changed)
+            self.moves += 1
+
+    def _attach(self, node, changed):
+        parent = self._take_slot()
+        parent.children.append(node)
+        node.parent = parent
+        changed.update((node.name, parent.name))
+        self._push_slot(parent)
+        self._push_slot(node)
+
+    def _push_slot(self, node, depth=None):
+        if node.has_slot():
+            if depth is None:
+                depth = self.depth(node.name)
+            if depth is not None:
+                heapq.heappush(self._slots, (depth, next(self._order), node.name))
+
+    def _take_slot(self):
+        """The shallowest attached peer with a free slot, or the root if none."""
+        detached = []
+        try:
+            while self._slots:
+                depth, order, name = heapq.heappop(self._slots)
+                node = self._nodes.get(name)
+                if node is None or not node.has_slot():
+                    continue
+                actual = self.depth(name)
+                if actual is None:
+                    # Inside a subtree that is being moved; may be valid again later
+                    detached.append((depth, order, name))
+                elif actual > depth:
+                    # Moved deeper since it was pushed
+                    heapq.heappush(self._slots, (actual, order, name))
+                else:
+                    return node
+            # Every slot is taken: the host forwards to one more peer
+            return self.root
+        finally:
+            for entry in detached:
+                heapq.heappush(self._slots, entry)
+
+
+class RelayPlanner:
+    """One RelayTree per room, rooted at the host."""
+
+    def __init__(self, root_fanout, fanout):
+        self.root_fanout = root_fanout
+        self.fanout = fanout
+        self._trees = {}
+
+    def tree(self, room_code, host):
+        tree = self._trees.get(room_code)
+        if tree is None:
+            tree = self._trees[room_code] = RelayTree(host, self.root_fanout, self.fanout)
+        return tree
+
+    def join(self, room_code, host, username, quality):
+        return self.tree(room_code, host).add(username, quality)
+
+    def leave(self, room_code, username):
+        tree = self._trees.get(room_code)
+        if tree is None or username not in tree:
+            return {}
+        plans = tree.remove(username)
+        if not len(tree):
+            del self._trees[room_code]
+        return plans
+
+    def set_quality(self, room_code, username, quality):
+        tree = self._trees.get(room_code)
+        if tree is None or username not in tree:
+            return {}
+        return tree.set_quality(username, quality)
+
+    def host_plan(self, room_code, host):
+        tree = self._trees.get(room_code)
+        return tree.plan(host) if tree is not None else {'pull_from': None, 'forward_to': []}
+
+
+_config = {**DEFAULTS, **getattr(settings, 'RELAY_TREE', {})}
+relay_planner = (
+    RelayPlanner(_config['ROOT_FANOUT'], _config['FANOUT'])
+    if _config['ENABLED'] and single_process_layer() else None
+)
@@ -1,5 +1,5 @@
 from django.urls import path
-from . import views
+from . import metrics, views
 from django.contrib.auth import views as auth_views
 
 urlpatterns = [
@@ -16,6 +16,8 @@ urlpatterns = [
     path('session/<str:room_code>/waiting/', views.waiting_room, name='waiting_room'),
     path('session/<str:room_code>/check-status/', views.check_status, name='check_status'),
     path('session/<str:room_code>/toggle-discovery/', views.toggle_discoverability, name='toggle_discoverability'),
+    path('session/<str:room_code>/audio/', views.upload_audio, name='upload_audio'),
+    path('audio/<int:message_id>/', views.audio_message_file, name='audio_message_file'),
     path('profile/', views.profile_view, name='profile'),
 
     # Invitation flow
@@ -30,4 +32,13 @@ urlpatterns = [
     # Host control panel
     path('api/session-requests/<str:room_code>/', views.session_requests, name='session_requests'),
     path('api/handle-request/', views.handle_request, name='handle_request'),
+
+    # Chat history
+    path('api/session/<str:room_code>/history/', views.chat_history, name='chat_history'),
+
+    # Invite box typeahead
+    path('api/session/<str:room_code>/users/', views.search_users, name='search_users'),
 ]
+
+if metrics.ENABLED:
+    urlpatterns.append(path('metrics', views.prometheus_metrics, name='metrics'))
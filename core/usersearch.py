@@ -0,0 +1,42 @@
+"""
+Username prefix search over discoverable profiles.
+
+Profile.username_lower has a partial index over discoverable profiles, and a
+prefix is turned into a [prefix, next prefix) range on it, so a lookup is
+an index seek that reads about `limit` rows whatever the number of users.
+Pages continue after the last username returned.
+"""
+from .models import Profile
+
+DEFAULT_PAGE_SIZE = 10
+MAX_PAGE_SIZE = 50
+
+
+def prefix_range(prefix):
+    """Return (low, high) bounding every string that starts with `prefix`."""
+    return prefix, prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+
+def search_page(prefix, after=None, exclude_user_ids=None, limit=DEFAULT_PAGE_SIZE):
+    """
+    Return (usernames, next_after) for discoverable users whose username
+    starts with `prefix` (case-insensitively), in username order.
+    """
+    profiles = Profile.objects.filter(is_discoverable=True)
+    prefix = prefix.lower()
+    if prefix:
+        low, high = prefix_range(prefix)
+        profiles = profiles.filter(username_lower__gte=low, username_lower__lt=high)
+    if after:
+        profiles = profiles.filter(username_lower__gt=after.lower())
+    if exclude_user_ids is not None:
+        profiles = profiles.exclude(user_id__in=exclude_user_ids)
+
+    rows = list(
+        profiles.order_by('username_lower').values_list('username_lower', 'user__username')[:limit + 1]
+    )
+    next_after = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_after = rows[-1][0]
+    return [username for _, username in rows], next_after
@@ -3,10 +3,24 @@ from django.contrib.auth import login
 from django.contrib.auth.models import User
 from django.contrib.auth.forms import UserCreationForm
 from django.contrib.auth.decorators import login_required
-from django.http import JsonResponse
+from django.conf import settings
+from django.http import HttpResponse, JsonResponse, Http404
+from django.urls import reverse
 from django.views.decorators.http import require_http_methods
 from requests import request, session
-from .models import Session, Participant, Notification
+from .models import Session, Participant, Notification, AudioMessage
+from . import history, listings, metrics, roomcache, seats, tokens, usersearch, wire
+from .media import ranged_file_response
+from .realtime import (
+    evict_member, group_send, notify_lobby, notify_user, push_session_settings, room_group_name,
+)
+
+STATUS_LABELS = dict(Participant.STATUS_CHOICES)
+
+
+def is_member(session_id, user):
+    member = roomcache.get_member(session_id, user.id)
+    return member is not None and member['status'] in seats.MEMBER_STATUSES
 
 
 def index(request):
@@ -23,7 +37,7 @@ def index(request):
 
         joined_sessions = Session.objects.filter(
             participants__user=request.user,
-            participants__status='accepted',
+            participants__status__in=seats.MEMBER_STATUSES,
             is_active=True
         ).exclude(
             host=request.user  # avoid duplicates
@@ -66,13 +80,12 @@ def create_session(request):
             is_suggestions_enabled=suggestions_enabled,
         )
         # Add host as a participant
-        Participant.objects.create(
-            user=request.user,
-            session=session,
+        seats.set_status(
+            session, request.user, 'accepted',
             display_name=request.user.username,
-            status='accepted',
             connection_quality='high'
         )
+        notify_lobby()
         return redirect('session_room', room_code=session.room_code)
     return redirect('index')
 
@@ -84,24 +97,24 @@ def join_session(request):
         try:
             session = Session.objects.get(room_code=room_code, is_active=True)
 
-            # Check participant limit
-            current_count = session.participants.exclude(status__in=['rejected', 'kicked']).count()
-            if current_count >= session.max_participants:
-                return render(request, 'core/index.html', {
-                    'error': f'Session is full ({session.max_participants} participants max).'
-                })
-
-            # Create participant entry if not exists
-            participant, created = Participant.objects.get_or_create(
-                user=request.user,
-                session=session,
-                defaults={'display_name': request.user.username, 'status': 'pending'}
-            )
-
-            # If host, ensure accepted
-            if session.host == request.user:
-                participant.status = 'accepted'
-                participant.save()
+            is_host = session.host == request.user
+            participant = Participant.objects.filter(user=request.user, session=session).first()
+            created = False
+
+            # Create participant entry if not exists; if host, ensure accepted
+            if participant is None or (is_host and participant.status != 'accepted'):
+                try:
+                    participant, created = seats.set_status(
+                        session, request.user, 'accepted' if is_host else 'pending',
+                        display_name=request.user.username
+                    )
+                except seats.SessionFull:
+                    return render(request, 'core/index.html', {
+                        'error': f'Session is full ({session.max_participants} participants max).'
+                    })
+
+            if created and not is_host:
+                notify_user(session.host_id, 'join_request', room_code=room_code, username=request.user.username)
 
             # If previously kicked, block re-entry
             if participant.status == 'kicked':
@@ -123,38 +136,42 @@ def join_session(request):
 @login_required
 def session_room(request, room_code):
 
-    session = get_object_or_404(Session, room_code=room_code)
-    participant = get_object_or_404(Participant, user=request.user, session=session)
+    session = roomcache.get_session_or_404(room_code)
+    participant = roomcache.get_member_or_404(session['id'], request.user.id)
 
     # ⭐ MUST BE INSIDE FUNCTION
-    pending_requests = session.participants.filter(
+    pending_requests = Participant.objects.filter(
+        session_id=session['id'],
         status='pending',
         request_type='join_request'
     )
 
-    invited_users = session.participants.filter(
+    invited_users = Participant.objects.filter(
+        session_id=session['id'],
         status='pending',
         request_type='invite'
     )
 
     # Redirect pending participants to waiting room
-    if participant.status == 'pending':
+    if participant['status'] == 'pending':
         return redirect('waiting_room', room_code=room_code)
 
-    if participant.status in ('rejected', 'kicked'):
+    if participant['status'] in ('rejected', 'kicked'):
         return render(request, 'core/index.html', {
             'error': 'You have been removed from this session.'
         })
 
-    is_host = session.host == request.user
+    is_host = session['host_id'] == request.user.id
 
-    participants_list = session.participants.exclude(user=session.host).order_by('joined_at')
-
-    current_count = session.participants.exclude(status__in=['rejected', 'kicked']).count()
+    participants_list = list(
+        Participant.objects.filter(session_id=session['id']).exclude(user_id=session['host_id'])
+        .select_related('user').order_by('joined_at')
+    )
 
-    discoverable_users = User.objects.filter(profile__is_discoverable=True).exclude(
-        id__in=session.participants.filter(status__in=['accepted', 'pending']).values_list('user_id', flat=True)
-    ).exclude(id=request.user.id).order_by('username')
+    # Occupancy counts every seat, so it follows from the rows already loaded
+    host = participant if is_host else roomcache.get_member(session['id'], session['host_id'])
+    current_count = sum(seats.holds_seat(p.status) for p in participants_list)
+    current_count += host is not None and seats.holds_seat(host['status'])
 
     context = {
         'session': session,
@@ -163,7 +180,7 @@ def session_room(request, room_code):
         'room_code': room_code,
         'participants_list': participants_list,
         'current_count': current_count,
-        'discoverable_users': discoverable_users,
+        'connect_token': tokens.issue_for(session, request.user),
 
         # ⭐ NEW
         'pending_requests': pending_requests,
@@ -178,10 +195,10 @@ def session_control(request, room_code):
     if request.method != 'POST':
         return JsonResponse({'error': 'POST required'}, status=405)
 
-    session = get_object_or_404(Session, room_code=room_code)
+    cached = roomcache.get_session_or_404(room_code)
 
     # Only host can control
-    if session.host != request.user:
+    if cached['host_id'] != request.user.id:
         return JsonResponse({'error': 'Only the host can manage participants.'}, status=403)
 
     action = request.POST.get('action')
@@ -190,9 +207,12 @@ def session_control(request, room_code):
     if not action or not target_username:
         return JsonResponse({'error': 'Missing action or username.'}, status=400)
 
+    session = get_object_or_404(Session, id=cached['id'])
+
     if action == 'toggle_suggestions':
         session.is_suggestions_enabled = not session.is_suggestions_enabled
         session.save()
+        push_session_settings(session)
         status_str = "enabled" if session.is_suggestions_enabled else "disabled"
         return JsonResponse({
             'status': 'ok',
@@ -200,6 +220,17 @@ def session_control(request, room_code):
             'is_enabled': session.is_suggestions_enabled
         })
 
+    if action == 'toggle_fuzzy_hints':
+        session.is_fuzzy_hints_enabled = not session.is_fuzzy_hints_enabled
+        session.save()
+        push_session_settings(session)
+        status_str = "enabled" if session.is_fuzzy_hints_enabled else "disabled"
+        return JsonResponse({
+            'status': 'ok',
+            'message': f'Typo-tolerant hints {status_str}.',
+            'is_enabled': session.is_fuzzy_hints_enabled
+        })
+
     try:
         target_participant = Participant.objects.get(
             session=session,
@@ -213,18 +244,25 @@ def session_control(request, room_code):
         return JsonResponse({'error': 'Cannot manage yourself.'}, status=400)
 
     if action == 'accept':
-        target_participant.status = 'accepted'
-        target_participant.save()
+        try:
+            seats.set_status(session, target_participant.user, 'accepted')
+        except seats.SessionFull:
+            return JsonResponse({'error': f'Session is full ({session.max_participants} max).'}, status=400)
+        notify_user(target_participant.user_id, 'request_status', room_code=room_code, status='accepted')
+        notify_lobby()
         return JsonResponse({'status': 'ok', 'message': f'{target_username} accepted.'})
 
     elif action == 'reject':
-        target_participant.status = 'rejected'
-        target_participant.save()
+        seats.set_status(session, target_participant.user, 'rejected')
+        evict_member(room_code, target_username, 'rejected')
+        notify_user(target_participant.user_id, 'request_status', room_code=room_code, status='rejected')
         return JsonResponse({'status': 'ok', 'message': f'{target_username} rejected.'})
 
     elif action == 'kick':
-        target_participant.status = 'kicked'
-        target_participant.save()
+        seats.set_status(session, target_participant.user, 'kicked')
+        evict_member(room_code, target_username, 'kicked')
+        notify_user(target_participant.user_id, 'request_status', room_code=room_code, status='kicked')
+        notify_lobby()
         return JsonResponse({'status': 'ok', 'message': f'{target_username} kicked.'})
 
 @login_required
@@ -232,6 +270,7 @@ def delete_session(request, room_code):
     session = get_object_or_404(Session, room_code=room_code, host=request.user)
     session.is_active = False
     session.save()
+    notify_lobby()
     return redirect('index')
 
 @login_required
@@ -240,14 +279,16 @@ def add_participant(request, room_code):
     if request.method != 'POST':
         return JsonResponse({'error': 'POST required'}, status=405)
 
-    session = get_object_or_404(Session, room_code=room_code)
-    if session.host != request.user:
+    cached = roomcache.get_session_or_404(room_code)
+    if cached['host_id'] != request.user.id:
         return JsonResponse({'error': 'Only the host can add participants.'}, status=403)
 
     target_username = request.POST.get('username')
     if not target_username:
         return JsonResponse({'error': 'Missing username.'}, status=400)
 
+    session = get_object_or_404(Session, id=cached['id'])
+
     try:
         target_user = User.objects.get(username=target_username)
     except User.DoesNotExist:
@@ -255,28 +296,17 @@ def add_participant(request, room_code):
 
     # Check if user is already a participant
     participant = Participant.objects.filter(session=session, user=target_user).first()
-    if participant:
-        if participant.status in ['accepted', 'pending']:
-            return JsonResponse({'error': f'{target_username} is already a participant.'}, status=400)
-        
-        # If they were kicked or rejected, allow re-adding them
-        participant.status = 'accepted'
-        participant.save()
-        return JsonResponse({'status': 'ok', 'message': f'{target_username} re-added successfully.'})
+    if participant and seats.holds_seat(participant.status):
+        return JsonResponse({'error': f'{target_username} is already a participant.'}, status=400)
 
-    # Check participant limit
-    current_count = session.participants.exclude(status__in=['rejected', 'kicked']).count()
-    if current_count >= session.max_participants:
+    # Automatically accepted since host added them; kicked or rejected users can be re-added
+    try:
+        seats.set_status(session, target_user, 'accepted', display_name=target_user.username)
+    except seats.SessionFull:
         return JsonResponse({'error': f'Session is full ({session.max_participants} max).'}, status=400)
 
-    # Create participant (Automatically accepted since host added them)
-    Participant.objects.create(
-        user=target_user,
-        session=session,
-        display_name=target_user.username,
-        status='accepted'
-    )
-
+    if participant:
+        return JsonResponse({'status': 'ok', 'message': f'{target_username} re-added successfully.'})
     return JsonResponse({'status': 'ok', 'message': f'{target_username} added successfully.'})
 
 @login_required
@@ -316,27 +346,25 @@ def invite_participant(request):
     if invited_user == request.user:
         return JsonResponse({'error': 'You cannot invite yourself'}, status=400)
 
-    # Check participant limit
-    current_count = session.participants.exclude(status__in=['rejected', 'disconnected']).count()
-    if current_count >= session.max_participants:
-        return JsonResponse({'error': f'Session is full ({session.max_participants} max)'}, status=400)
-
     # Create or update participant
-    participant, created = Participant.objects.update_or_create(
-        user=invited_user,
-        session=session,
-        defaults={
-            'display_name': username,
-            'status': 'pending',
-            'request_type': 'invite'
-        }
-    )
+    try:
+        participant, created = seats.set_status(
+            session, invited_user, 'pending',
+            display_name=username,
+            request_type='invite'
+        )
+    except seats.SessionFull:
+        return JsonResponse({'error': f'Session is full ({session.max_participants} max)'}, status=400)
 
     # Create notification
     Notification.objects.create(
         user=invited_user,
         message=f"You have been invited to join session {session.room_code} by {request.user.username}"
     )
+    notify_user(
+        invited_user.id, 'invitation',
+        session_id=session.id, room_code=session.room_code, host=request.user.username
+    )
 
     return JsonResponse({'status': 'ok', 'message': f'Invitation sent to {username}'})
 
@@ -364,36 +392,43 @@ def my_invitations(request):
 
 @login_required
 def available_sessions(request):
-    """Get all available and discoverable sessions for the current user."""
-    # Get sessions where user is not already a participant
-    user_session_ids = Participant.objects.filter(
+    """Get a page of available and discoverable sessions for the current user."""
+    cursor = request.GET.get('cursor') or None
+    if cursor and listings.decode_cursor(cursor) is None:
+        return JsonResponse({'error': 'Invalid cursor'}, status=400)
+
+    try:
+        limit = int(request.GET.get('limit', listings.DEFAULT_PAGE_SIZE))
+    except (ValueError, TypeError):
+        limit = listings.DEFAULT_PAGE_SIZE
+    limit = min(max(limit, 1), listings.MAX_PAGE_SIZE)
+
+    user_session_ids = set(Participant.objects.filter(
         user=request.user
-    ).values_list('session_id', flat=True)
-    
-    sessions = Session.objects.filter(
-        is_active=True,
-        is_discoverable=True  # Only show discoverable sessions
-    ).exclude(
-        id__in=user_session_ids
-    ).exclude(
-        host=request.user
-    ).select_related('host').values(
-        'id', 'room_code', 'host__username', 'max_participants', 'created_at'
-    ).order_by('-created_at')
-    
-    # Add participant counts
-    sessions_list = []
-    for session in sessions:
-        participant_count = Participant.objects.filter(
-            session_id=session['id'],
-            status='accepted'
-        ).count()
-        session['participant_count'] = participant_count
-        sessions_list.append(session)
-    
+    ).values_list('session_id', flat=True))
+
+    # The listing is shared and cached; only the exclusions are per user
+    rows, next_cursor = listings.visible_page(
+        cursor, limit, lambda row: row['host_id'] == request.user.id or row['id'] in user_session_ids,
+        expect_hidden=len(user_session_ids)
+    )
+
+    sessions_list = [
+        {
+            'id': row['id'],
+            'room_code': row['room_code'],
+            'host__username': row['host__username'],
+            'max_participants': row['max_participants'],
+            'created_at': row['created_at'],
+            'participant_count': row['participant_count'],
+        }
+        for row in rows
+    ]
+
     return JsonResponse({
         'status': 'ok',
-        'sessions': sessions_list
+        'sessions': sessions_list,
+        'next_cursor': next_cursor
     })
 
 
@@ -414,13 +449,21 @@ def respond_invite(request):
         request_type='invite'
     )
 
+    session = participant.session
+    try:
+        seats.set_status(session, request.user, action)
+    except seats.SessionFull:
+        return JsonResponse({'error': f'Session is full ({session.max_participants} max)'}, status=400)
+
+    notify_user(
+        session.host_id, 'invite_response',
+        room_code=session.room_code, username=request.user.username, status=action
+    )
+
     if action == 'accepted':
-        participant.status = 'accepted'
-        participant.save()
+        notify_lobby()
         return JsonResponse({'status': 'ok', 'message': 'Invitation accepted'})
     else:
-        participant.status = 'rejected'
-        participant.save()
         return JsonResponse({'status': 'ok', 'message': 'Invitation rejected'})
 
 
@@ -440,21 +483,16 @@ def join_with_code(request):
     except Session.DoesNotExist:
         return JsonResponse({'error': 'Invalid or inactive room code'}, status=404)
 
-    # Check participant limit (count only accepted participants)
-    accepted_count = session.participants.filter(status='accepted').count()
-    if accepted_count >= session.max_participants:
-        return JsonResponse({'error': f'Session is full ({session.max_participants} max)'}, status=400)
-
     # Create or update participant
-    participant, created = Participant.objects.update_or_create(
-        user=request.user,
-        session=session,
-        defaults={
-            'display_name': request.user.username,
-            'status': 'pending',
-            'request_type': 'join_request'
-        }
-    )
+    try:
+        participant, created = seats.set_status(
+            session, request.user, 'pending',
+            display_name=request.user.username,
+            request_type='join_request'
+        )
+    except seats.SessionFull:
+        return JsonResponse({'error': f'Session is full ({session.max_participants} max)'}, status=400)
+    notify_user(session.host_id, 'join_request', room_code=session.room_code, username=request.user.username)
 
     return JsonResponse({
         'status': 'ok',
@@ -468,14 +506,14 @@ def join_with_code(request):
 @login_required
 def session_requests(request, room_code):
     """Get all pending join requests for a session (host only)."""
-    session = get_object_or_404(Session, room_code=room_code)
+    session = roomcache.get_session_or_404(room_code)
 
     # Only host can view
-    if session.host != request.user:
+    if session['host_id'] != request.user.id:
         return JsonResponse({'error': 'Only the host can view requests'}, status=403)
 
     requests = Participant.objects.filter(
-        session=session,
+        session_id=session['id'],
         status='pending',
         request_type='join_request'
     ).values('id', 'user__username', 'display_name', 'user__id', 'joined_at')
@@ -510,17 +548,20 @@ def handle_request(request):
         request_type='join_request'
     )
 
-    # Check participant limit if accepting
-    if action == 'accepted':
-        accepted_count = session.participants.filter(status='accepted').count()
-        if accepted_count >= session.max_participants:
-            return JsonResponse({'error': 'Session is now full'}, status=400)
+    # A pending request already holds its seat; anything else needs a free one
+    try:
+        seats.set_status(session, participant.user, action)
+    except seats.SessionFull:
+        return JsonResponse({'error': 'Session is now full'}, status=400)
 
-    participant.status = action
-    participant.save()
+    if action == 'rejected':
+        evict_member(session.room_code, username, action)
 
     message = f'Your join request was {action}.'
     Notification.objects.create(user=participant.user, message=message)
+    notify_user(participant.user_id, 'request_status', room_code=session.room_code, status=action)
+    if action == 'accepted':
+        notify_lobby()
 
     return JsonResponse({'status': 'ok', 'message': f'Request {action}.'})
 
@@ -530,11 +571,11 @@ def handle_request(request):
 @login_required
 def waiting_room(request, room_code):
     """View for participants waiting for host approval."""
-    session = get_object_or_404(Session, room_code=room_code)
-    participant = get_object_or_404(Participant, user=request.user, session=session)
+    session = roomcache.get_session_or_404(room_code)
+    participant = roomcache.get_member_or_404(session['id'], request.user.id)
 
     # Only pending participants see waiting room
-    if participant.status != 'pending':
+    if participant['status'] != 'pending':
         return redirect('session_room', room_code=room_code)
 
     context = {
@@ -549,15 +590,18 @@ def waiting_room(request, room_code):
 @require_http_methods(["POST"])
 def toggle_discoverability(request, room_code):
     """Toggle whether a session is discoverable in Available Sessions (host only)."""
-    session = get_object_or_404(Session, room_code=room_code)
+    cached = roomcache.get_session_or_404(room_code)
     
     # Only host can toggle
-    if session.host != request.user:
+    if cached['host_id'] != request.user.id:
         return JsonResponse({'error': 'Only the host can change session visibility'}, status=403)
     
+    session = get_object_or_404(Session, id=cached['id'])
     # Toggle the discoverability
     session.is_discoverable = not session.is_discoverable
     session.save()
+    push_session_settings(session)
+    notify_lobby()
     
     status_text = "visible in Available Sessions" if session.is_discoverable else "hidden from Available Sessions"
     
@@ -571,10 +615,143 @@ def toggle_discoverability(request, room_code):
 @login_required
 def check_status(request, room_code):
     """Check participant status (for polling in waiting room)."""
-    session = get_object_or_404(Session, room_code=room_code)
-    participant = get_object_or_404(Participant, user=request.user, session=session)
+    session = roomcache.get_session_or_404(room_code)
+    participant = roomcache.get_member_or_404(session['id'], request.user.id)
 
+    status = participant['status']
     return JsonResponse({
-        'status': participant.status,
-        'message': f'Status: {participant.get_status_display()}'
+        'status': status,
+        'message': f'Status: {STATUS_LABELS.get(status, status)}'
     })
+
+
+# ========== AUDIO MESSAGES ==========
+
+@login_required
+@require_http_methods(["POST"])
+def upload_audio(request, room_code):
+    """Store a recorded audio clip and announce it to the room."""
+    session = roomcache.get_session_or_404(room_code, active_only=True)
+
+    if not is_member(session['id'], request.user):
+        return JsonResponse({'error': 'Only participants can send audio messages'}, status=403)
+
+    # Reject oversized clips before the upload handlers spool the body
+    max_bytes = settings.AUDIO_MESSAGE_MAX_BYTES
+    if int(request.META.get('CONTENT_LENGTH') or 0) > max_bytes + 64 * 1024:
+        return JsonResponse({'error': 'Audio message is too large'}, status=413)
+
+    clip = request.FILES.get('audio')
+    if clip is None:
+        return JsonResponse({'error': 'Missing audio file'}, status=400)
+    if clip.size > max_bytes:
+        return JsonResponse({'error': 'Audio message is too large'}, status=413)
+    if not (clip.content_type or '').startswith('audio/'):
+        return JsonResponse({'error': 'Unsupported file type'}, status=400)
+
+    try:
+        duration = max(float(request.POST.get('duration', 0)), 0)
+    except (ValueError, TypeError):
+        duration = 0
+
+    # FileField.save copies the upload to storage chunk by chunk
+    audio = AudioMessage.objects.create(
+        session_id=session['id'],
+        sender=request.user,
+        sender_name=request.user.username,
+        audio_file=clip,
+        duration=duration,
+    )
+
+    event = {
+        'id': audio.id,
+        'url': reverse('audio_message_file', args=[audio.id]),
+        'duration': audio.duration,
+        'sender': audio.sender_name,
+    }
+    group_send(room_group_name(room_code), wire.frame_event('audio_message', {'type': 'audio_message', **event}))
+
+    return JsonResponse({'status': 'ok', 'audio': event})
+
+
+@login_required
+@require_http_methods(["GET", "HEAD"])
+def audio_message_file(request, message_id):
+    """Serve an audio message to participants of its session, with Range support."""
+    audio = get_object_or_404(AudioMessage, id=message_id)
+
+    if not is_member(audio.session_id, request.user):
+        raise Http404
+
+    return ranged_file_response(request, audio.audio_file)
+
+
+# ========== CHAT HISTORY ==========
+
+@login_required
+@require_http_methods(["GET"])
+def chat_history(request, room_code):
+    """Get a page of chat and audio messages, newest page first."""
+    session = roomcache.get_session_or_404(room_code)
+
+    if not is_member(session['id'], request.user):
+        return JsonResponse({'error': 'Only participants can read the chat history'}, status=403)
+
+    cursor = request.GET.get('before') or None
+    if cursor and history.decode_cursor(cursor) is None:
+        return JsonResponse({'error': 'Invalid cursor'}, status=400)
+
+    try:
+        limit = int(request.GET.get('limit', history.DEFAULT_PAGE_SIZE))
+    except (ValueError, TypeError):
+        limit = history.DEFAULT_PAGE_SIZE
+    limit = min(max(limit, 1), history.MAX_PAGE_SIZE)
+
+    messages, next_cursor = history.history_page(session['id'], cursor, limit)
+    return JsonResponse({
+        'status': 'ok',
+        'messages': messages,
+        'next_cursor': next_cursor
+    })
+
+
+# ========== USER SEARCH ==========
+
+@login_required
+@require_http_methods(["GET"])
+def search_users(request, room_code):
+    """Find discoverable users to invite by username prefix (host only)."""
+    session = roomcache.get_session_or_404(room_code)
+
+    if session['host_id'] != request.user.id:
+        return JsonResponse({'error': 'Only the host can search for users to invite'}, status=403)
+
+    try:
+        limit = int(request.GET.get('limit', usersearch.DEFAULT_PAGE_SIZE))
+    except (ValueError, TypeError):
+        limit = usersearch.DEFAULT_PAGE_SIZE
+    limit = min(max(limit, 1), usersearch.MAX_PAGE_SIZE)
+
+    # Users already in the session or with a pending request can't be invited
+    exclude_ids = Participant.objects.filter(
+        session_id=session['id'], status__in=seats.SEAT_STATUSES, user__isnull=False
+    ).values_list('user_id', flat=True)
+
+    usernames, next_after = usersearch.search_page(
+        request.GET.get('q', '').strip(),
+        after=request.GET.get('after') or None,
+        exclude_user_ids=exclude_ids,
+        limit=limit
+    )
+    return JsonResponse({
+        'status': 'ok',
+        'users': usernames,
+        'next_after': next_after
+    })
+
+
+def prometheus_metrics(request):
+    """Process metrics for Prometheus; only routed when METRICS is enabled."""
+    if not metrics.authorized(request):
+        return HttpResponse('Forbidden', status=403, content_type='text/plain')
+    return HttpResponse(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -0,0 +1,96 @@
+"""
+Frame encoding for the room WebSocket protocol.
+
+Each connection picks a codec when it opens, by offering one of the
+`screendial.<codec>` WebSocket subprotocols: JSON text frames (the default,
+used by the browser client), or msgpack or CBOR binary frames.
+
+Events fanned out to a room carry their frame already encoded, so it is
+serialized once per group_send rather than once per recipient. The JSON
+encoding is always included. The binary encodings are included for every
+codec that a connection in the sending process uses. A recipient in another
+process whose codec is missing re-encodes from the JSON.
+"""
+import itertools
+import uuid
+from collections import Counter, namedtuple
+
+import cbor2
+import msgpack
+import ujson
+
+SUBPROTOCOL_PREFIX = 'screendial.'
+
+Codec = namedtuple('Codec', 'name binary dumps loads')
+
+CODECS = {
+    'json': Codec(
+        'json', False,
+        lambda frame: ujson.dumps(frame, ensure_ascii=False, escape_forward_slashes=False),
+        ujson.loads,
+    ),
+    'msgpack': Codec('msgpack', True, msgpack.packb, lambda data: msgpack.unpackb(data, raw=False)),
+    'cbor': Codec('cbor', True, cbor2.dumps, cbor2.loads),
+}
+JSON = CODECS['json']
+
+# Open connections in this process per codec name
+_in_use = Counter()
+
+# event_ids are unique across processes: a per-process prefix and a counter
+_EVENT_ID_PREFIX = uuid.uuid4().hex[:12]
+_event_ids = itertools.count(1)
+
+
+def negotiate(subprotocols):
+    """
+    Return (codec, subprotocol) for the first offered subprotocol that names
+    a known codec, or (JSON, None) if there is none.
+    """
+    for subprotocol in subprotocols:
+        name = subprotocol[len(SUBPROTOCOL_PREFIX):] if subprotocol.startswith(SUBPROTOCOL_PREFIX) else None
+        if name in CODECS:
+            return CODECS[name], subprotocol
+    return JSON, None
+
+
+def acquire(codec):
+    _in_use[codec.name] += 1
+
+
+def release(codec):
+    _in_use[codec.name] -= 1
+    if _in_use[codec.name] <= 0:
+        del _in_use[codec.name]
+
+
+def encode_all(frame):
+    """`frame` in JSON and in every other codec open in this process."""
+    encoded = {'json': JSON.dumps(frame)}
+    for name in _in_use:
+        if name not in encoded:
+            encoded[name] = CODECS[name].dumps(frame)
+    return encoded
+
+
+def frame_event(handler, frame, **fields):
+    """
+    A channel-layer event for consumer method `handler` that delivers
+    `frame`, pre-encoded. Extra `fields` are for the handler itself (e.g.
+    routing), and are not sent. Every copy of the event carries the same
+    event_id, which lets receivers in one process tell it is one event.
+    """
+    return {'type': handler, 'encoded': encode_all(frame), 'event_id': new_event_id(), **fields}
+
+
+def new_event_id():
+    """An id no other event, in this process or any other, has."""
+    return f'{_EVENT_ID_PREFIX}:{next(_event_ids)}'
+
+
+def encoded(event, codec):
+    """The frame of a frame_event() as `codec` bytes or text."""
+    data = event['encoded'].get(codec.name)
+    if data is None:
+        data = codec.dumps(JSON.loads(event['encoded']['json']))
+    return data
@@ -57,6 +57,16 @@ CHANNEL_LAYERS = {
     }
 }
 
+# To run several daphne/uvicorn workers on one host without a broker, use
+# the Unix socket layer; every worker must share the same directory:
+#
+# CHANNEL_LAYERS = {
+#     "default": {
+#         "BACKEND": "core.layers.UnixSocketChannelLayer",
+#         "CONFIG": {"path": "/tmp/screendial-channels"},
+#     }
+# }
+
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -65,6 +75,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'core.metrics.MetricsMiddleware',
 ]
 
 ROOT_URLCONF = 'myproject.urls'
@@ -94,6 +105,16 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        'OPTIONS': {
+            # Take the write lock when a transaction starts, so concurrent
+            # seat changes (core.seats) queue up instead of failing as locked
+            'transaction_mode': 'IMMEDIATE',
+            'timeout': 20,
+        },
+        # A file, not shared-cache memory, so concurrent tests wait for locks
+        'TEST': {
+            'NAME': BASE_DIR / 'test_db.sqlite3',
+        },
     }
 }
 
@@ -134,11 +155,107 @@ USE_TZ = True
 
 STATIC_URL = 'static/'
 
+# Uploaded files (audio messages)
+MEDIA_URL = 'media/'
+MEDIA_ROOT = BASE_DIR / 'media'
+
+# Largest audio message clip accepted by the upload endpoint
+AUDIO_MESSAGE_MAX_BYTES = 10 * 1024 * 1024
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
+# Command hints: maximum typos (edit distance) tolerated by fuzzy matching
+HINT_FUZZY_MAX_DISTANCE = 2
+
+# Seconds a worker reuses its compiled hint catalog before reading it again,
+# so catalog changes made in other processes reach every worker
+HINT_CATALOG_SECONDS = 30
+
+# How long the shared available sessions listing may be served from cache
+AVAILABLE_SESSIONS_CACHE_SECONDS = 10
+
+# Chat messages are saved in batches: flushed every BATCH_SIZE messages or
+# FLUSH_INTERVAL seconds, holding at most MAX_PENDING unsaved messages
+CHAT_WRITE_BEHIND = {
+    'BATCH_SIZE': 200,
+    'FLUSH_INTERVAL': 1.0,
+    'MAX_PENDING': 5000,
+}
+
+# Presence changes are written and pushed to rooms at most every
+# FLUSH_INTERVAL seconds; pages send heartbeats every HEARTBEAT_INTERVAL
+# seconds and sockets silent for STALE_AFTER seconds count as offline
+PRESENCE = {
+    'FLUSH_INTERVAL': 1.0,
+    'HEARTBEAT_INTERVAL': 15,
+    'STALE_AFTER': 45,
+}
+
+# With ENABLED on, WebRTC signals from one client to one target are collected
+# for WINDOW seconds and delivered as a single frame. Off by default: every
+# offer, answer and ICE candidate would otherwise wait up to WINDOW.
+SIGNAL_BATCHING = {
+    'ENABLED': False,
+    'WINDOW': 0.02,
+}
+
+# Screen shares reach viewers through a relay tree: the host sends to at
+# most ROOT_FANOUT viewers and each viewer forwards to as many others as
+# FANOUT allows for its connection quality. Only used with the in-memory
+# channel layer; across workers viewers pull from the host directly.
+RELAY_TREE = {
+    'ENABLED': True,
+    'ROOT_FANOUT': 4,
+    'FANOUT': {'high': 3, 'medium': 1, 'low': 0},
+}
+
+# Counters and latency histograms served in the Prometheus text format at
+# /metrics; with ENABLED off nothing is recorded and the URL is not routed.
+# Until TOKEN is set nobody may read it; after that, scrapers sending
+# 'Authorization: Bearer <TOKEN>' and logged-in staff users may.
+METRICS = {
+    'ENABLED': True,
+    'TOKEN': '',
+}
+
+# Room code -> session and (session, user) -> participant lookups are served
+# from the cache for up to TIMEOUT seconds and dropped whenever a row changes.
+# ENABLED None turns it on when the cache is shared by every worker, or when
+# everything runs in one process as with the InMemoryChannelLayer above, so
+# the shipped setup uses it with the default LocMemCache. Running several
+# workers (UnixSocketChannelLayer) needs a shared CACHES backend such as
+# Redis or Memcached for it to stay on.
+ROOM_CACHE = {
+    'ENABLED': None,
+    'TIMEOUT': 300,
+}
+
+# Session WebSockets authenticate with a signed token from the room page,
+# valid for MAX_AGE seconds and renewed with every heartbeat ack
+CONNECT_TOKENS = {
+    'MAX_AGE': 120,
+}
+
+# The last CAPACITY chat, audio, join and participant events of each room are
+# kept for RETAIN seconds after its last socket closes, so reconnecting pages
+# get what they missed
+ROOM_EVENTS = {
+    'CAPACITY': 500,
+    'RETAIN': 120,
+}
+
+# Each WebSocket queues at most MAX_ITEMS outgoing frames, dropping bulk and
+# then chat frames when full; a socket whose backlog stays at SLOW_THRESHOLD
+# or more for SLOW_TIMEOUT seconds is closed
+OUTBOUND_QUEUE = {
+    'MAX_ITEMS': 256,
+    'SLOW_THRESHOLD': 128,
+    'SLOW_TIMEOUT': 10.0,
+}
+
 # Authentication URLs
 LOGIN_REDIRECT_URL = 'profile'
 LOGIN_URL = 'login'